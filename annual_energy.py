@@ -0,0 +1,232 @@
+'''
+This module places a turbine for a whole year of flows rather than for one river measurement. The river
+conditions over a year are reduced to a set of weighted flow states (from a flow-duration curve or from a
+historical record), and one fixed position (and optionally the radius and width) is chosen to maximise the
+expected annual energy. With a generator load each state is scored at the turbine's operating point
+against the load (see operating_point.py), the speed it would settle at in that flow. Without one the RPM
+is assumed to follow the flow ideally and each state is scored at its best RPM - for many breastshot
+designs that is a power above what the flow carries (see evaluation.py), so the states whose power is
+over the hydraulic power are reported as limited.
+
+Without a load each candidate position is evaluated against every flow state and RPM in one call, the
+states being stacked into one array-valued river.
+
+Parameters:
+----------------
+    turbine - object: breastTurbine or underTurbine object, moved to the optimum
+    states - list: river objects of the flow states
+    weights - array: the fraction of the year spent in each state
+    geometry - bool: optimise the radius and width as well as the position
+    load - object: optional operating_point.generator_load the turbine drives
+    trace - object: optional traces.trace_writer recording each iteration
+
+Methods:
+----------------
+    scaled_river - the river of a fixed width channel carrying a multiple of a reference river's flow
+    states_from_duration_curve - flow states from a flow-duration curve and a reference river
+    states_from_record - flow states from a record of river measurements
+    state_powers - the power of the turbine in each flow state, at its operating point or best RPM
+    annual_energy - the expected annual energy of the turbine in kWh
+    optimise_annual - finds the position (and geometry) maximising the expected annual energy
+
+Returns:
+----------------
+    optimise_annual - dict: the position (and geometry), the expected annual energy, the mean power, the
+                    power in each state and whether it is above the hydraulic power of the state
+
+'''
+
+# imports
+import copy
+import numpy as np
+
+from river_class import river_obj, stack_rivers
+from feasibility import feasible_box
+from evaluation import RPM_RANGE, turbine_power, limited
+from operating_point import find_operating_point
+
+HOURS_PER_YEAR = 8760
+
+# the bounds of the radius and width when the geometry is optimised
+GEOMETRY_BOUNDS = {'radius': (0.3, 1.0), 'width': (0.5, 2.0)}
+
+
+def scaled_river(river, ratio):
+    '''
+    the river carrying ratio times the flow of the reference river in the same channel - the depth and
+    velocity scale as for a wide fixed width channel under Manning's equation (depth ~ Q^0.6, velocity ~ Q^0.4)
+    '''
+    return river_obj(river.width, river.depth * ratio**0.6, river.velocity * ratio**0.4, head=river.head)
+
+
+def states_from_duration_curve(exceedance, flow, river, n_states=10):
+    '''
+    flow states from a flow-duration curve (the fraction of time each flow rate in m^3/s is exceeded) -
+    the curve is split into n_states bands of equal time, and the river of each band's flow is scaled
+    from the reference river (scaled_river)
+    '''
+    exceedance = np.asarray(exceedance, dtype=float)
+    flow = np.asarray(flow, dtype=float)
+    order = np.argsort(exceedance)
+    exceedance, flow = exceedance[order], flow[order]
+
+    # the flow at the middle of each band of equal time
+    edges = np.linspace(0, 1, n_states + 1)
+    middle = (edges[1:] + edges[:-1]) / 2
+    band_flow = np.interp(middle, exceedance, flow)
+
+    states = [scaled_river(river, ratio) for ratio in band_flow / river.vol_flow_rate]
+    weights = np.diff(edges)
+    return states, weights
+
+
+def states_from_record(width, depth, velocity, head=0, n_states=10):
+    '''
+    flow states from a record of river measurements (e.g. daily) - the record is split into n_states
+    groups of similar flow rate, each state being the mean of its group weighted by the time in it
+    '''
+    width, depth, velocity, head = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (width, depth, velocity, head)])
+    flow = width * depth * velocity
+
+    # groups of equal numbers of records by flow rate
+    groups = np.array_split(np.argsort(flow), min(n_states, len(flow)))
+
+    states = [river_obj(width[g].mean(), depth[g].mean(), velocity[g].mean(), head=head[g].mean()) for g in groups]
+    weights = np.array([len(g) for g in groups]) / len(flow)
+    return states, weights
+
+
+def state_powers(turbine, states, RPM=None, load=None):
+    '''
+    the power of the turbine in each flow state at its operating point against the load, or without a
+    load at its best RPM (at RPM if given) - the turbine's own river is put back afterwards
+    '''
+    if load is not None:
+        # a copy of the turbine in each state, solved together
+        turbines = []
+        for state in states:
+            turbines.append(copy.deepcopy(turbine))
+            turbines[-1].river = state
+        return find_operating_point(turbines, load)[1]
+
+    river = turbine.river
+    RPMs = np.atleast_1d(RPM_RANGE if RPM is None else RPM)
+
+    try:
+        # the power at every RPM (rows) in every state (columns)
+        turbine.river = stack_rivers(states)
+        power = turbine_power(turbine, RPMs)
+    finally:
+        turbine.river = river
+
+    return np.max(power, axis=0)
+
+
+def annual_energy(turbine, states, weights, RPM=None, load=None):
+    # the expected annual energy in kWh
+    return HOURS_PER_YEAR * np.dot(weights, state_powers(turbine, states, RPM, load)) / 1000
+
+
+def _bounds(turbine, states, geometry):
+    # the position bounds covering every state, then the geometry bounds
+    if type(turbine).__name__ == 'underTurbine':
+        bounds = [(turbine.barrel_radius, GEOMETRY_BOUNDS['radius'][1] if geometry else turbine.radius)]
+    else:
+        radius = GEOMETRY_BOUNDS['radius'][1] if geometry else turbine.radius
+        boxes = [feasible_box(state, radius) for state in states]
+        bounds = [(max(0, min(b[0][0] for b in boxes)), max(b[0][1] for b in boxes)),
+                  (max(-min(state.head for state in states), min(b[1][0] for b in boxes)), max(b[1][1] for b in boxes))]
+    if geometry:
+        bounds += [GEOMETRY_BOUNDS['radius'], GEOMETRY_BOUNDS['width']]
+    return bounds
+
+
+def optimise_annual(turbine, states, weights, geometry=False, RPM=None, load=None, trace=None):
+    '''
+    find the fixed position (and with geometry the radius and width) of the turbine maximising the
+    expected annual energy over the flow states - the turbine is left at the optimum
+    '''
+    import scipy.optimize as opt
+
+    weights = np.asarray(weights, dtype=float)
+    weights = weights / weights.sum()
+
+    if type(turbine).__name__ == 'underTurbine':
+        names = ['y_centre']
+    else:
+        names = ['x_centre', 'y_centre']
+    if geometry:
+        names += ['radius', 'width']
+
+    def fun(params):
+        for name, value in zip(names, params):
+            setattr(turbine, name, value)
+        try:
+            return -np.dot(weights, state_powers(turbine, states, RPM, load))
+        except ValueError:
+            # the turbine can not be placed there (e.g. an undershot turbine below the water surface)
+            return 0
+
+    callback = None
+    if trace is not None:
+        fun = trace.objective(fun)
+        callback = trace.callback(cache_hits=lambda: getattr(turbine, 'stage_hits', 0))
+
+    bounds = _bounds(turbine, states, geometry)
+    x0 = np.clip([getattr(turbine, name) for name in names], [b[0] for b in bounds], [b[1] for b in bounds])
+    res = opt.minimize(fun, x0, bounds=bounds, method='nelder-mead', callback=callback)
+
+    if trace is not None:
+        trace.flush()
+
+    # move the turbine to the optimum
+    mean_power = -fun(res.x)
+    power = state_powers(turbine, states, RPM, load)
+    model = 'undershot' if type(turbine).__name__ == 'underTurbine' else 'breastshot'
+
+    result = dict(zip(names, res.x))
+    result.update(mean_power=mean_power, annual_energy=HOURS_PER_YEAR * mean_power / 1000, power=power,
+                  limited=limited(power, stack_rivers(states), model))
+    return result
+
+
+if __name__ == "__main__":
+    import time
+    from breastshot_calcs import breastTurbine
+    from evaluation import hydraulic_power
+    from operating_point import generator_load
+
+    # the test channel with a flow-duration curve around its measured flow
+    river = river_obj(width=0.77, depth=0.3, velocity=1.5, head=2)
+    exceedance = np.array([0.01, 0.1, 0.3, 0.5, 0.7, 0.9, 0.99])
+    flow = river.vol_flow_rate * np.array([3, 1.8, 1.2, 0.9, 0.6, 0.35, 0.2])
+    states, weights = states_from_duration_curve(exceedance, flow, river, n_states=8)
+
+    # the generator of the test rig (gear ratio from testData.csv)
+    load = generator_load(speed=[0, 500], torque=[0, 40], gear_ratio=231.2 / 14.5)
+
+    # the position optimised for the measured flow only
+    turbine = breastTurbine(river, x_centre=0.8, y_centre=-0.1)
+    start = time.time()
+    turbine.optimise()
+    single = time.time() - start
+    print('single flow optimum (%.2f, %.2f): %.0f kWh/yr over the flow states against the generator (%.2f s)'
+          % (turbine.x_centre, turbine.y_centre, annual_energy(turbine, states, weights, load=load), single))
+
+    # the position optimised for the year against the generator
+    turbine = breastTurbine(river, x_centre=0.8, y_centre=-0.1)
+    start = time.time()
+    result = optimise_annual(turbine, states, weights, load=load)
+    print('annual optimum (%.2f, %.2f): %.0f kWh/yr, %d of %d states above the hydraulic power (%.2f s)'
+          % (result['x_centre'], result['y_centre'], result['annual_energy'], result['limited'].sum(), len(states),
+             time.time() - start))
+
+    # with the RPM following the flow ideally (the best RPM in every state)
+    turbine = breastTurbine(river, x_centre=0.8, y_centre=-0.1)
+    result = optimise_annual(turbine, states, weights)
+    print('ideal speed optimum (%.2f, %.2f): %.0f kWh/yr, %d of %d states above the hydraulic power'
+          % (result['x_centre'], result['y_centre'], result['annual_energy'], result['limited'].sum(), len(states)))
+
+    # the ceiling - the hydraulic energy of the flow states over the year
+    available = hydraulic_power(stack_rivers(states), 'breastshot')
+    print('the flow carries %.0f kWh/yr' % (HOURS_PER_YEAR * np.dot(weights, available) / 1000))
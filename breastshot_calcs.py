@@ -1,11 +1,25 @@
 # import modules
 import numpy as np
-import matplotlib.pyplot as plt
 import math
-import scipy.optimize as opt
-import pandas as pd
 
-class breastTurbine():
+from stages import staged, superpose_blades
+from feasibility import feasible, feasible_box
+
+__all__ = ['np', 'math', 'breastTurbine']
+
+# plotting, pandas and scipy are only imported when first used, so numeric use of the model (and every
+# pool worker) does not load them - they are still available as module attributes, but are left out of
+# __all__ so that import * does not load them either
+_LAZY = {'plt': 'matplotlib.pyplot', 'opt': 'scipy.optimize', 'pd': 'pandas'}
+
+def __getattr__(name):
+    if name in _LAZY:
+        import importlib
+        return importlib.import_module(_LAZY[name])
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+class breastTurbine(staged):
     '''
     This class will contain all the calculations for the breastshot turbine
 
@@ -24,19 +38,32 @@ class breastTurbine():
         width - float: width of the turbine
         x_centre - float: x coordinate of the centre of the turbine
         y_centre - float: y coordinate of the centre of the turbine
-        river - object: river object containing the river parameters
+        river - object: river object containing the river parameters (array-valued for many river conditions)
 
     Methods:
     ----------------
+        find_geometry - calculates the coordinates, blade separation and max bucket volume of the turbine
+        find_feasible - rejects positions where the turbine can not reach the river (see feasibility.py)
         find_intersects - calculates the coordinates of the intersects between the
                             river and the radius of the turbine
+        find_intersects_array - the first and last intersects for each condition of an array-valued river
         find_theta_range - calculates the range of useful theta
+        find_theta_range_array - the range of useful theta for each condition of an array-valued river
         find_filling_rate - calculates the filling rate of the turbine at each theta
         find_vol - calculates the volume of water in the turbine bucket at each theta
         find_centre_mass - calculates the centre of mass of the water at each theta (moment arm)
         find_pot_power - calculates the potential power of the turbine at each theta
         find_imp_power - calculates the impulse power of the turbine at each theta
         find_tot_power - calculates the total power of the turbine at each theta
+        analysis_blades - the average power for a range of blade counts from one shared evaluation
+
+    The methods are run as stages (see stages.py) - changing an input only re-runs the stages that depend
+    on it the next time analysis is called, e.g. a new RPM re-uses the intersections and centre of mass.
+
+    An array-valued river is evaluated in one call - the intersections and theta range are found for every
+    river condition together and the results have the river axes after any RPM axes (RPM..., river..., theta).
+    With an array-valued river x_centre and y_centre can also be arrays of the river's shape, one position
+    for each river condition (e.g. the turbines of many cascade layouts).
 
     Returns:
     ----------------
@@ -48,6 +75,22 @@ class breastTurbine():
 
     '''
 
+    # the inputs of the analysis and the stages that depend on them
+    INPUTS = ('river', 'radius', 'width', 'num_blades', 'x_centre', 'y_centre', 'RPM')
+    STAGES = {
+        'geometry': ('find_geometry', ('radius', 'width', 'num_blades', 'x_centre', 'y_centre')),
+        'feasible': ('find_feasible', ('geometry', 'river')),
+        'intersects': ('find_intersects', ('geometry', 'river', 'feasible')),
+        'theta_range': ('find_theta_range', ('intersects',)),
+        'filling_rate': ('find_filling_rate', ('theta_range', 'RPM')),
+        'vol': ('find_vol', ('filling_rate',)),
+        'centre_mass': ('find_centre_mass', ('theta_range',)),
+        'pot_power': ('find_pot_power', ('vol', 'centre_mass')),
+        'imp_power': ('find_imp_power', ('filling_rate',)),
+        'tot_power': ('find_tot_power', ('pot_power', 'imp_power')),
+        'avg_power': ('find_avg_power', ('tot_power',)),
+    }
+
     def __init__(self, river, radius = 0.504, width = 1.008, num_blades = 6, x_centre = 0, y_centre = 0, RPM=15): 
 
         self.radius = radius
@@ -56,46 +99,131 @@ class breastTurbine():
         self.river = river
         self.x_centre = x_centre 
         self.y_centre = y_centre 
-        self.RPM = RPM
 
+        self.theta = np.linspace(0, 2*np.pi, 100)
+        self.g = 9.81
+
+        # the number of positions rejected by the feasibility test
+        self.feasibility_rejects = 0
+
+        self.run_stage('geometry')
+        self.set_RPM(RPM)
+
+    def find_geometry(self):
+        '''
+        calculate the coordinates of the turbine, the blade separation and the max volume of a bucket
+        '''
         self.blade_sep = 2*np.pi/self.num_blades
-        
 
-        self.theta = np.linspace(0, 2*np.pi, 100)
-        self.x = self.radius * np.cos(self.theta) + self.x_centre
-        self.y = self.radius * np.sin(self.theta) + self.y_centre
+        # a position per river condition gives the coordinates of each turbine along the last axis
+        self.x = self.radius * np.cos(self.theta) + np.asarray(self.x_centre)[..., None]
+        self.y = self.radius * np.sin(self.theta) + np.asarray(self.y_centre)[..., None]
 
-        self.g = 9.81
-        self.max_vol = 0.06298815822 * radius * width # m^3
+        self.max_vol = 0.06298815822 * self.radius * self.width # m^3
         # the max vol will scale proportionally with the radius * width (constant determined from the max volume of the turbine)
+        return 0
 
-        omega = 2 * np.pi * RPM / 60
+    def set_RPM(self, RPM):
+        '''
+        set the RPM of the turbine and the RPM dependent angular velocities
+
+        RPM can be an array, the RPM dependent results then have a leading RPM axis
+        '''
+        if not np.isscalar(RPM):
+            RPM = np.asarray(RPM, dtype=float)
+
+        self.RPM = RPM
+        self.omega = 2 * np.pi * RPM / 60
 
         # calculate dtheta/dt
         dtheta = self.theta[1] - self.theta[0]
         dt = (60/RPM) / len(self.theta)
         self.dthetadt = dtheta / dt
+        return 0
+
+    def _rpm_axes(self, value):
+        # an RPM dependent value reshaped to broadcast over the river conditions and theta
+        return np.reshape(value, np.shape(value) + (1,) * (len(self.river.shape) + 1))
 
+    def find_feasible(self):
+        '''
+        reject the position before the intersection scan if the rotor can not reach the nappe (feasibility.py)
+        '''
+        if self.river.shape:
+            # the test is for one nappe, the scan of many river conditions prunes its own points
+            return 0
+        if feasible(self.river, self.x_centre, self.y_centre, self.radius):
+            return 0
+        self.feasibility_rejects += 1
+        return 1
 
     def find_intersects(self):
         # find the intersection of the turbine and the river
         # find the x and y coordinates of the intersection and the corresponding angles
-        x_intersect = []
-        y_intersect = []
+        self.run_stage('geometry')
 
         # intersection occurs when both the x and y differences between the turbine and river are approximately 0
-        for i, xval in enumerate(self.river.x_nappe):
-            for j, xxval in enumerate(self.x):
-                if abs(xval - xxval) < 0.1 and abs(self.y[j] - self.river.y_nappe[i]) < 0.1:
-                    x_intersect.append(self.x[j])
-                    y_intersect.append(self.y[j])
-
-        self.x_intersect = x_intersect
-        self.y_intersect = y_intersect
+        x_nappe = self.river.x_nappe
+        y_nappe = self.river.y_nappe
+
+        if self.river.shape:
+            return self.find_intersects_array(x_nappe, y_nappe)
+
+        # only the river points inside the turbine's bounding box (+ 0.1) can intersect, so the rest are
+        # dropped before comparing (the small margin keeps the comparison below exact)
+        margin = 0.1 + 1e-9
+        rows = np.nonzero((x_nappe > self.x.min() - margin) & (x_nappe < self.x.max() + margin) &
+                          (y_nappe > self.y.min() - margin) & (y_nappe < self.y.max() + margin))[0]
+
+        # compare the remaining river points (rows) with every turbine point (columns) at once, the row
+        # major order of nonzero keeps the intersects in river order
+        close = (np.abs(x_nappe[rows, None] - self.x[None, :]) < 0.1) & (np.abs(self.y[None, :] - y_nappe[rows, None]) < 0.1)
+        _, j = np.nonzero(close)
+
+        self.x_intersect = list(self.x[j])
+        self.y_intersect = list(self.y[j])
         return 0
-    
+
+    def find_intersects_array(self, x_nappe, y_nappe):
+        '''
+        the first and last intersects (as find_intersects) for every river condition - x_intersect and
+        y_intersect are (first, last) arrays of the river shape, nan where the turbine misses the river
+        '''
+        shape = self.river.shape
+        x_nappe = x_nappe.reshape(-1, x_nappe.shape[-1])
+        y_nappe = y_nappe.reshape(-1, y_nappe.shape[-1])
+
+        # the turbine points met by each river (the same turbine for all, or one position per river)
+        x = np.broadcast_to(self.x, shape + self.x.shape[-1:]).reshape(len(x_nappe), -1)
+        y = np.broadcast_to(self.y, shape + self.y.shape[-1:]).reshape(len(y_nappe), -1)
+
+        # the nappe points of every river inside its turbine's bounding box (+ 0.1), in river then point order
+        margin = 0.1 + 1e-9
+        r, n = np.nonzero((x_nappe > x.min(axis=1, keepdims=True) - margin) & (x_nappe < x.max(axis=1, keepdims=True) + margin) &
+                          (y_nappe > y.min(axis=1, keepdims=True) - margin) & (y_nappe < y.max(axis=1, keepdims=True) + margin))
+        close = (np.abs(x_nappe[r, n][:, None] - x[r]) < 0.1) & (np.abs(y[r] - y_nappe[r, n][:, None]) < 0.1)
+        hit = close.any(axis=1)
+        r, close = r[hit], close[hit]
+
+        # the first intersect is the first close turbine point of the first close nappe point of each river,
+        # the last is the last close turbine point of its last close nappe point
+        rivers, first = np.unique(r, return_index=True)
+        last = np.append(first, len(r))[1:] - 1
+        j_first = np.argmax(close[first], axis=1)
+        j_last = close.shape[1] - 1 - np.argmax(close[last, ::-1], axis=1)
+
+        self.x_intersect = np.full((2, len(x_nappe)), np.nan)
+        self.y_intersect = np.full((2, len(x_nappe)), np.nan)
+        self.x_intersect[:, rivers] = x[rivers, j_first], x[rivers, j_last]
+        self.y_intersect[:, rivers] = y[rivers, j_first], y[rivers, j_last]
+        self.x_intersect = self.x_intersect.reshape((2,) + shape)
+        self.y_intersect = self.y_intersect.reshape((2,) + shape)
+        return 0
+
     def find_theta_range(self):
         # calculate theta_entry and theta_exit (alpha 1,2)
+        if self.river.shape:
+            return self.find_theta_range_array()
  
         
         # check that theta_entry is less than pi/2
@@ -126,46 +254,63 @@ class breastTurbine():
         self.theta_range = theta_exit - theta_entry
         return 0
 
+    def find_theta_range_array(self):
+        '''
+        theta_entry and theta_exit (as find_theta_range) for every river condition, nan where the turbine
+        misses the river - fails only if it misses every river condition
+        '''
+        (x_first, x_last), (y_first, y_last) = self.x_intersect, self.y_intersect
+        self.in_river = ~np.isnan(x_first)
+        if not np.any(self.in_river):
+            return 1
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            entry = np.arctan(np.abs(self.x_centre - x_first) / np.abs(self.y_centre - y_first))
+            exit = math.pi + np.arctan(np.abs(self.x_centre - x_last) / np.abs(self.y_centre - y_last))
+        theta_entry = np.where(y_first < self.y_centre, math.pi/2, entry)
+        theta_exit = np.where(x_last > self.x_centre, math.pi, exit)
+
+        self.theta_entry = np.where(self.in_river, theta_entry, np.nan)
+        self.theta_exit = np.where(self.in_river, theta_exit, np.nan)
+        self.theta_range = self.theta_exit - self.theta_entry
+        return 0
+
     
     def find_filling_rate(self):
         '''
         calculate the filling rate of the bucket at each theta and emptying rate
+
+        the rates are calculated for every theta at once, with a leading axis when the RPM is an array
         '''
-        filling_rate = np.zeros(len(self.theta))
+        theta = self.theta
         RPM = self.RPM
 
         # calculate the angular velocity of the turbine in radians per second
         self.omega = 2 * np.pi * RPM / 60
+        omega = self._rpm_axes(self.omega)
+        theta_entry = np.asarray(self.theta_entry)[..., None]
+        head = np.asarray(self.river.head)[..., None]
+        nappe_height = np.asarray(self.river.nappe_height)[..., None]
+        y_centre = np.asarray(self.y_centre)[..., None]
 
-        for i, theta in enumerate(self.theta):
-            if theta >= self.theta_entry and theta <= self.blade_sep + np.pi/2:
-            
-                # calculate the falling velocity of the water and blade
-                blade_v = self.omega * self.radius * np.sin(theta)
-
-                fall_v = np.sqrt(2 * self.g * (-self.y_centre + self.river.head  + self.river.nappe_height/2 - self.radius * np.cos(theta)))
+        # the bucket fills between theta_entry and the next blade passing 90 degrees
+        filling = (theta >= theta_entry) & (theta <= self.blade_sep + np.pi/2)
 
-                if theta > self.blade_sep:
-                    fill = self.width * self.radius * (np.sin(theta - self.blade_sep)) * (fall_v - blade_v)
-                else:
-                    # calculate the filling rate in m^3/s at each theta (the flow is split between current and next blade)
-                    fill = self.width * self.radius * (np.sin(theta) ) * (fall_v - blade_v) #- np.sin(theta - self.blade_sep)
+        # calculate the falling velocity of the water and blade
+        blade_v = omega * self.radius * np.sin(theta)
 
-                # remove nan values
-                if np.isnan(fill):
-                    fill = 0
-                elif fill < 0:
-                    fill = 0
-                filling_rate[i] = fill
+        with np.errstate(invalid='ignore'):
+            fall_v = np.sqrt(2 * self.g * (-y_centre + head  + nappe_height/2 - self.radius * np.cos(theta)))
 
-            else:
+        # calculate the filling rate in m^3/s at each theta (the flow is split between current and next blade)
+        blade_sin = np.where(theta > self.blade_sep, np.sin(theta - self.blade_sep), np.sin(theta))
+        fill = self.width * self.radius * blade_sin * (fall_v - blade_v)
 
-                filling_rate[i]=0
-                continue
+        # remove nan and negative values (nan > 0 is False)
+        filling_rate = np.where(filling & (fill > 0), fill, 0)
 
-        
         # multiply by dtheta/dt to get the filling rate in m^3/s and remove the shared value
-        rate = (filling_rate * self.dthetadt)  
+        rate = (filling_rate * self._rpm_axes(self.dthetadt))
 
         self.filling_rate = rate
         
@@ -178,26 +323,18 @@ class breastTurbine():
         the filling rate is m^3/s but volume is in terms of theta so the integral is multiplied by dt/dtheta
         '''
 
-        vol = np.cumsum(self.filling_rate)
-        max_vol_ach = max(vol)
+        vol = np.cumsum(self.filling_rate, axis=-1)
         empty_angle = np.pi/2
 
-        # limit the volume to the maximum volume of the turbine
-        for i, val in enumerate(vol):
-            if val > self.max_vol:
-                val = self.max_vol
-                max_vol_ach = val
+        # limit the volume to the maximum volume of the turbine - once the volume has passed the max
+        # volume the bucket empties from the max volume, until then it empties from the max achieved
+        passed_max = np.cumsum(vol > self.max_vol, axis=-1) > 0
+        max_vol_ach = np.where(passed_max, self.max_vol, np.max(vol, axis=-1, keepdims=True))
 
-            # make it so the bucket begins to empty when the turbine is at 90 degrees - need to find exact angle
-            
-            if self.theta[i] > empty_angle:
-                val =  max_vol_ach*(1 - (self.theta[i] - empty_angle))
-                if val < 0:
-                    val = 0
+        # make it so the bucket begins to empty when the turbine is at 90 degrees - need to find exact angle
+        emptying = np.maximum(max_vol_ach * (1 - (self.theta - empty_angle)), 0)
 
-            vol[i] = val
-            
-        self.vol = vol
+        self.vol = np.where(self.theta > empty_angle, emptying, np.minimum(vol, self.max_vol))
         return 0
 
     def find_centre_mass(self):
@@ -212,12 +349,9 @@ class breastTurbine():
         e = 3.19372668997763
 
         # calculate the centre of mass at each theta
-        centre_mass = np.zeros(len(self.theta))
-        for i, theta in enumerate(self.theta):
-            if theta >= self.theta_entry and theta <= self.theta_exit:
-                centre_mass[i] = (a*(theta**4) + b*(theta**3) + c*(theta**2) + d*theta + e)
-            else:
-                centre_mass[i] = 0
+        theta = self.theta
+        in_range = (theta >= np.asarray(self.theta_entry)[..., None]) & (theta <= np.asarray(self.theta_exit)[..., None])
+        centre_mass = np.where(in_range, a*(theta**4) + b*(theta**3) + c*(theta**2) + d*theta + e, 0)
 
         self.centre_mass = centre_mass
         return 0
@@ -227,9 +361,8 @@ class breastTurbine():
         calculate the potential power at each theta
         '''
         # potential power is the product of the volume of water, the centre of mass, the angular velocity and the density of water
-        pot_power = np.zeros(len(self.theta))
-        for i, theta in enumerate(self.theta):
-            pot_power[i] = (self.g * self.vol[i] * self.centre_mass[i] * self.river.rho * self.omega)
+        omega = self._rpm_axes(self.omega)
+        pot_power = self.g * self.vol * self.centre_mass * self.river.rho * omega
 
         self.pot_power = pot_power
         return 0
@@ -238,39 +371,31 @@ class breastTurbine():
         '''
         calculate the impulse power at each theta
         '''
-        imp_power = np.zeros(len(self.theta))
-
-        # impulse power is the product of the radius, the density of water, the angular velocity and the difference between the filling rate and the volume flow rate
-        for i, theta in enumerate(self.theta):
-            if theta < self.theta_entry or theta > self.blade_sep + np.pi/2:
-                imp_power[i] = 0
-                continue
-
-            # calculate the falling velocity of the water - the fall distance is the head - (y_centre + radius * cos(theta))
-            fall_river_flow = np.sqrt(2 * self.g * (self.river.head + self.river.nappe_height/2 - (self.y_centre  + self.radius * np.cos(theta)))) * self.width * self.radius * np.sin(theta - self.theta_entry) 
+        theta = self.theta
+        omega = self._rpm_axes(self.omega)
+        theta_entry = np.asarray(self.theta_entry)[..., None]
+        head = np.asarray(self.river.head)[..., None]
+        nappe_height = np.asarray(self.river.nappe_height)[..., None]
+        y_centre = np.asarray(self.y_centre)[..., None]
+        impulse = (theta >= theta_entry) & (theta <= self.blade_sep + np.pi/2)
+
+        # calculate the falling velocity of the water - the fall distance is the head - (y_centre + radius * cos(theta))
+        with np.errstate(invalid='ignore'):
+            fall_river_flow = np.sqrt(2 * self.g * (head + nappe_height/2 - (y_centre  + self.radius * np.cos(theta)))) * self.width * self.radius * np.sin(theta - theta_entry) 
             
-            # the impulse power is the product of the radius, the density of water, the angular velocity and the difference between the filling rate and the volume flow rate
-            imp = self.omega * self.river.rho * self.radius * (fall_river_flow - self.filling_rate[i])
-
-            if imp < 0:
-                imp = 0
-
-            imp_power[i] = imp
+        # the impulse power is the product of the radius, the density of water, the angular velocity and the difference between the filling rate and the volume flow rate
+        imp = omega * self.river.rho * self.radius * (fall_river_flow - self.filling_rate)
+        imp = np.where(imp < 0, 0, imp)
 
-        self.imp_power = imp_power
+        self.imp_power = np.where(impulse, imp, 0)
         return 0
     
     def find_tot_power(self):
         '''
         calculate the total power at each theta
         '''
-        tot_power = np.zeros(len(self.theta))
-
         # total power is the sum of the potential and impulse power
-        for i, theta in enumerate(self.theta):
-            tot_power[i] =   self.imp_power[i] + self.pot_power[i]
-
-        self.tot_power = tot_power
+        self.tot_power = self.imp_power + self.pot_power
         return 0
     
     def find_avg_power(self):
@@ -284,42 +409,43 @@ class breastTurbine():
         blade_sep_idx = 100 / self.num_blades
 
         # compounding the power output of each blade with offset blade_sep_idx
-        power = np.zeros(len(self.theta))
+        power = np.zeros(np.shape(self.tot_power))
         for i in range(self.num_blades):
-            power += np.roll(self.tot_power, int(i*blade_sep_idx))
+            power += np.roll(self.tot_power, int(i*blade_sep_idx), axis=-1)
 
         # average the power over one revolution
-        avg_power = np.sum(power) / len(power)
+        avg_power = np.sum(power, axis=-1) / power.shape[-1]
 
         self.avg_power = avg_power *  self.num_blades   #- 0.2854295943166135 * 1000
         self.full_power = power
 
         return 0
     
-    def analysis(self):
+    def analysis(self, RPM=None):
         '''
         run the analysis for the turbine
+
+        if RPM is given (a value or an array) the turbine is set to it first - for an array of RPMs the
+        river intersection and centre of mass are found once and the average power is returned for each RPM
         '''
-        # run the analysis
-        self.find_intersects()
-        if self.find_theta_range():
+        if RPM is not None:
+            self.set_RPM(RPM)
+
+        # run the analysis - only the stages with changed inputs since the last analysis are re-run
+        if self.run_stage('theta_range'):
             # print('error: turbine not in river')
-            return 0
-        if self.find_filling_rate():
-            return 0
-        self.find_vol()
-        self.find_centre_mass()
-        self.find_pot_power()
-        self.find_imp_power()
-        self.find_tot_power()
-        self.find_avg_power()
+            shape = np.shape(self.RPM) + self.river.shape
+            return 0 if not shape else np.zeros(shape)
+        self.run_stage('avg_power')
 
         return self.avg_power
 
         
-    def optimise(self):
+    def optimise(self, trace=None):
         '''
         Optimise the turbine position to maximise the average power output
+
+        trace - optional traces.trace_writer recording each iteration of the optimisation
         '''
 
         # first define the function to be optimised
@@ -333,11 +459,25 @@ class breastTurbine():
             
             return -power
         
+        import scipy.optimize as opt
+
         # define the initial guess
         x0 = np.array([self.x_centre, self.y_centre])
 
+        callback = None
+        if trace is not None:
+            fun = trace.objective(fun)
+            callback = trace.callback(cache_hits=lambda: self.stage_hits, rejects=lambda: self.feasibility_rejects)
+
+        # the positions where the turbine can meet the nappe bound the search
+        x_box, y_box = feasible_box(self.river, self.radius)
+        bounds = ((max(0, x_box[0]), min(100, x_box[1])), (max(-self.river.head, y_box[0]), min(100, y_box[1])))
+
         # run the optimisation
-        res = opt.minimize(fun, x0, bounds=((0, 100), (-self.river.head, 100)), method='nelder-mead')
+        res = opt.minimize(fun, x0, bounds=bounds, method='nelder-mead', callback=callback)
+
+        if trace is not None:
+            trace.flush()
 
         # print the results
         if not res.success:
@@ -355,10 +495,48 @@ class breastTurbine():
         # return the optimal power
         return power
     
+    def analysis_blades(self, blade_counts, RPM=None):
+        '''
+        the average power of the turbine with each number of blades in blade_counts, from one evaluation -
+        the intersections, theta range and centre of mass are shared and the blade dependent stages are run
+        once with a leading blade count axis (the result has it before any RPM and river axes)
+
+        the turbine keeps its own num_blades, its blade dependent stages are re-run by the next analysis
+        '''
+        counts = np.asarray(blade_counts, dtype=int)
+        if RPM is not None:
+            self.set_RPM(RPM)
+
+        if self.run_stage('theta_range'):
+            return np.zeros(counts.shape + np.shape(self.RPM) + self.river.shape)
+        self.run_stage('centre_mass')
+
+        # the blade separation of each count, broadcast against the (RPM..., river..., theta) results
+        blade_sep = self.blade_sep
+        self.blade_sep = np.reshape(2*np.pi/counts, counts.shape + (1,) * (np.ndim(self.RPM) + len(self.river.shape) + 1))
+        try:
+            self.find_filling_rate()
+            self.find_vol()
+            self.find_pot_power()
+            self.find_imp_power()
+            self.find_tot_power()
+            power = superpose_blades(self.tot_power, counts)
+        finally:
+            self.blade_sep = blade_sep
+            self.invalidate('theta_range')
+
+        # as find_avg_power
+        avg_power = np.sum(power, axis=-1) / power.shape[-1]
+        return avg_power * np.reshape(counts, counts.shape + (1,) * (avg_power.ndim - 1))
+
     def plot_turbine(self):
         '''
         Plot the turbine
         '''
+        import matplotlib.pyplot as plt
+
+        self.run_stage('geometry')
+
         # plot the turbine
         plt.figure()
         plt.plot(self.x_centre, self.y_centre, color='r', marker='o')
@@ -371,6 +549,7 @@ class breastTurbine():
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
     from river_class import river_obj
 
     # define the river
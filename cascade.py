@@ -0,0 +1,313 @@
+'''
+This module models a cascade of turbines in series along one channel. Each turbine takes energy out of the
+flow and hands a modified river on to the next turbine - the volumetric flow rate is unchanged but the
+energy extracted is taken first from the head and then from the velocity head (the river slows and so
+deepens). A breastshot turbine can only use the head its wheel spans (from the top of the nappe down to the
+bottom of the wheel) so the rest of the head is handed on. A turbine is credited with at most MAX_EFFICIENCY
+of the energy available to it, the flow losing the rest, and the river is never slowed below a fraction of
+the velocity at the top of the cascade.
+
+Each turbine runs at the RPM giving it the most credited power. Its model power (as analysis) is kept
+alongside - where the model claims more than the energy balance allows the turbine is saturated, and a
+layout whose total reaches the credit limit of the river at the top of the cascade takes all the energy
+the flow can give up (more turbines, or other placements, can not add to it). Layouts are compared on their credited total, and layouts with the same total on how far the model's claims exceed
+it, so a search among saturated layouts moves towards the placements the model describes best.
+
+The placement optimiser finds the position of every turbine together. A greedy layout (each turbine placed
+in turn at its best position on the river it sees) seeds a differential evolution search over the positions
+of all the turbines. The candidate layouts of a generation are evaluated in a batch - the rivers seen by one
+turbine of every layout are one array-valued river and the turbine models take a position per river, so
+each turbine of the cascade is one model call over all the layouts and RPMs - optionally split across a
+process pool.
+
+Parameters:
+----------------
+    river - object: river object for the top of the cascade
+    n_units - int: the number of turbines
+    model - string: 'breastshot' or 'undershot', chosen from the river head if not given
+    radius, width, num_blades - the geometry shared by the turbines
+    pop_size - int: the number of layouts in the population
+    generations - int: the number of generations
+    workers - int: the number of worker processes (1 evaluates in this process)
+    trace - object: optional traces.trace_writer recording each generation
+
+Methods:
+----------------
+    downstream_river - the river after a turbine producing a given power
+    run_cascade - the power, RPM, inflowing river and model power of each turbine of one layout
+    evaluate_layouts - the power, RPM and model power of each turbine for a batch of layouts
+    optimise_cascade - finds the positions of the turbines maximising the total power
+
+Returns:
+----------------
+    optimise_cascade - dict: the position, credited power, model power, saturation, RPM and inflowing river of
+                    each turbine, the total power, the credit limit of the flow and whether the total is at it
+
+'''
+
+# imports
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from river_class import river_obj, stack_rivers
+from feasibility import feasible_box
+from evaluation import RPM_RANGE, build_turbine, turbine_power, runaway_RPM
+
+# the position variables of each model
+POSITION_VARIABLES = {
+    'breastshot': ('x_centre', 'y_centre'),
+    'undershot': ('y_centre',),
+}
+
+# the flow is never slowed below this fraction of the velocity at the top of the cascade
+MIN_VELOCITY_FRACTION = 0.2
+
+# the largest fraction of the energy available to a turbine it turns into power, the rest is lost in the flow
+MAX_EFFICIENCY = 0.8
+
+
+def _energy(river, max_head=None, min_velocity=None):
+    # the head a turbine can use and the specific energy (m) available to it, with the velocity floor
+    if min_velocity is None:
+        min_velocity = MIN_VELOCITY_FRACTION * river.velocity
+    min_velocity = np.minimum(min_velocity, river.velocity)
+
+    # the fall is from the top of the nappe, and every metre of it used comes off the head handed on, so
+    # the nappe is only counted once down the cascade
+    fall = np.where(np.asarray(river.head) > 0, river.head + river.nappe_height, 0)
+    usable_head = fall if max_head is None else np.minimum(fall, np.maximum(max_head, 0))
+    return usable_head, usable_head + (river.velocity**2 - min_velocity**2) / (2 * river.g), min_velocity
+
+
+def credit_limit(river, max_head=None, min_velocity=None):
+    # the most power (W) a turbine can be credited with from the river (see downstream_river)
+    return MAX_EFFICIENCY * river.rho * river.g * river.vol_flow_rate * _energy(river, max_head, min_velocity)[1]
+
+
+def downstream_river(river, power, max_head=None, min_velocity=None):
+    '''
+    the river after a turbine producing power (W) from it, and the power credited to the turbine - the
+    energy taken from the flow (the power over MAX_EFFICIENCY) comes from the fall first (from the top of
+    the nappe, at most max_head of it) and then from the velocity head down to min_velocity (by default
+    MIN_VELOCITY_FRACTION of this river's velocity), keeping the flow rate
+
+    the river and power can be arrays (an array-valued river), for a turbine in each river condition
+    '''
+    flow = river.vol_flow_rate
+    weight_flow = river.rho * river.g * flow
+    usable_head, available, min_velocity = _energy(river, max_head, min_velocity)
+
+    power = np.minimum(np.maximum(power, 0), MAX_EFFICIENCY * weight_flow * available)
+    drop = power / (MAX_EFFICIENCY * weight_flow)
+
+    head_drop = np.minimum(drop, usable_head)
+    velocity = np.sqrt(np.maximum(river.velocity**2 - 2 * river.g * (drop - head_drop), min_velocity**2))
+    depth = flow / (river.width * velocity)
+
+    return river_obj(river.width, depth, velocity, head=np.maximum(river.head - head_drop, 0)), power
+
+
+def _bounds(river, model, radius, barrel_radius=0.169):
+    # the position bounds of a turbine - where a breastshot wheel can meet the nappe at the top of the
+    # cascade, above the downstream bed (as breastTurbine.optimise)
+    if model == 'breastshot':
+        x_box, y_box = feasible_box(river, radius)
+        return np.array([max(0, x_box[0]), max(-river.head, y_box[0])]), np.array([x_box[1], y_box[1]])
+    return np.array([barrel_radius]), np.array([radius])
+
+
+def _usable_head(river, model, positions, geometry):
+    # the head each turbine spans - from the top of the nappe down to the bottom of a breastshot wheel, none
+    # for undershot
+    if model == 'breastshot':
+        return river.nappe_height + geometry.get('radius', 0.504) - positions[:, 1]
+    return np.zeros(len(positions))
+
+
+def _step(river, model, positions, geometry, min_velocity):
+    '''
+    one turbine of each layout - river holds the river each layout's turbine sees (one condition per row of
+    positions). Returns the rivers handed on, the credited power, the model power and the RPM of each turbine
+    '''
+    n = len(positions)
+    max_head = _usable_head(river, model, positions, geometry)
+    limit = credit_limit(river, max_head, min_velocity)
+
+    # the model power of every turbine at every RPM (rows) in one call, none past an undershot runaway
+    claimed = np.zeros((len(RPM_RANGE), n))
+    turbine = build_turbine(river, model, **geometry, **{name: positions[:, d] for d, name in enumerate(POSITION_VARIABLES[model])})
+    if turbine is not None:
+        try:
+            claimed = turbine_power(turbine, RPM_RANGE, model).reshape(len(RPM_RANGE), n)
+        except ValueError:
+            pass
+        claimed = np.where(RPM_RANGE[:, None] <= runaway_RPM(river, model, turbine.radius), claimed, 0)
+
+    # the RPM with the most credited power - of those, the one where the model claims least beyond it
+    credited = np.minimum(claimed, limit)
+    k = np.argmin(np.where(credited == credited.max(axis=0), claimed, np.inf), axis=0)
+    claimed = claimed[k, np.arange(n)]
+
+    river, power = downstream_river(river, credited[k, np.arange(n)], max_head, min_velocity)
+    return river, power, claimed, RPM_RANGE[k]
+
+
+def _cascade(river, model, layouts, geometry):
+    # run every layout down the cascade together, with the array-valued river flowing into each turbine
+    n_layouts, n_units = layouts.shape[:2]
+    power, claimed, RPM = np.zeros((3, n_layouts, n_units))
+    min_velocity = MIN_VELOCITY_FRACTION * river.velocity
+
+    river = stack_rivers([river] * n_layouts)
+    rivers = []
+    for k in range(n_units):
+        rivers.append(river)
+        river, power[:, k], claimed[:, k], RPM[:, k] = _step(river, model, layouts[:, k], geometry, min_velocity)
+
+    return power, RPM, claimed, rivers
+
+
+def _condition(river, i):
+    # condition i of an array-valued river as a river of its own
+    return river_obj(*[float(getattr(river, name)[i]) for name in ('width', 'depth', 'velocity', 'head')])
+
+
+def run_cascade(river, model, layout, geometry=None):
+    '''
+    run one layout (a row of positions per turbine) down the cascade - returns the credited power and RPM of
+    each turbine, the river flowing into each turbine and the model power of each turbine
+    '''
+    power, RPM, claimed, rivers = _cascade(river, model, np.asarray(layout, dtype=float)[None], geometry or {})
+    return power[0], RPM[0], [_condition(r, 0) for r in rivers], claimed[0]
+
+
+def evaluate_layouts(river, model, layouts, geometry=None):
+    '''
+    the credited power, RPM and model power of each turbine of each layout - layouts has shape (layouts,
+    turbines, position)
+
+    the layouts are stepped down the cascade together, each turbine of every layout being one model call
+    '''
+    power, RPM, claimed, _ = _cascade(river, model, np.asarray(layouts, dtype=float), geometry or {})
+    return power, RPM, claimed
+
+
+def _evaluate(river, model, layouts, geometry, pool, workers):
+    # evaluate the layouts, split into one chunk per worker when there is a pool
+    if pool is None:
+        return evaluate_layouts(river, model, layouts, geometry)
+
+    chunks = np.array_split(layouts, workers)
+    results = list(pool.map(evaluate_layouts, [river] * workers, [model] * workers, chunks, [geometry] * workers))
+    return tuple(np.concatenate([r[i] for r in results]) for i in range(3))
+
+
+def _better(total, excess, best_total, best_excess):
+    # more credited power, or as much with less model power beyond it
+    tie = np.isclose(total, best_total, rtol=1e-9, atol=1e-9)
+    return (~tie & (total > best_total)) | (tie & (excess < best_excess))
+
+
+def _greedy_layout(river, model, n_units, geometry, lo, hi, n=7):
+    # place each turbine in turn at the best point of a grid of positions on the river it sees
+    grids = np.meshgrid(*[np.linspace(lo[d], hi[d], n) for d in range(len(lo))], indexing='ij')
+    candidates = np.column_stack([g.ravel() for g in grids])
+
+    layout = np.zeros((n_units, len(lo)))
+    min_velocity = MIN_VELOCITY_FRACTION * river.velocity
+    for k in range(n_units):
+        # every candidate position on the river this turbine sees, in one step
+        rivers, power, claimed, _ = _step(stack_rivers([river] * len(candidates)), model, candidates, geometry, min_velocity)
+        best = 0
+        for i in range(1, len(candidates)):
+            if _better(power[i], claimed[i] - power[i], power[best], claimed[best] - power[best]):
+                best = i
+        layout[k] = candidates[best]
+        river = _condition(rivers, best)
+
+    return layout
+
+
+def optimise_cascade(river, n_units, model=None, radius=0.504, width=1.008, num_blades=6, pop_size=20, generations=20,
+                     workers=1, seed=None, trace=None):
+    '''
+    find the positions of n_units turbines in series maximising the total credited power of the cascade
+    (ties broken on the least model power beyond it)
+    '''
+    if model is None:
+        model = river.select_turbine()
+    geometry = {'radius': radius, 'width': width, 'num_blades': int(num_blades)}
+
+    lo, hi = _bounds(river, model, radius)
+    lo, hi = np.tile(lo, (n_units, 1)), np.tile(hi, (n_units, 1))
+
+    rng = np.random.default_rng(seed)
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        # the greedy layout seeds the population, the rest are random
+        layouts = lo + rng.random((pop_size,) + lo.shape) * (hi - lo)
+        layouts[0] = _greedy_layout(river, model, n_units, geometry, lo[0], hi[0])
+
+        power, RPM, claimed = _evaluate(river, model, layouts, geometry, pool, workers)
+        total, excess = power.sum(axis=1), (claimed - power).sum(axis=1)
+
+        if trace is not None:
+            best = np.argmax(total)
+            trace.evaluated(layouts[best], total[best], n=pop_size)
+            trace.iteration_done()
+
+        for _ in range(generations):
+            # differential evolution (rand/1/bin) - each trial layout replaces its target if it is better
+            a, b, c = (np.array([rng.choice(np.delete(np.arange(pop_size), i), 3, replace=False) for i in range(pop_size)])).T
+            mutant = layouts[a] + rng.uniform(0.5, 1.0) * (layouts[b] - layouts[c])
+            cross = rng.random(layouts.shape) < 0.7
+            cross[np.arange(pop_size), rng.integers(n_units, size=pop_size)] = True
+            trials = np.clip(np.where(cross, mutant, layouts), lo, hi)
+
+            trial_power, trial_RPM, trial_claimed = _evaluate(river, model, trials, geometry, pool, workers)
+            trial_total, trial_excess = trial_power.sum(axis=1), (trial_claimed - trial_power).sum(axis=1)
+
+            better = _better(trial_total, trial_excess, total, excess)
+            layouts[better], power[better], RPM[better], claimed[better] = trials[better], trial_power[better], trial_RPM[better], trial_claimed[better]
+            total[better], excess[better] = trial_total[better], trial_excess[better]
+
+            if trace is not None:
+                best = np.argmax(trial_total)
+                trace.evaluated(trials[best], trial_total[best], n=pop_size)
+                trace.iteration_done(excess=float(excess.min()))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if trace is not None:
+            trace.flush()
+
+    best = 0
+    for i in range(1, pop_size):
+        if _better(total[i], excess[i], total[best], excess[best]):
+            best = i
+    unit_power, unit_RPM, rivers, unit_claimed = run_cascade(river, model, layouts[best], geometry)
+    limit = credit_limit(river)
+
+    result = {name: layouts[best][:, d] for d, name in enumerate(POSITION_VARIABLES[model])}
+    result.update(model=model, power=unit_power, model_power=unit_claimed, saturated=unit_claimed > unit_power, RPM=unit_RPM,
+                  rivers=rivers, total_power=unit_power.sum(), limit=limit, at_limit=bool(np.isclose(unit_power.sum(), limit, rtol=1e-9)))
+    return result
+
+
+if __name__ == "__main__":
+    import time
+
+    # a cascade of breastshot turbines down the test channel with a bigger head
+    river = river_obj(width=0.77, depth=0.3, velocity=1.5, head=4)
+
+    for n_units in (3, 6, 10):
+        start = time.time()
+        result = optimise_cascade(river, n_units, seed=0)
+        print('%d turbines: %.1f W in %.2f s%s' % (n_units, result['total_power'], time.time() - start,
+                                                  ' - all the flow can give up' if result['at_limit'] else ''))
+        for k in range(n_units):
+            r = result['rivers'][k]
+            print('    turbine %d at (%.2f, %.2f), %.1f W (model %.1f W%s) at %.0f RPM - inflow head %.2f m, velocity %.2f m/s'
+                  % (k + 1, result['x_centre'][k], result['y_centre'][k], result['power'][k], result['model_power'][k],
+                     ', saturated' if result['saturated'][k] else '', result['RPM'][k], r.head, r.velocity))
@@ -0,0 +1,281 @@
+'''
+This module runs a long-running local evaluation service around the turbine models and the payback
+calculation, so the GUI, notebooks and dashboards can share one warm process and its caches rather than
+each importing the models.
+
+JSON requests are posted over HTTP on localhost. Requests arriving within a short window are grouped
+and requests for the same river, geometry and position are evaluated together in one vectorized call
+over their RPMs. Turbines (with their river intersection) and results are kept in LRU caches, and the
+latency of every request is recorded so percentiles can be reported.
+
+Requests (POST /evaluate):
+----------------
+    {"model": "breastshot", "river": {"width": .., "depth": .., "velocity": .., "head": ..},
+     "turbine": {"radius": .., "width": .., "num_blades": .., "x_centre": .., "y_centre": ..}, "RPM": 15}
+    {"model": "undershot", "river": {..}, "turbine": {"radius": .., "y_centre": .., ..}, "RPM": 15}
+    {"model": "payback", "size": "medium", "power": 400}
+
+    GET /stats returns the request count, batch sizes, cache hits and latency percentiles
+
+Methods:
+----------------
+    evaluation_service - the service, start() serves on host:port and evaluate() can be awaited directly
+
+Returns:
+----------------
+    {"power": .., "limited": ..} for the turbine models, the power as the model's analysis and limited true
+    when it is more than the hydraulic power of the river, {"payback_time": .., "benefit": ..} for payback
+    or {"error": ..} if the request could not be evaluated
+
+'''
+
+# imports
+import io
+import json
+import time
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+import numpy as np
+
+from river_class import river_obj
+from payback import household
+from evaluation import MODELS, turbine_power, limited
+
+
+class _lru(OrderedDict):
+    # a small least recently used cache
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        if key in self:
+            self.move_to_end(key)
+            self.hits += 1
+            return self[key]
+        self.misses += 1
+        return None
+
+    def store(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.size:
+            self.popitem(last=False)
+
+
+class _payback_turbine():
+    # the payback calculation only needs the average power of the turbine
+    def __init__(self, avg_power):
+        self.avg_power = avg_power
+
+
+class evaluation_service():
+    '''
+    The evaluation service.
+
+    Parameters:
+    ----------------
+        window - float: the time in s to wait for more requests before evaluating a batch
+        max_batch - int: the maximum number of requests in a batch
+        cache_size - int: the number of turbines and of results kept in the caches
+    '''
+    def __init__(self, window=0.005, max_batch=256, cache_size=4096):
+        self.window = window
+        self.max_batch = max_batch
+
+        self.turbines = _lru(cache_size)
+        self.results = _lru(cache_size)
+
+        self.latencies = deque(maxlen=10000)
+        self.n_requests = 0
+        self.n_batches = 0
+
+        # the batches are evaluated off the event loop on a single thread of their own so the service
+        # keeps accepting requests (and the caches are only touched by one thread)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.queue = None
+        self.server = None
+        self.batcher = None
+
+    async def start(self, host='127.0.0.1', port=8765):
+        # start the batcher and serve http on host:port (port 0 picks a free port)
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.ensure_future(self._batch_loop())
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.cancel()
+
+    async def evaluate(self, request):
+        '''
+        queue a request for the next batch and wait for its result
+        '''
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future))
+        result = await future
+
+        self.latencies.append(time.perf_counter() - start)
+        self.n_requests += 1
+        return result
+
+    async def _batch_loop(self):
+        # collect requests for up to window seconds then evaluate them together
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.n_batches += 1
+            results = await loop.run_in_executor(self.executor, self._evaluate_batch, [request for request, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _evaluate_batch(self, requests):
+        '''
+        evaluate a batch of requests - turbine requests are grouped by river, geometry and position and
+        each group is evaluated at all of its RPMs in one call
+        '''
+        results = [None] * len(requests)
+        groups = {}
+
+        for i, request in enumerate(requests):
+            try:
+                model = request.get('model')
+                if model == 'payback':
+                    results[i] = self._payback(request)
+                    continue
+                if model not in MODELS:
+                    raise ValueError('unknown model %r' % model)
+
+                key = (model, _key(request.get('river', {})), _key(request.get('turbine', {})))
+                RPM = float(request.get('RPM', 15))
+
+                cached = self.results.lookup(key + (RPM,))
+                if cached is not None:
+                    results[i] = dict(zip(('power', 'limited'), cached))
+                    continue
+                groups.setdefault(key, []).append((i, RPM))
+            except Exception as e:
+                results[i] = {'error': '%s: %s' % (type(e).__name__, e)}
+
+        for key, members in groups.items():
+            try:
+                turbine = self._turbine(key)
+                RPMs = np.array([RPM for _, RPM in members])
+                power = np.atleast_1d(turbine_power(turbine, RPMs, key[0]))
+                over = np.atleast_1d(limited(power, turbine.river, key[0]))
+                for (i, RPM), p, o in zip(members, power, over):
+                    self.results.store(key + (RPM,), (float(p), bool(o)))
+                    results[i] = {'power': float(p), 'limited': bool(o)}
+            except Exception as e:
+                for i, _ in members:
+                    results[i] = {'error': '%s: %s' % (type(e).__name__, e)}
+
+        return results
+
+    def _turbine(self, key):
+        # a turbine for the river, geometry and position - cached so they are only built once
+        turbine = self.turbines.lookup(key)
+        if turbine is None:
+            model, river, geometry = key
+            turbine = MODELS[model](river_obj(**dict(river)), **dict(geometry))
+            self.turbines.store(key, turbine)
+        return turbine
+
+    def _payback(self, request):
+        home = household(request.get('size', 'medium'))
+        if 'turbine_cost' in request:
+            home.turbine_cost = float(request['turbine_cost'])
+
+        # the payback calculation prints its breakdown, which is not wanted in the service
+        with contextlib.redirect_stdout(io.StringIO()):
+            payback_time, benefit = home.payback(_payback_turbine(float(request['power'])))
+        return {'payback_time': payback_time, 'benefit': benefit}
+
+    def stats(self):
+        '''
+        the request count, batch sizes, cache hit rates and latency percentiles in ms
+        '''
+        latencies = np.array(self.latencies) * 1000
+        stats = {
+            'requests': self.n_requests,
+            'batches': self.n_batches,
+            'mean_batch': self.n_requests / max(self.n_batches, 1),
+            'turbine_cache_hits': self.turbines.hits,
+            'result_cache_hits': self.results.hits,
+        }
+        if len(latencies):
+            for q in (50, 90, 99):
+                stats['p%d_ms' % q] = float(np.percentile(latencies, q))
+        return stats
+
+    async def _handle(self, reader, writer):
+        # minimal http handling - one request per connection
+        try:
+            request_line = (await reader.readline()).decode().split()
+            length = 0
+            while True:
+                line = (await reader.readline()).decode().strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+            body = await reader.readexactly(length) if length else b''
+
+            method, path = request_line[0], request_line[1]
+            if method == 'GET' and path == '/stats':
+                code, response = 200, self.stats()
+            elif method == 'POST' and path == '/evaluate':
+                response = await self.evaluate(json.loads(body))
+                code = 400 if 'error' in response else 200
+            else:
+                code, response = 404, {'error': 'not found'}
+        except Exception as e:
+            code, response = 400, {'error': '%s: %s' % (type(e).__name__, e)}
+
+        payload = json.dumps(response).encode()
+        writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: close\r\n\r\n'
+                     % (code, b'OK' if code == 200 else b'Error', len(payload)) + payload)
+        await writer.drain()
+        writer.close()
+
+
+def _key(params):
+    # a hashable key for a dictionary of parameters
+    return tuple(sorted((k, v if isinstance(v, int) else float(v)) for k, v in params.items()))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the local turbine evaluation service')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--window', type=float, default=0.005, help='batching window in s')
+    args = parser.parse_args()
+
+    async def main():
+        service = evaluation_service(window=args.window)
+        port = await service.start(port=args.port)
+        print('Serving on http://127.0.0.1:%d (POST /evaluate, GET /stats)' % port)
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
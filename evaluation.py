@@ -0,0 +1,128 @@
+'''
+This module holds the design evaluation shared by the screening, search and service modules - building a
+turbine of either model from its parameters, and scoring it over a range of RPMs.
+
+The powers returned are the model's own (as analysis). For many designs the breastshot model's power keeps
+rising with the RPM (the impulse term grows with the blade speed), so their best power over an RPM range
+sits at the top of the range and can be many times the energy the river carries - limited flags such
+powers, those above the hydraulic power of the river (the weight flow times the head the turbine can use
+and the velocity head). A search that should not chase them can score designs with cap=True, limiting
+each power to the hydraulic power before the best RPM is chosen.
+
+Parameters:
+----------------
+    river - object: river object (a single river or an array-valued one)
+    model - string: 'breastshot' or 'undershot'
+    params - dict: the turbine parameters (radius, width, num_blades, x_centre, y_centre, RPM...)
+    RPM - float or array: the RPMs to evaluate, the turbine's own RPM if None
+    cap - bool: score the design on its power limited to the hydraulic power
+
+Methods:
+----------------
+    hydraulic_power - the power the flow carries that a turbine of the model could take
+    limited - whether powers are above the hydraulic power, i.e. outside what the model can be trusted for
+    build_turbine - the turbine of the model for the parameters, None if it can not be built
+    runaway_RPM - the RPM above which a design of the model is not scored
+    turbine_power - the power of a turbine at its RPM(s)
+    design_power - the best power of a design over a range of RPMs and its RPM
+
+Returns:
+----------------
+    design_power - tuple: the best power and the RPM giving it, (0, RPM[0]) if the design can not be built
+
+'''
+
+# imports
+import numpy as np
+
+from breastshot_calcs import breastTurbine
+from undershot_calcs import underTurbine
+
+MODELS = {'breastshot': breastTurbine, 'undershot': underTurbine}
+
+# the RPMs a design is scored over
+RPM_RANGE = np.linspace(1, 40, 40)
+
+
+def hydraulic_power(river, model):
+    '''
+    the power (W) of the flow available to the model - a breastshot turbine can take the head from the top
+    of the nappe to the downstream bed as well as the velocity head, an undershot turbine only the velocity
+    head (the kinetic power of the stream)
+    '''
+    energy = river.velocity**2 / (2 * river.g)
+    if model == 'breastshot':
+        energy = energy + river.head + river.nappe_height
+    return river.rho * river.g * river.vol_flow_rate * energy
+
+
+def limited(power, river, model):
+    # True where a power is more than the flow carries (the model has left its range there)
+    return np.asarray(power) > hydraulic_power(river, model)
+
+
+def runaway_RPM(river, model, radius):
+    '''
+    the RPM above which a design is given no power - an undershot wheel runs away once its blade tips move at
+    the river velocity (as underTurbine.optimise), where the stream can no longer drive it and the drag model
+    does not hold; a breastshot wheel is not limited
+    '''
+    if model == 'undershot':
+        return 60 * river.velocity / (2 * np.pi * radius)
+    return np.inf
+
+
+def build_turbine(river, model, **params):
+    # the turbine for the parameters (num_blades is rounded), None where the model rejects them
+    if 'num_blades' in params:
+        params['num_blades'] = int(round(params['num_blades']))
+    try:
+        return MODELS[model](river, **params)
+    except ValueError:
+        return None
+
+
+def turbine_power(turbine, RPM=None, model=None, cap=False):
+    '''
+    the average power of the turbine at RPM (as turbine.analysis) with nan powers as 0 - with cap each
+    power is at most the hydraulic power of the turbine's river
+    '''
+    power = np.nan_to_num(turbine.analysis(RPM))
+    if not cap:
+        return power
+    if model is None:
+        model = 'undershot' if isinstance(turbine, underTurbine) else 'breastshot'
+    return np.minimum(power, hydraulic_power(turbine.river, model))
+
+
+def design_power(river, model, params, RPM=RPM_RANGE, cap=False):
+    '''
+    the best power of the design over RPM and the RPM giving it (with RPM None, the power at the RPM in
+    params) - with cap the RPM is chosen on the power limited to the hydraulic power, and the limited power
+    returned (ties, a curve at the limit, go to the lowest RPM). A design the model rejects gives no power,
+    and no RPM above its runaway RPM is scored.
+    '''
+    turbine = build_turbine(river, model, **params)
+    RPMs = np.atleast_1d(RPM if RPM is not None else params.get('RPM', 15))
+    if turbine is None:
+        return 0, RPMs[0]
+    try:
+        curve = np.atleast_1d(turbine_power(turbine, RPM, model, cap))
+    except ValueError:
+        return 0, RPMs[0]
+    curve = np.where(RPMs <= runaway_RPM(river, model, turbine.radius), curve, 0)
+    k = np.argmax(curve)
+    return curve[k], RPMs[k]
+
+
+if __name__ == "__main__":
+    from river_class import river_obj
+
+    # the test channel - a large wheel whose best RPM is at the top of the range, far above the energy of
+    # the flow, against its best power with the cap
+    river = river_obj(width=0.77, depth=0.3, velocity=1.5, head=2)
+    design = {'radius': 0.78, 'width': 1.76, 'num_blades': 12, 'x_centre': 1.03, 'y_centre': -0.47}
+    power, RPM = design_power(river, 'breastshot', design)
+    print('hydraulic power %.0f W' % hydraulic_power(river, 'breastshot'))
+    print('best %.0f W at %.0f RPM%s' % (power, RPM, ' (limited)' if limited(power, river, 'breastshot') else ''))
+    print('capped best %.0f W at %.0f RPM' % design_power(river, 'breastshot', design, cap=True))
@@ -0,0 +1,91 @@
+'''
+This module is a cheap geometric test of whether a breastshot turbine can meet the river at all. The
+intersection in breastTurbine.find_intersects needs a point of the nappe within 0.1 m in x and in y of a
+point of the rotor, so a nappe point must lie within 0.1 * sqrt(2) of the rotor circle - if no nappe
+point is that close to the circle the turbine produces no power and the analysis can be skipped. The test
+is vectorized over any number of candidate positions and radii, and it never rejects a position the full
+intersection would accept.
+
+The same envelope gives the box of turbine centres that can meet the nappe, which optimisers use as bounds.
+
+Parameters:
+----------------
+    river - object: river object with the nappe trajectory
+    x_centre, y_centre, radius - float or array: the candidate turbines (broadcast together)
+    y_min - float: the lowest turbine centre considered, the downstream bed (-head) by default
+
+Methods:
+----------------
+    feasible - whether each candidate turbine can meet the nappe
+    feasible_box - the bounds of the centres of turbines of a radius that can meet the nappe
+
+Returns:
+----------------
+    feasible - bool array: True where the turbine may intersect the nappe
+    feasible_box - tuple: ((x_min, x_max), (y_min, y_max))
+
+'''
+
+# imports
+import numpy as np
+
+# the furthest a nappe point can be from the rotor circle and still be counted as an intersection
+MARGIN = 0.1 * np.sqrt(2) + 1e-9
+
+
+def feasible(river, x_centre, y_centre, radius):
+    '''
+    True for each candidate turbine with a nappe point within MARGIN of its rotor circle
+    '''
+    x_centre, y_centre, radius = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (x_centre, y_centre, radius)])
+    shape = x_centre.shape
+    x_centre, y_centre, radius = x_centre.ravel(), y_centre.ravel(), radius.ravel()
+
+    # only the nappe points within the vertical reach of some candidate are compared
+    keep = (river.y_nappe >= np.min(y_centre - radius) - MARGIN) & (river.y_nappe <= np.max(y_centre + radius) + MARGIN)
+    x_nappe, y_nappe = river.x_nappe[keep], river.y_nappe[keep]
+
+    # distance of every nappe point from every centre, compared with the radius
+    distance = np.hypot(x_nappe[None, :] - x_centre[:, None], y_nappe[None, :] - y_centre[:, None])
+    near = np.abs(distance - radius[:, None]) < MARGIN
+
+    return near.any(axis=1).reshape(shape)
+
+
+def feasible_box(river, radius, y_min=None):
+    '''
+    the box of centres of turbines of the radius that may meet the nappe above y_min - radius (turbines
+    centred below y_min are not considered)
+    '''
+    if y_min is None:
+        y_min = -river.head
+
+    reach = radius + MARGIN
+    above = river.y_nappe >= y_min - reach
+    x_nappe, y_nappe = river.x_nappe[above], river.y_nappe[above]
+
+    x_box = (float(x_nappe.min() - reach), float(x_nappe.max() + reach))
+    y_box = (float(max(y_nappe.min() - reach, y_min)), float(y_nappe.max() + reach))
+    return x_box, y_box
+
+
+if __name__ == "__main__":
+    import time
+    from river_class import river_obj
+    from breastshot_calcs import breastTurbine
+
+    river = river_obj(width=0.77, depth=0.3, velocity=1.5, head=2)
+    print('feasible box of a 0.504 m turbine:', feasible_box(river, 0.504))
+
+    # compare the pre-filter with the full analysis over a grid of positions
+    x, y = np.meshgrid(np.linspace(-1, 4, 60), np.linspace(-3, 2, 60))
+
+    start = time.time()
+    ok = feasible(river, x, y, 0.504)
+    print('%d of %d positions rejected in %.4f s' % (np.sum(~ok), ok.size, time.time() - start))
+
+    missed = 0
+    for xi, yi, oki in zip(x.ravel(), y.ravel(), ok.ravel()):
+        if not oki and breastTurbine(river, x_centre=xi, y_centre=yi).analysis() != 0:
+            missed += 1
+    print('rejected positions with power: %d' % missed)
@@ -0,0 +1,162 @@
+'''
+This module finds the operating point of a turbine driving a generator. The turbine models take the RPM
+as an input, but on a real installation the RPM is set by the load - the turbine speeds up until the
+torque it produces is matched by the torque drawn by the generator (see the turbine and generator RPM
+columns of testData.csv).
+
+The equilibrium RPM is found for many turbines at once (each with its own river and position) with a
+bracketed root find on the net torque - a coarse scan of RPM brackets the stable equilibrium and the
+bracket is then repeatedly subdivided. Each turbine is evaluated at all of its RPMs in one call, so the
+river intersection is only found once per turbine per step.
+
+Parameters:
+----------------
+    turbines - list: breastTurbine or underTurbine objects, each with its own river and position
+    load - object: generator_load object with the torque-speed curve of the generator
+
+Methods:
+----------------
+    generator_load - the torque-speed curve of the generator referred to the turbine shaft
+    turbine_torque - calculates the torque of each turbine at the given RPMs
+    find_operating_point - calculates the equilibrium RPM and the realised power of each turbine
+
+Returns:
+----------------
+    RPM - array: the equilibrium RPM of each turbine
+    power - array: the average power of each turbine at the equilibrium RPM
+    status - array: CONVERGED, STALLED or RUNAWAY for each turbine
+
+'''
+
+# imports
+import numpy as np
+
+# status of each operating point
+CONVERGED = 0
+STALLED = 1 # the load torque exceeds the turbine torque at all RPM, the turbine does not turn
+RUNAWAY = 2 # the turbine torque exceeds the load torque at all RPM in the scan
+
+
+class generator_load():
+    '''
+    The torque-speed curve of the generator, referred to the turbine shaft through the gearing.
+
+    Parameters:
+    ----------------
+        speed - array: generator speeds in RPM (increasing)
+        torque - array: the load torque of the generator at each speed in Nm
+        gear_ratio - float: generator RPM / turbine RPM (about 16 for the test rig in testData.csv)
+        efficiency - float: efficiency of the gearing
+    '''
+    def __init__(self, speed, torque, gear_ratio=1, efficiency=1):
+        self.speed = np.asarray(speed, dtype=float)
+        self.torque = np.asarray(torque, dtype=float)
+        self.gear_ratio = gear_ratio
+        self.efficiency = efficiency
+
+    def torque_at(self, RPM):
+        # torque on the turbine shaft at the given turbine RPM
+        gen_torque = np.interp(np.asarray(RPM) * self.gear_ratio, self.speed, self.torque)
+        return gen_torque * self.gear_ratio / self.efficiency
+
+
+def turbine_torque(turbines, RPM):
+    '''
+    calculate the torque of each turbine at its RPMs - row i of RPM holds the RPMs for turbine i, each
+    turbine is evaluated at all of its RPMs in one call
+
+    the torque is the average power divided by the angular velocity, turbines outside the river give 0
+    '''
+    RPM = np.asarray(RPM, dtype=float)
+    torque = np.zeros(RPM.shape)
+    for i, turbine in enumerate(turbines):
+        power = turbine.analysis(RPM[i])
+        torque[i] = power / turbine.omega
+
+    return np.nan_to_num(torque)
+
+
+def find_operating_point(turbines, load, RPM_min=0.5, RPM_max=60, n_scan=24, n_refine=11, tol=1e-3, max_iter=20):
+    '''
+    find the equilibrium RPM of each turbine against the load
+
+    the net torque (turbine - load) is scanned on a coarse RPM grid for all turbines, the stable
+    equilibrium is the highest RPM at which the net torque changes from positive to negative - that
+    bracket is then refined by evaluating n_refine RPMs inside it (one call per turbine) and keeping
+    the sub-bracket holding the crossing, until it is narrower than tol
+    '''
+    n = len(turbines)
+    scan = np.linspace(RPM_min, RPM_max, n_scan)
+
+    # coarse scan of the net torque for every turbine
+    rpms = np.tile(scan, (n, 1))
+    net = turbine_torque(turbines, rpms) - load.torque_at(rpms)
+
+    lo, hi, has_bracket = _bracket(rpms, net)
+
+    status = np.full(n, CONVERGED)
+    status[~has_bracket & (net[:, -1] > 0)] = RUNAWAY
+    status[~has_bracket & (net[:, -1] <= 0)] = STALLED
+
+    # refine the brackets of all the bracketed turbines together
+    active = np.nonzero(has_bracket)[0]
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+        rpms = np.linspace(lo[active], hi[active], n_refine, axis=1)
+        f = turbine_torque([turbines[i] for i in active], rpms) - load.torque_at(rpms)
+
+        # the end points are known to bracket the crossing
+        f[:, 0] = np.maximum(f[:, 0], np.finfo(float).tiny)
+        f[:, -1] = np.minimum(f[:, -1], 0)
+        lo[active], hi[active], _ = _bracket(rpms, f)
+
+        active = active[(hi[active] - lo[active]) > tol]
+
+    RPM = (lo + hi) / 2
+    RPM[status == RUNAWAY] = RPM_max
+    RPM[status == STALLED] = 0
+
+    # realised power at the operating point, the turbines are left at their operating RPM
+    power = np.zeros(n)
+    for i, turbine in enumerate(turbines):
+        if status[i] == STALLED:
+            continue
+        power[i] = turbine.analysis(RPM[i])
+
+    return RPM, np.nan_to_num(power), status
+
+
+def _bracket(rpms, net):
+    # find the highest RPM interval in each row where the net torque goes from positive to non positive
+    crossing = (net[:, :-1] > 0) & (net[:, 1:] <= 0)
+    has_bracket = crossing.any(axis=1)
+
+    k = crossing.shape[1] - 1 - np.argmax(crossing[:, ::-1], axis=1)
+    rows = np.arange(len(rpms))
+
+    lo = np.where(has_bracket, rpms[rows, k], 0)
+    hi = np.where(has_bracket, rpms[rows, k + 1], 0)
+    return lo, hi, has_bracket
+
+
+if __name__ == "__main__":
+    import time
+    from river_class import river_obj
+    from breastshot_calcs import breastTurbine
+
+    # a linear generator load, gear ratio from testData.csv (231.2 / 14.5 generator / turbine RPM)
+    load = generator_load(speed=[0, 500], torque=[0, 40], gear_ratio=231.2 / 14.5)
+
+    # many positions in many rivers
+    turbines = []
+    for velocity in np.linspace(0.8, 2, 10):
+        river = river_obj(width=0.77, depth=0.3, velocity=velocity, head=2)
+        for x in np.linspace(0.5, 1, 10):
+            turbines.append(breastTurbine(river, x_centre=x, y_centre=-0.1))
+
+    start = time.time()
+    RPM, power, status = find_operating_point(turbines, load)
+    print('Solved %d operating points in %.2f s' % (len(turbines), time.time() - start))
+    print('RPM range: %.2f - %.2f, power range: %.2f - %.2f W' % (RPM.min(), RPM.max(), power.min(), power.max()))
+    print('Converged: %d, stalled: %d, runaway: %d' % ((status == CONVERGED).sum(), (status == STALLED).sum(), (status == RUNAWAY).sum()))
@@ -0,0 +1,225 @@
+'''
+This module keeps the results of turbine optimisations on disk, so the same optimisation (same river,
+geometry, starting point and optimiser settings) is only run once across GUI sessions, notebook reruns and
+pool workers.
+
+Each result is stored in its own compact binary .npz file named by a hash of its inputs and of the model
+version - the model version is a hash of the model source files, so changing the model code invalidates
+every earlier result automatically. Files are written to a temporary name and moved into place, so
+concurrent writers (e.g. pool workers) never leave a partial file, and the least recently used results
+are evicted once the cache is over its size limit.
+
+Parameters:
+----------------
+    path - string: the cache directory, created if needed
+    max_bytes - int: the size limit of the cache
+
+Methods:
+----------------
+    model_version - hash of the model source files
+    optimum_cache - the cache, optimise(turbine) is a cached turbine.optimise()
+
+Returns:
+----------------
+    result - dict: the optimum x_centre, y_centre, RPM and power, and any per-theta arrays stored with it
+
+'''
+
+# imports
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import functools
+import numpy as np
+
+# the source files of the models - a change to any of them changes the model version
+MODEL_MODULES = ('river_class', 'stages', 'feasibility', 'breastshot_calcs', 'undershot_calcs')
+
+# the per-theta arrays stored with a result when arrays are requested
+THETA_ARRAYS = ('theta', 'full_power', 'x', 'y')
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'pico_stream', 'optima')
+
+
+@functools.lru_cache(maxsize=None)
+def model_version():
+    # hash the source of the model modules
+    digest = hashlib.sha256()
+    for name in MODEL_MODULES:
+        module = sys.modules.get(name) or __import__(name)
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+class optimum_cache():
+    '''
+    The on-disk cache of optimisation results.
+
+    Parameters:
+    ----------------
+        path - string: the cache directory
+        max_bytes - int: the total size of the cached files above which the least recently used are removed
+    '''
+    def __init__(self, path=None, max_bytes=256 * 2**20):
+        self.path = path if path is not None else DEFAULT_PATH
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, turbine, settings=None):
+        '''
+        the hash of the model, the river, the turbine inputs (its geometry and the starting point of the
+        optimisation), the optimiser settings and the model version
+        '''
+        river = turbine.river
+        inputs = {name: getattr(turbine, name) for name in turbine.INPUTS if name != 'river'}
+        content = {
+            'model': type(turbine).__name__,
+            'river': [river.width, river.depth, river.velocity, river.head],
+            'inputs': inputs,
+            'settings': settings or {},
+            'version': model_version(),
+        }
+        text = json.dumps(content, sort_keys=True, default=_jsonable)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def get(self, key):
+        '''
+        the stored result for the key, or None
+        '''
+        try:
+            with np.load(self._file(key)) as data:
+                result = {name: data[name] for name in data.files}
+            # touch the file so eviction removes the least recently used results first
+            os.utime(self._file(key))
+        except (FileNotFoundError, OSError, ValueError):
+            # missing (or evicted by another process) - treated as a miss
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        for name in ('x_centre', 'y_centre', 'RPM', 'power'):
+            result[name] = float(result[name])
+        return result
+
+    def put(self, key, result):
+        '''
+        store a result, written to a temporary file then moved into place so readers and other writers
+        only ever see complete files
+        '''
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **result)
+            os.replace(tmp, self._file(key))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        self.evict()
+        return 0
+
+    def evict(self):
+        # remove the least recently used results until the cache is within max_bytes
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # already removed by another process
+                pass
+            total -= size
+        return 0
+
+    def clear(self):
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.npz'):
+                os.remove(entry.path)
+        return 0
+
+    def optimise(self, turbine, settings=None, arrays=False, start=None, **kwargs):
+        '''
+        a cached turbine.optimise(**kwargs) - on a hit the turbine is moved to the stored optimum and analysed
+        there without running the optimisation, the optimum power is returned either way
+
+        settings are any optimiser settings not held by the turbine (they are part of the key), kwargs are
+        passed on to turbine.optimise and those other than trace are part of the key too - with arrays the
+        per-theta arrays of the optimum are stored with it
+
+        start is an optional function of the turbine run only on a miss, before the optimisation (e.g.
+        warm_start_store.seed) - it may move the turbine and returns more kwargs for turbine.optimise, and
+        neither is part of the key, so a warm started optimisation is stored under its unseeded key
+        '''
+        key_settings = dict(settings or {}, **{k: v for k, v in kwargs.items() if k != 'trace'})
+        key = self.key(turbine, key_settings)
+
+        result = self.get(key)
+        if result is not None:
+            turbine.x_centre = result['x_centre']
+            turbine.y_centre = result['y_centre']
+            turbine.set_RPM(result['RPM'])
+            # re-run the analysis so the per-theta arrays and avg_power are those of the stored optimum
+            turbine.analysis()
+            return result['power']
+
+        if start is not None:
+            kwargs.update(start(turbine))
+        power = float(np.nan_to_num(turbine.optimise(**kwargs)))
+
+        result = {'x_centre': turbine.x_centre, 'y_centre': turbine.y_centre, 'RPM': turbine.RPM, 'power': power}
+        if arrays:
+            for name in THETA_ARRAYS:
+                if hasattr(turbine, name):
+                    result[name] = np.asarray(getattr(turbine, name), dtype=np.float32)
+        self.put(key, result)
+
+        return power
+
+    def stats(self):
+        sizes = [entry.stat().st_size for entry in os.scandir(self.path) if entry.name.endswith('.npz')]
+        return {'entries': len(sizes), 'bytes': sum(sizes), 'hits': self.hits, 'misses': self.misses}
+
+
+def _jsonable(value):
+    # numpy values in the key content
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('can not hash %r' % (value,))
+
+
+if __name__ == "__main__":
+    import time
+    from river_class import river_obj
+    from breastshot_calcs import breastTurbine
+
+    cache = optimum_cache(os.path.join(tempfile.gettempdir(), 'optimum_cache_demo'))
+    river = river_obj(width=0.77, depth=0.3, velocity=1.5, head=2)
+
+    for run in range(2):
+        turbine = breastTurbine(river, x_centre=0.8, y_centre=-0.1)
+        start = time.time()
+        power = cache.optimise(turbine, arrays=True)
+        print('run %d: %.2f W at (%.3f, %.3f) in %.4f s' % (run + 1, power, turbine.x_centre, turbine.y_centre, time.time() - start))
+
+    print(cache.stats())
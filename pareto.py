@@ -0,0 +1,281 @@
+'''
+This module finds the trade off between turbine power and turbine cost. The design choices (radius, width
+and num_blades, with the position of the turbine) change both the power and the cost of the turbine, so
+rather than one optimum the non-dominated (Pareto) front of designs is found, with the payback of each
+design from payback.py, so customers can be quoted a range of options.
+
+The front is found with a multi-objective evolutionary search (non-dominated sorting with crowding
+distance, as NSGA-II). Each generation is evaluated in batches - the whole RPM curve of each design is
+found in one call and the best RPM kept - optionally split across a process pool. The search scores each
+design on its power limited to the hydraulic power of the river (see evaluation.py), so it does not chase
+the designs the model credits with more power than the flow carries; the front reports the model's own
+power with those designs flagged as limited, and their payback from the limited power.
+
+Parameters:
+----------------
+    river - object: river object for the site
+    model - string: 'breastshot' or 'undershot'
+    cost - object: cost_model object giving the turbine cost from its geometry
+    home - object: household object used for the payback
+    pop_size - int: the number of designs in the population
+    generations - int: the number of generations
+    bounds - dict: (min, max) of each design variable, the defaults are used for any not given
+    workers - int: the number of worker processes (1 evaluates in this process)
+    trace - object: optional traces.trace_writer recording each generation
+
+Methods:
+----------------
+    cost_model - the cost of a turbine from its radius, width and number of blades
+    evaluate_designs - calculates the best power and RPM of each design (limited to the hydraulic power with cap)
+    non_dominated_sort - ranks designs into non-dominated fronts
+    crowding_distance - calculates the crowding distance of each design within its front
+    pareto_front - finds the power vs cost Pareto front
+
+Returns:
+----------------
+    front - dict: the design variables, power, whether the power is above the hydraulic power (limited), RPM,
+            cost, payback time and yearly benefit of each design on the front, sorted by cost
+
+'''
+
+# imports
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from payback import household
+from feasibility import feasible
+from evaluation import design_power, limited
+
+# the design variables of each model and their default bounds
+DESIGN_VARIABLES = {
+    'breastshot': ('radius', 'width', 'num_blades', 'x_centre', 'y_centre'),
+    'undershot': ('radius', 'width', 'num_blades', 'y_centre'),
+}
+DEFAULT_BOUNDS = {
+    'radius': (0.3, 1.0),
+    'width': (0.5, 2.0),
+    'num_blades': (3, 12),
+    'x_centre': (0, 2),
+    'y_centre': (-1.5, 0.5),
+}
+UNDERSHOT_Y_BOUNDS = (0.169, 1.0)
+
+
+class cost_model():
+    '''
+    A simple turbine cost model - a fixed cost plus costs scaling with the bucket area (radius * width) and
+    with the number of blades. The defaults give about £4000 for the standard 0.504 m x 1.008 m 6 blade
+    turbine, the fixed turbine_cost used in payback.py.
+
+    Parameters:
+    ----------------
+        base - float: fixed cost (generator, frame, installation) in £
+        area_rate - float: cost per m^2 of radius * width in £
+        blade_cost - float: cost per blade in £
+    '''
+    def __init__(self, base=2000, area_rate=3000, blade_cost=80):
+        self.base = base
+        self.area_rate = area_rate
+        self.blade_cost = blade_cost
+
+    def cost(self, radius, width, num_blades):
+        return self.base + self.area_rate * np.asarray(radius) * np.asarray(width) + self.blade_cost * np.asarray(num_blades)
+
+
+def evaluate_designs(river, model, designs, cap=False):
+    '''
+    calculate the best average power (over evaluation.RPM_RANGE, with cap at most the hydraulic power of the
+    river) and its RPM for each design - designs is an array with a row per design and a column per design
+    variable of the model
+    '''
+    names = DESIGN_VARIABLES[model]
+    power = np.zeros(len(designs))
+    RPM = np.zeros(len(designs))
+
+    # breastshot designs that can not reach the nappe produce nothing and are not built
+    reachable = np.ones(len(designs), dtype=bool)
+    if model == 'breastshot' and len(designs):
+        reachable = feasible(river, designs[:, names.index('x_centre')], designs[:, names.index('y_centre')], designs[:, names.index('radius')])
+
+    for i in np.nonzero(reachable)[0]:
+        power[i], RPM[i] = design_power(river, model, dict(zip(names, designs[i])), cap=cap)
+
+    return power, RPM
+
+
+def _evaluate(river, model, designs, pool, workers):
+    # score the designs (limited to the hydraulic power), split into one chunk per worker when there is a pool
+    if pool is None:
+        return evaluate_designs(river, model, designs, cap=True)
+
+    chunks = np.array_split(designs, workers)
+    results = list(pool.map(evaluate_designs, [river] * workers, [model] * workers, chunks, [True] * workers))
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+def non_dominated_sort(F):
+    '''
+    rank the rows of F (objectives to minimise) into non-dominated fronts, 0 being the Pareto front
+
+    the dominance of every pair is found at once, the fronts are then peeled off in turn
+    '''
+    F = np.asarray(F)
+    n = len(F)
+
+    # dominates[i, j] - row i is no worse in every objective and better in at least one
+    le = np.all(F[:, None, :] <= F[None, :, :], axis=2)
+    lt = np.any(F[:, None, :] < F[None, :, :], axis=2)
+    dominates = le & lt
+
+    n_dominating = dominates.sum(axis=0)
+    rank = np.full(n, -1)
+    front = 0
+    remaining = np.ones(n, dtype=bool)
+    while remaining.any():
+        current = remaining & (n_dominating == 0)
+        rank[current] = front
+        remaining &= ~current
+        n_dominating = n_dominating - dominates[current].sum(axis=0)
+        front += 1
+
+    return rank
+
+
+def crowding_distance(F, rank):
+    '''
+    the crowding distance of each row of F within its front - the extremes of each front are infinite
+    '''
+    F = np.asarray(F, dtype=float)
+    distance = np.zeros(len(F))
+
+    for front in np.unique(rank):
+        idx = np.nonzero(rank == front)[0]
+        if len(idx) < 3:
+            distance[idx] = np.inf
+            continue
+        for m in range(F.shape[1]):
+            order = idx[np.argsort(F[idx, m])]
+            span = F[order[-1], m] - F[order[0], m]
+            distance[order[0]] = distance[order[-1]] = np.inf
+            if span > 0:
+                distance[order[1:-1]] += (F[order[2:], m] - F[order[:-2], m]) / span
+
+    return distance
+
+
+def _select(F, n):
+    # keep the n best designs by rank then crowding distance
+    rank = non_dominated_sort(F)
+    distance = crowding_distance(F, rank)
+    order = np.lexsort((-distance, rank))
+    return order[:n], rank, distance
+
+
+def pareto_front(river, model='breastshot', cost=None, home=None, pop_size=100, generations=30, bounds=None, workers=1, seed=None, trace=None):
+    '''
+    find the power vs cost Pareto front of turbine designs for the river
+    '''
+    if cost is None:
+        cost = cost_model()
+    if home is None:
+        home = household('medium')
+
+    names = DESIGN_VARIABLES[model]
+    all_bounds = dict(DEFAULT_BOUNDS)
+    if model == 'undershot':
+        all_bounds['y_centre'] = UNDERSHOT_Y_BOUNDS
+    all_bounds.update(bounds or {})
+    lo = np.array([all_bounds[name][0] for name in names], dtype=float)
+    hi = np.array([all_bounds[name][1] for name in names], dtype=float)
+    blades = names.index('num_blades')
+
+    rng = np.random.default_rng(seed)
+
+    def objectives(designs, power):
+        # maximise power and minimise cost
+        c = cost.cost(designs[:, 0], designs[:, 1], np.round(designs[:, blades]))
+        return np.column_stack([-power, c]), c
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        designs = lo + rng.random((pop_size, len(names))) * (hi - lo)
+        power, RPM = _evaluate(river, model, designs, pool, workers)
+        F, c = objectives(designs, power)
+
+        if trace is not None:
+            best = np.argmax(power)
+            trace.evaluated(designs[best], power[best], n=pop_size)
+            trace.iteration_done(front_size=int(np.sum(non_dominated_sort(F) == 0)))
+
+        for _ in range(generations):
+            # binary tournaments on rank then crowding distance to pick the parents
+            _, rank, distance = _select(F, len(F))
+            a, b = rng.integers(len(F), size=(2, pop_size))
+            better = (rank[a] < rank[b]) | ((rank[a] == rank[b]) & (distance[a] > distance[b]))
+            parents = np.where(better, a, b)
+
+            # blend crossover of pairs of parents then gaussian mutation, kept inside the bounds
+            mates = parents[rng.permutation(pop_size)]
+            w = rng.uniform(-0.25, 1.25, size=(pop_size, len(names)))
+            children = designs[parents] * w + designs[mates] * (1 - w)
+            mutate = rng.random((pop_size, len(names))) < 1 / len(names)
+            children += mutate * rng.normal(0, 0.1, size=children.shape) * (hi - lo)
+            children = np.clip(children, lo, hi)
+
+            child_power, child_RPM = _evaluate(river, model, children, pool, workers)
+
+            # keep the best of the parents and children
+            designs = np.vstack([designs, children])
+            power = np.concatenate([power, child_power])
+            RPM = np.concatenate([RPM, child_RPM])
+            F, c = objectives(designs, power)
+
+            keep, _, _ = _select(F, pop_size)
+            designs, power, RPM, F, c = designs[keep], power[keep], RPM[keep], F[keep], c[keep]
+
+            if trace is not None:
+                # the best power found so far (the most powerful design is an end of the front, so it is
+                # always kept), with the size of the current front
+                best = np.argmax(power)
+                trace.evaluated(designs[best], power[best], n=pop_size)
+                trace.iteration_done(front_size=int(np.sum(non_dominated_sort(F) == 0)))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if trace is not None:
+            trace.flush()
+
+    # the non-dominated designs that produce power, one of each distinct power and cost (the same design
+    # can survive several times, and designs limited to the hydraulic power can tie)
+    rank = non_dominated_sort(F)
+    on_front = np.nonzero((rank == 0) & (power > 0))[0]
+    _, first = np.unique(np.round(F[on_front], 6), axis=0, return_index=True)
+    on_front = on_front[first]
+    order = on_front[np.argsort(c[on_front])]
+
+    # the payback of the power the design is scored on, with the model's own power at its RPM reported
+    payback_time, benefit = home.payback_batch(power[order], c[order])
+    raw = np.array([design_power(river, model, dict(zip(names, designs[i])), RPM=RPM[i])[0] for i in order])
+
+    front = {name: designs[order, k] for k, name in enumerate(names)}
+    front['num_blades'] = np.round(front['num_blades']).astype(int)
+    front.update(power=raw, limited=limited(raw, river, model), RPM=RPM[order], cost=c[order],
+                 payback_time=payback_time, benefit=benefit)
+    return front
+
+
+if __name__ == "__main__":
+    import time
+    from river_class import river_obj
+
+    river = river_obj(width=0.77, depth=0.3, velocity=1.5, head=2)
+
+    start = time.time()
+    front = pareto_front(river, pop_size=80, generations=20, seed=0)
+    print('Pareto front of %d designs in %.2f s\n' % (len(front['cost']), time.time() - start))
+
+    # a * marks a power above the hydraulic power of the river, paid back on the hydraulic power
+    print('  cost (£)  power (W)  payback (yr)  radius  width  blades')
+    for i in range(len(front['cost'])):
+        print('%10.0f %10.1f%s %12.2f %7.2f %6.2f %7d' % (front['cost'][i], front['power'][i], '*' if front['limited'][i] else ' ',
+                                                         front['payback_time'][i], front['radius'][i], front['width'][i], front['num_blades'][i]))
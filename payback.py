@@ -11,6 +11,7 @@ Parameters:
 Methods:
 ----------------
     household - object: the household object
+    payback_batch - the payback period and benefit for arrays of power and turbine cost, without printing
 
 Returns:
 ----------------
@@ -103,3 +104,21 @@ class household():
 
 
             
+
+    def payback_batch(self, avg_power, turbine_cost=None):
+        # calculate the payback period for many turbines at once (as payback but without printing)
+        # avg_power - array: the average power of each turbine in W
+        # turbine_cost - array: the cost of each turbine in £, the household turbine_cost if not given
+        if turbine_cost is None:
+            turbine_cost = self.turbine_cost
+
+        # calculate the energy produced by each turbine in a year kWh/year
+        energy_produced = np.asarray(avg_power) * 365 * 24 / 1000
+        energy_diff = self.yearly_usage - energy_produced
+
+        # sell back any excess, otherwise save on the energy used
+        profit = np.where(energy_diff < 0, np.abs(energy_diff) * self.sell_back_rate, 0)
+        savings = np.where(energy_diff < 0, self.unit_charge * self.yearly_usage, self.unit_charge * np.abs(energy_diff))
+
+        benefit = profit + savings
+        return turbine_cost / benefit, benefit
@@ -0,0 +1,210 @@
+'''
+This module contains a compact columnar store for turbine evaluation results. Sweeps and optimisations
+can produce millions of evaluations, so rather than growing a pandas DataFrame row by row (and keeping
+every turbine object alive) each evaluation is reduced to a fixed width record of parameters, average
+power, theta range and a status flag.
+
+Each column is held as its own 1D numpy array, either in memory or as a memory-mapped .npy file in a
+directory, so the store can be appended to in chunks and exported to pandas without copying.
+
+Parameters:
+----------------
+    path - string: directory for the memory-mapped column files, None to keep the store in memory
+    float32 - bool: store the float columns as float32 to halve the memory use
+    capacity - int: the number of rows to allocate initially (grows by doubling)
+
+Methods:
+----------------
+    append - append a chunk of evaluations given as column arrays
+    append_turbine - append a single evaluated turbine object
+    column - return a view of one column
+    to_dataframe - export the store to a pandas DataFrame without copying
+    flush - write the memory-mapped columns and row count to disk
+
+Returns:
+----------------
+    result_store - object: the store, len(store) is the number of rows held
+
+NOTE a path that already holds a store is reopened and appended to, the float32 setting is then taken
+from the files on disk.
+
+'''
+
+# imports
+import os
+import json
+import numpy as np
+
+# status flags - these are bit flags so more than one can be set for a row
+OK = 0
+NO_INTERSECT = 1 # the turbine does not meet the river
+NAN_POWER = 2 # the model returned nan
+ERROR = 4 # the evaluation raised an exception
+
+# the float columns in the order they are stored
+FLOAT_FIELDS = ('radius', 'width', 'x_centre', 'y_centre', 'RPM', 'avg_power', 'theta_entry', 'theta_exit', 'theta_range')
+
+
+class result_store():
+    # constructor
+    def __init__(self, path=None, float32=False, capacity=65536):
+
+        self.path = path
+        self.float_dtype = np.dtype(np.float32 if float32 else np.float64)
+        self.n = 0
+
+        # the fixed width layout of a record
+        self.dtypes = {name: self.float_dtype for name in FLOAT_FIELDS}
+        self.dtypes['num_blades'] = np.dtype(np.int16)
+        self.dtypes['status'] = np.dtype(np.uint8)
+
+        if self.path is not None and os.path.exists(os.path.join(self.path, 'meta.json')):
+            # reopen an existing store
+            with open(os.path.join(self.path, 'meta.json')) as f:
+                meta = json.load(f)
+            self.n = meta['n']
+            self.float_dtype = np.dtype(meta['float_dtype'])
+            self.dtypes.update({name: self.float_dtype for name in FLOAT_FIELDS})
+            self.capacity = meta['capacity']
+            self.columns = {name: np.load(self._file(name), mmap_mode='r+') for name in self.dtypes}
+        else:
+            if self.path is not None:
+                os.makedirs(self.path, exist_ok=True)
+            self.capacity = max(int(capacity), 1)
+            self.columns = {name: self._allocate(name, self.capacity) for name in self.dtypes}
+
+    def _file(self, name):
+        return os.path.join(self.path, name + '.npy')
+
+    def _allocate(self, name, capacity):
+        # allocate a column either in memory or as a memory-mapped file
+        if self.path is None:
+            return np.zeros(capacity, dtype=self.dtypes[name])
+        return np.lib.format.open_memmap(self._file(name), mode='w+', dtype=self.dtypes[name], shape=(capacity,))
+
+    def _grow(self, needed):
+        '''
+        grow every column to hold at least the needed number of rows, doubling the capacity so that
+        chunked appends are amortised
+        '''
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+
+        for name, old in self.columns.items():
+            if self.path is None:
+                new = np.zeros(capacity, dtype=self.dtypes[name])
+                new[:self.n] = old[:self.n]
+            else:
+                # write the larger column to a temporary file then swap it in
+                tmp = self._file(name) + '.tmp'
+                new = np.lib.format.open_memmap(tmp, mode='w+', dtype=self.dtypes[name], shape=(capacity,))
+                new[:self.n] = old[:self.n]
+                new.flush()
+                del old
+                os.replace(tmp, self._file(name))
+                new = np.load(self._file(name), mmap_mode='r+')
+            self.columns[name] = new
+
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.n
+
+    def append(self, **cols):
+        '''
+        append a chunk of evaluations, each keyword is a column name and the values are scalars or
+        equal length arrays - missing columns are left as 0 (nan for the float columns)
+        '''
+        arrays = {name: np.atleast_1d(np.asarray(val)) for name, val in cols.items()}
+        unknown = set(arrays) - set(self.dtypes)
+        if unknown:
+            raise ValueError('unknown columns: %s' % ', '.join(sorted(unknown)))
+
+        # the chunk length is the longest column, scalars are broadcast
+        m = max((len(a) for a in arrays.values()), default=0)
+        if m == 0:
+            return 0
+
+        if self.n + m > self.capacity:
+            self._grow(self.n + m)
+
+        for name, col in self.columns.items():
+            if name in arrays:
+                col[self.n:self.n + m] = np.broadcast_to(arrays[name], (m,))
+            elif name in FLOAT_FIELDS:
+                col[self.n:self.n + m] = np.nan
+            else:
+                col[self.n:self.n + m] = 0
+
+        self.n += m
+        return m
+
+    def append_turbine(self, turbine, status=OK):
+        '''
+        append a single turbine object (breastTurbine or underTurbine) at its current inputs - the power is
+        that of turbine.analysis(), so a turbine moved since it was last analysed is not recorded with a stale
+        power, and a breastshot turbine that misses the river is recorded with NO_INTERSECT. Only the fixed
+        width record is kept so the turbine object can be released
+        '''
+        avg_power = float(turbine.analysis())
+        theta_entry = getattr(turbine, 'theta_entry', getattr(turbine, 'alpha1', np.nan))
+        theta_exit = getattr(turbine, 'theta_exit', getattr(turbine, 'alpha2', np.nan))
+
+        # the analysis stops at the theta range stage when the turbine does not meet the river
+        if 'theta_range' in turbine.STAGES and turbine.run_stage('theta_range'):
+            theta_entry = theta_exit = np.nan
+            if status == OK:
+                status = NO_INTERSECT
+        elif status == OK and np.isnan(avg_power):
+            status = NAN_POWER
+
+        return self.append(radius=turbine.radius, width=turbine.width, num_blades=turbine.num_blades,
+                           x_centre=turbine.x_centre, y_centre=turbine.y_centre, RPM=turbine.RPM,
+                           avg_power=avg_power, theta_entry=theta_entry, theta_exit=theta_exit,
+                           theta_range=theta_exit - theta_entry, status=status)
+
+    def column(self, name):
+        # return a view of the filled part of a column
+        return self.columns[name][:self.n]
+
+    def to_dataframe(self):
+        '''
+        export the store to a pandas DataFrame - the columns are views of the store so no data is copied
+        '''
+        import pandas as pd
+
+        return pd.DataFrame({name: self.column(name) for name in self.dtypes}, copy=False)
+
+    def flush(self):
+        # write the memory-mapped columns and the row count to disk
+        if self.path is None:
+            return 0
+
+        for col in self.columns.values():
+            col.flush()
+
+        meta = {'n': self.n, 'capacity': self.capacity, 'float_dtype': self.float_dtype.name}
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        return 0
+
+
+if __name__ == "__main__":
+    import time
+    import tempfile
+
+    # append 10 million evaluations in chunks of 100k
+    store = result_store(path=tempfile.mkdtemp(), float32=True)
+    chunk = 100000
+
+    start = time.time()
+    for i in range(100):
+        x = np.random.uniform(0, 2, chunk)
+        store.append(radius=0.504, width=1.008, num_blades=6, x_centre=x, y_centre=-0.1, RPM=15,
+                     avg_power=np.random.uniform(0, 500, chunk), status=OK)
+    store.flush()
+    print('Appended %d rows in %.2f s' % (len(store), time.time() - start))
+
+    df = store.to_dataframe()
+    print(df.describe())
@@ -1,6 +1,17 @@
 # imports
 import numpy as np
-import matplotlib.pyplot as plt
+
+__all__ = ['np', 'river_obj', 'stack_rivers']
+
+# matplotlib is only needed for plotting, plt is imported on first use
+_LAZY = {'plt': 'matplotlib.pyplot'}
+
+def __getattr__(name):
+    if name in _LAZY:
+        import importlib
+        return importlib.import_module(_LAZY[name])
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
 
 '''
 This class will construct a river object that will contain all the information needed
@@ -11,17 +22,21 @@ The measurement inputs to this class should be relatively easy to achieve.
 
 Parameters:
 ----------------
-    width - float: the width of the river in m prior to a nappe (if applicable)
-    depth - float: the depth of the river in m prior to a nappe (if applicable)
-    velocity - float: the free stream velocity of the river prior to a nappe (if applicable)
-    head - float: the head of the waterfall, 0 if not existant
+    width - float or array: the width of the river in m prior to a nappe (if applicable)
+    depth - float or array: the depth of the river in m prior to a nappe (if applicable)
+    velocity - float or array: the free stream velocity of the river prior to a nappe (if applicable)
+    head - float or array: the head of the waterfall, 0 if not existant
 
 Methods:
-NONE
+----------------
+    select_turbine - selects the turbine type for the river, undershot for a zero head river
+                        and breastshot otherwise
+    stack_rivers - (function) one array-valued river object from a list of river objects
 
 Returns:
 ----------------
-    vol_flow_rate - float: the volumetric flow rate of the river
+    shape - tuple: the shape of the river conditions, () for a single river
+    vol_flow_rate - float or array: the volumetric flow rate of the river
     y_nappe - array: the y coordinates of the 'top' of the river
     x_nappe - array: the corresponding x coordinates
     y_bed - array: the y coordinates of the river bed
@@ -30,16 +45,25 @@ Returns:
 NOTE the returned coordinates are only after the nappe (assuming left to right flow)
 the head does not impact the calculations and can be left empty unless defined otherwise.
 
+Arrays of measurements are broadcast together so that one object holds many river conditions - the derived
+quantities are element-wise and the coordinates gain a trailing axis (shape + (1000,)). The turbine models
+evaluate a fixed turbine against every condition in one call.
+
 
 '''
 
 class river_obj():
     # constructor
     def __init__(self, width, depth, velocity, head=0 ):
+        if not all(np.isscalar(v) for v in (width, depth, velocity, head)):
+            # many river conditions at once
+            width, depth, velocity, head = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (width, depth, velocity, head)])
+
         self.width = width
         self.depth = depth
         self.velocity = velocity
         self.head = head
+        self.shape = np.shape(width)
 
 
         self.vol_flow_rate = width * depth * velocity # m^3/s
@@ -59,13 +83,30 @@ class river_obj():
         # define time - arbitrary 1000
         t = np.linspace(0, time, 1000) 
         # define x and y coordinates (after waterfall)
-        self.x_bed = self.velocity * t
-        self.y_bed = np.zeros(len(t))  - 0.5 * self.g * t**2
-        self.x_nappe = self.v_nappe * t
-        self.y_nappe = self.nappe_height * np.ones(len(t)) - 0.5 * self.g * t**2
+        self.x_bed = np.asarray(self.velocity)[..., None] * t
+        self.y_bed = np.zeros(self.shape + (len(t),))  - 0.5 * self.g * t**2
+        self.x_nappe = np.asarray(self.v_nappe)[..., None] * t
+        self.y_nappe = np.asarray(self.nappe_height)[..., None] * np.ones(len(t)) - 0.5 * self.g * t**2
+
+    def select_turbine(self):
+        # a zero head river has no nappe to fall onto a breastshot turbine so an undershot turbine is used
+        if self.shape:
+            return np.where(self.head <= 0, 'undershot', 'breastshot')
+        if self.head <= 0:
+            return 'undershot'
+        return 'breastshot'
+
+
+def stack_rivers(rivers):
+    '''
+    one river object holding the conditions of each river in the list, along its first axis
+    '''
+    return river_obj(*[np.array([getattr(river, name) for river in rivers], dtype=float) for name in ('width', 'depth', 'velocity', 'head')])
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
     # test the class
     test = river_obj(1, 1, 1, head=2)
 
@@ -0,0 +1,241 @@
+'''
+This module finds which design parameters drive the turbine power at a site, with variance-based (Sobol)
+global sensitivity indices. The first order index of a parameter is the share of the power variance it
+causes on its own, the total index includes its interactions with the other parameters - a parameter with
+a small total index can be frozen and dropped from later optimisations.
+
+The indices are estimated from Saltelli sample matrices (A, B and A with each column in turn taken from B)
+drawn from a scrambled Sobol sequence. The samples are drawn in batches and evaluated in chunks, optionally
+on a process pool, until the bootstrap confidence intervals of the indices are narrow enough. A row of A
+and its copies with the RPM or the blade count from B describe the same wheel, so they are evaluated in one
+call of the model over their blade counts and RPMs.
+
+The powers are the model's own, including those above the hydraulic power of the river (see evaluation.py)
+- the indices describe the model over the whole design space.
+
+Parameters:
+----------------
+    river - object: river object for the site
+    model - string: 'breastshot' or 'undershot'
+    bounds - dict: (min, max) of each parameter, the defaults are used for any not given
+    tol - float: the bootstrap 95% confidence interval half-width of every index to stop at
+    batch - int: the number of base samples drawn at a time (a power of 2)
+    max_samples - int: the maximum number of base samples
+    workers - int: the number of worker processes (1 evaluates in this process)
+
+Methods:
+----------------
+    evaluate_parameters - the average power of each row of parameters, rows of one wheel evaluated together
+    evaluate_blades - the best average power over a range of blade counts of each row of parameters
+    sobol_indices - the first order and total indices (with bootstrap confidence intervals) from the
+                    evaluations of the sample matrices
+    sensitivity - samples until the indices have converged
+    insensitive - the parameters that can be frozen
+
+Returns:
+----------------
+    sensitivity - dict: the parameter names, first order and total indices and their confidence interval
+                half-widths, the number of base samples and evaluations and whether the indices converged
+
+'''
+
+# imports
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from pareto import DEFAULT_BOUNDS, UNDERSHOT_Y_BOUNDS
+from evaluation import build_turbine, hydraulic_power, runaway_RPM
+
+# the parameters of each model
+PARAMETERS = {
+    'breastshot': ('radius', 'width', 'num_blades', 'x_centre', 'y_centre', 'RPM'),
+    'undershot': ('radius', 'width', 'num_blades', 'y_centre', 'RPM'),
+}
+RPM_BOUNDS = (1, 40)
+
+# the z value of a 95% confidence interval
+Z95 = 1.959963984540054
+
+
+def evaluate_parameters(river, model, X, names, cap=False):
+    '''
+    the average power of the turbine for each row of X (a column per parameter name), 0 where the turbine can
+    not be placed or is above its runaway RPM and, with cap, at most the hydraulic power of the river
+
+    rows that differ only in their RPM and blade count share a turbine, and all of their blade counts and
+    RPMs are evaluated in one analysis_blades call
+    '''
+    X = np.asarray(X, dtype=float)
+    names = list(names)
+    power = np.zeros(len(X))
+    if len(X) == 0:
+        return power
+
+    # the groups of rows with the same wheel, position and river
+    shared = [k for k, name in enumerate(names) if name not in ('RPM', 'num_blades')]
+    _, group = np.unique(X[:, shared], axis=0, return_inverse=True)
+    group = group.ravel()
+    order = np.argsort(group, kind='stable')
+    rows_of = np.split(order, np.flatnonzero(np.diff(group[order])) + 1)
+
+    available = hydraulic_power(river, model)
+    for rows in rows_of:
+        turbine = build_turbine(river, model, **dict(zip(names, X[rows[0]])))
+        if turbine is None:
+            continue
+        RPMs = X[rows, names.index('RPM')] if 'RPM' in names else np.full(len(rows), turbine.RPM)
+        counts = np.round(X[rows, names.index('num_blades')]).astype(int) if 'num_blades' in names else np.full(len(rows), turbine.num_blades)
+
+        # the power at every blade count (rows) and RPM (columns) of the group
+        RPM_values, RPM_index = np.unique(RPMs, return_inverse=True)
+        count_values, count_index = np.unique(counts, return_inverse=True)
+        try:
+            grid = np.nan_to_num(turbine.analysis_blades(count_values, RPM_values))
+        except ValueError:
+            continue
+        grid = np.where(RPM_values <= runaway_RPM(river, model, turbine.radius), grid, 0)
+        if cap:
+            grid = np.minimum(grid, available)
+        power[rows] = grid[count_index.ravel(), RPM_index.ravel()]
+    return power
+
+
+def evaluate_blades(river, model, X, names, blade_counts, cap=False):
+    '''
+    the best average power over blade_counts, and the count giving it, for each row of X (which has no
+    num_blades column) - all the counts of a row come from one shared evaluation, so the blade count can be
+    left out of a search. With cap the powers are at most the hydraulic power of the river.
+    '''
+    counts = np.asarray(blade_counts, dtype=int)
+    power = np.zeros(len(X))
+    best = np.full(len(X), counts[0])
+    available = hydraulic_power(river, model)
+    for i, row in enumerate(X):
+        turbine = build_turbine(river, model, **dict(zip(names, row)))
+        if turbine is None:
+            continue
+        try:
+            blade_power = np.nan_to_num(turbine.analysis_blades(counts))
+        except ValueError:
+            continue
+        blade_power = np.where(turbine.RPM <= runaway_RPM(river, model, turbine.radius), blade_power, 0)
+        if cap:
+            blade_power = np.minimum(blade_power, available)
+        k = np.argmax(blade_power)
+        power[i], best[i] = blade_power[k], counts[k]
+    return power, best
+
+
+def _evaluate(river, model, X, names, pool, workers, block=1):
+    # evaluate the rows, split into chunks (of whole blocks of rows) across the pool when there is one
+    if pool is None:
+        return evaluate_parameters(river, model, X, names)
+
+    blocks = np.array_split(X.reshape(-1, block, X.shape[1]), workers * 4)
+    chunks = [chunk.reshape(-1, X.shape[1]) for chunk in blocks]
+    results = pool.map(evaluate_parameters, [river] * len(chunks), [model] * len(chunks), chunks, [names] * len(chunks))
+    return np.concatenate(list(results))
+
+
+def sobol_indices(f_A, f_B, f_AB, n_bootstrap=200, seed=None):
+    '''
+    the first order (Saltelli 2010) and total (Jansen) indices from the evaluations of A, B and of A with
+    column i from B (f_AB[:, i]), with the 95% confidence interval half-widths from bootstrapping the rows
+    '''
+    def indices(a, b, ab):
+        variance = np.var(np.concatenate([a, b], axis=-1), axis=-1)[..., None]
+        variance = np.where(variance > 0, variance, np.inf)
+        first = np.mean(b[..., None] * (ab - a[..., None]), axis=-2) / variance
+        total = 0.5 * np.mean((a[..., None] - ab)**2, axis=-2) / variance
+        return first, total
+
+    first, total = indices(f_A, f_B, f_AB)
+
+    # every bootstrap resample of the rows at once
+    rows = np.random.default_rng(seed).integers(len(f_A), size=(n_bootstrap, len(f_A)))
+    boot_first, boot_total = indices(f_A[rows], f_B[rows], f_AB[rows])
+
+    return first, total, Z95 * np.std(boot_first, axis=0), Z95 * np.std(boot_total, axis=0)
+
+
+def sensitivity(river, model='breastshot', bounds=None, tol=0.05, batch=256, max_samples=4096, workers=1, seed=None):
+    '''
+    the Sobol first order and total indices of the average power with respect to each parameter, sampling
+    until every confidence interval half-width is within tol (or max_samples base samples are used)
+    '''
+    from scipy.stats import qmc
+
+    names = PARAMETERS[model]
+    all_bounds = dict(DEFAULT_BOUNDS, RPM=RPM_BOUNDS)
+    if model == 'undershot':
+        all_bounds['y_centre'] = UNDERSHOT_Y_BOUNDS
+    all_bounds.update(bounds or {})
+    lo = np.array([all_bounds[name][0] for name in names], dtype=float)
+    hi = np.array([all_bounds[name][1] for name in names], dtype=float)
+    d = len(names)
+
+    # A and B are the two halves of one Sobol sequence of dimension 2d
+    sampler = qmc.Sobol(d=2 * d, scramble=True, seed=seed)
+
+    f_A, f_B, f_AB = np.zeros(0), np.zeros(0), np.zeros((0, d))
+    converged = False
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        while len(f_A) < max_samples:
+            AB = np.tile(lo, 2) + sampler.random(batch) * np.tile(hi - lo, 2)
+            A, B = AB[:, :d], AB[:, d:]
+
+            # A with column i from B for each parameter, all evaluated together with A and B - the rows of
+            # each sample are kept together so a chunk holds whole samples
+            A_B = np.repeat(A[:, None, :], d, axis=1)
+            A_B[:, np.arange(d), np.arange(d)] = B
+            X = np.concatenate([A[:, None], B[:, None], A_B], axis=1).reshape(-1, d)
+
+            power = _evaluate(river, model, X, names, pool, workers, d + 2).reshape(batch, d + 2)
+            f_A = np.concatenate([f_A, power[:, 0]])
+            f_B = np.concatenate([f_B, power[:, 1]])
+            f_AB = np.concatenate([f_AB, power[:, 2:]])
+
+            first, total, first_ci, total_ci = sobol_indices(f_A, f_B, f_AB, seed=seed)
+            if max(first_ci.max(), total_ci.max()) <= tol:
+                converged = True
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return {
+        'names': names,
+        'first': first,
+        'total': total,
+        'first_ci': first_ci,
+        'total_ci': total_ci,
+        'n': len(f_A),
+        'evaluations': len(f_A) * (d + 2),
+        'converged': converged,
+    }
+
+
+def insensitive(result, threshold=0.05):
+    '''
+    the parameters whose total index is below threshold even at the top of its confidence interval - they
+    can be frozen (e.g. at a nominal value) to shrink the search space of an optimisation
+    '''
+    return [name for name, total, ci in zip(result['names'], result['total'], result['total_ci']) if total + ci < threshold]
+
+
+if __name__ == "__main__":
+    import time
+    from river_class import river_obj
+
+    river = river_obj(width=0.77, depth=0.3, velocity=1.5, head=2)
+
+    for model, site in (('breastshot', river), ('undershot', river_obj(width=0.77, depth=0.5, velocity=2))):
+        start = time.time()
+        result = sensitivity(site, model, tol=0.1, max_samples=2048, seed=0)
+        print('%s: %d evaluations in %.2f s (converged: %s)' % (model, result['evaluations'], time.time() - start, result['converged']))
+        for k, name in enumerate(result['names']):
+            print('    %-10s first %.3f +/- %.3f   total %.3f +/- %.3f' % (name, result['first'][k], result['first_ci'][k],
+                                                                       result['total'][k], result['total_ci'][k]))
+        print('    can be frozen:', insensitive(result))
@@ -0,0 +1,205 @@
+'''
+This module screens a table of candidate sites in batch. For each site a river object is built, the
+turbine type is selected from the head (undershot for a zero head river, breastshot otherwise), and the
+position and RPM of the turbine are optimised. Without a generator load each position is scored by the
+model's best power over RPM_RANGE; with one (operating_point.generator_load) it is scored at the RPM the
+turbine settles at against the load, all the positions of a grid being solved together. A site whose best
+power is more than the hydraulic power of the river is flagged as limited - the model has left its range
+there and the power should not be taken at face value.
+
+The site table is read row by row and the results are written as each site completes, so the site list
+never has to fit in memory. The sites are evaluated on a process pool with a bounded number of sites in
+flight. A site that fails is written with an error status rather than stopping the run.
+
+Parameters:
+----------------
+    sites_file - string: csv file with a row per site, columns width, depth, velocity, head and
+                    optionally site, radius, turbine_width, num_blades
+    results_file - string: csv file the results are written to
+    workers - int: the number of worker processes
+    max_in_flight - int: the maximum number of sites submitted to the pool at once
+    load - object: optional generator_load the turbines drive
+
+Methods:
+----------------
+    read_sites - streams the site table one row at a time
+    screen_site - selects the turbine and optimises the position and RPM for one site
+    screen_sites - screens every site in the table on a process pool
+
+Returns:
+----------------
+    results_file - csv: site, turbine_type, x_centre, y_centre, RPM, power, limited, status and error for each site
+
+'''
+
+# imports
+import csv
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from river_class import river_obj
+from feasibility import feasible, feasible_box
+from evaluation import RPM_RANGE, build_turbine, design_power, limited, runaway_RPM
+from operating_point import find_operating_point, RUNAWAY
+
+# the columns of the results file
+RESULT_FIELDS = ['site', 'turbine_type', 'x_centre', 'y_centre', 'RPM', 'power', 'limited', 'status', 'error']
+
+
+def read_sites(sites_file):
+    # stream the site table - one dictionary per row
+    with open(sites_file, newline='') as f:
+        for i, row in enumerate(csv.DictReader(f)):
+            row.setdefault('site', str(i))
+            if not row['site']:
+                row['site'] = str(i)
+            yield row
+
+
+def _score(river, model, designs, load=None):
+    '''
+    the power and RPM of each design (a dict of parameters) - its best power over RPM_RANGE, or with a load
+    its power at its operating point - a turbine that runs away from the load (or past an undershot wheel's
+    runaway RPM, as design_power) has no operating point and gives no power
+    '''
+    power, RPM = np.zeros(len(designs)), np.full(len(designs), RPM_RANGE[0])
+    if load is None:
+        for i, params in enumerate(designs):
+            power[i], RPM[i] = design_power(river, model, params)
+        return power, RPM
+
+    turbines = [build_turbine(river, model, **params) for params in designs]
+    built = [i for i, turbine in enumerate(turbines) if turbine is not None]
+    if built:
+        RPM[built], power[built], status = find_operating_point([turbines[i] for i in built], load)
+        radius = np.array([turbines[i].radius for i in built])
+        settled = (status != RUNAWAY) & (RPM[built] <= runaway_RPM(river, model, radius))
+        power[built] = np.where(settled, power[built], 0)
+    return power, RPM
+
+
+def _optimise_breast(river, radius, width, num_blades, n=9, levels=3, load=None):
+    '''
+    find the best position and RPM of a breastshot turbine - a grid of positions is searched (with the
+    whole RPM curve found at each position) and the grid is zoomed onto the best position
+
+    the grid covers the positions where the turbine can meet the nappe, above the downstream bed (the
+    bounds of breastTurbine.optimise)
+    '''
+    x_box, y_box = feasible_box(river, radius)
+    bounds = (max(0, x_box[0]), min(100, x_box[1])), (max(-river.head, y_box[0]), min(100, y_box[1]))
+    (x_lo, x_hi), (y_lo, y_hi) = bounds
+
+    best = (0, 0, RPM_RANGE[0], 0)
+    for _ in range(levels):
+        # positions where the turbine can not reach the nappe are dropped before any turbine is built
+        X, Y = np.meshgrid(np.linspace(x_lo, x_hi, n), np.linspace(y_lo, y_hi, n), indexing='ij')
+        reachable = feasible(river, X, Y, radius)
+        designs = [dict(radius=radius, width=width, num_blades=num_blades, x_centre=x, y_centre=y) for x, y in zip(X[reachable], Y[reachable])]
+        power, RPM = _score(river, 'breastshot', designs, load)
+        if len(designs) and power.max() > best[3]:
+            k = np.argmax(power)
+            best = (X[reachable][k], Y[reachable][k], RPM[k], power[k])
+
+        # zoom onto the best position, never past the bounds of the first grid
+        dx, dy = (x_hi - x_lo) / (n - 1), (y_hi - y_lo) / (n - 1)
+        x_lo, x_hi = max(best[0] - dx, bounds[0][0]), min(best[0] + dx, bounds[0][1])
+        y_lo, y_hi = max(best[1] - dy, bounds[1][0]), min(best[1] + dy, bounds[1][1])
+
+    return best
+
+
+def _optimise_under(river, radius, width, num_blades, barrel_radius=0.169, n=25, load=None):
+    '''
+    find the best height and RPM of an undershot turbine - y_centre is searched between the barrel
+    radius and the turbine radius with the whole RPM curve (or the operating point) found at each height
+    '''
+    best = (2, barrel_radius, RPM_RANGE[0], 0)
+    heights = np.linspace(barrel_radius, radius, n)
+    designs = [dict(radius=radius, barrel_radius=barrel_radius, width=width, num_blades=num_blades, y_centre=y) for y in heights]
+    power, RPM = _score(river, 'undershot', designs, load)
+    k = np.argmax(power)
+    if power[k] > best[3]:
+        best = (2, heights[k], RPM[k], power[k])
+
+    return best
+
+
+def screen_site(site, load=None):
+    '''
+    select the turbine type and optimise the position and RPM (against the load if given) for one site -
+    any error is recorded in the result rather than raised
+    '''
+    result = {'site': site.get('site', ''), 'status': 'ok', 'error': ''}
+    try:
+        river = river_obj(float(site['width']), float(site['depth']), float(site['velocity']), head=float(site.get('head') or 0))
+
+        radius = float(site.get('radius') or 0.504)
+        width = float(site.get('turbine_width') or 1.008)
+        num_blades = int(site.get('num_blades') or 6)
+
+        turbine_type = river.select_turbine()
+        if turbine_type == 'undershot':
+            x, y, RPM, power = _optimise_under(river, radius, width, num_blades, load=load)
+        else:
+            x, y, RPM, power = _optimise_breast(river, radius, width, num_blades, load=load)
+
+        result.update(turbine_type=turbine_type, x_centre=x, y_centre=y, RPM=RPM, power=power,
+                      limited=bool(limited(power, river, turbine_type)))
+        if power <= 0:
+            result['status'] = 'no power'
+
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+
+    return result
+
+
+def screen_sites(sites_file, results_file, workers=4, max_in_flight=None, load=None):
+    '''
+    screen every site in the sites file on a process pool, writing each result as it completes
+
+    at most max_in_flight sites are read and submitted at once so memory use is bounded however long
+    the site table is - the results are written in the order they complete
+    '''
+    if max_in_flight is None:
+        max_in_flight = 4 * workers
+
+    n_done = 0
+    with open(results_file, 'w', newline='') as f, ProcessPoolExecutor(max_workers=workers) as pool:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+
+        pending = set()
+        for site in read_sites(sites_file):
+            pending.add(pool.submit(screen_site, site, load))
+
+            # wait for a free slot before reading the next site
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    writer.writerow(future.result())
+                    n_done += 1
+                f.flush()
+
+        for future in wait(pending).done:
+            writer.writerow(future.result())
+            n_done += 1
+
+    return n_done
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Screen a table of candidate sites')
+    parser.add_argument('sites_file', help='csv with width, depth, velocity, head columns')
+    parser.add_argument('results_file', help='csv to write the results to')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    start = time.time()
+    n = screen_sites(args.sites_file, args.results_file, workers=args.workers)
+    print('Screened %d sites in %.2f s' % (n, time.time() - start))
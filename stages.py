@@ -0,0 +1,116 @@
+'''
+This module contains the staged evaluation used by the turbine classes. The analysis of a turbine is a
+chain of stages (intersections, theta range, filling rate, ...) and each stage only depends on some of
+the inputs. The stages and their dependencies are declared on the class, and setting an input only
+invalidates the stages that depend on it - so re-running the analysis after changing the RPM does not
+re-find the river intersection, for example.
+
+Parameters:
+----------------
+    INPUTS - tuple: the attribute names of the inputs, setting one of these invalidates its dependents
+    STAGES - dict: stage name -> (method name, dependencies), the dependencies are inputs or other stages
+
+Methods:
+----------------
+    run_stage - runs a stage (and any stale stages it depends on) if it is stale and returns its result
+    invalidate - marks the stages depending on an input or stage as stale
+
+    stage_hits counts the stage runs avoided because the stage was already up to date
+
+    superpose_blades - the per-theta power of all the blades for several blade counts at once (shared by the
+                        analysis_blades of both turbine models)
+
+NOTE only assignment of an input is tracked - changing a river object in place (rather than assigning a
+new river to the turbine) is not seen, call invalidate('river') after doing so.
+
+'''
+
+import numpy as np
+
+
+class staged():
+    INPUTS = ()
+    STAGES = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        # find every stage that depends (directly or through other stages) on each input and stage
+        dependents = {name: set() for name in list(cls.INPUTS) + list(cls.STAGES)}
+        for stage, (_, deps) in cls.STAGES.items():
+            for dep in deps:
+                dependents[dep].add(stage)
+
+        changed = True
+        while changed:
+            changed = False
+            for name, stages in dependents.items():
+                for stage in list(stages):
+                    if not dependents[stage] <= stages:
+                        stages |= dependents[stage]
+                        changed = True
+
+        cls._dependents = dependents
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self.INPUTS:
+            self.invalidate(name)
+
+    def invalidate(self, name):
+        # mark every stage depending on name as stale
+        fresh = self.__dict__.get('_fresh')
+        if fresh:
+            fresh -= self._dependents[name]
+        return 0
+
+    def run_stage(self, stage):
+        '''
+        run the stage if it is stale, running any stale stages it depends on first, and return the
+        result of the stage's method
+        '''
+        if '_fresh' not in self.__dict__:
+            object.__setattr__(self, '_fresh', set())
+            object.__setattr__(self, '_stage_results', {})
+            object.__setattr__(self, 'stage_hits', 0)
+
+        method, deps = self.STAGES[stage]
+        for dep in deps:
+            if dep in self.STAGES:
+                result = self.run_stage(dep)
+                if result:
+                    # a stage failed (e.g. the turbine is not in the river) so this one can not run
+                    return result
+
+        if stage not in self._fresh:
+            self._stage_results[stage] = getattr(self, method)()
+            self._fresh.add(stage)
+        else:
+            self.__dict__['stage_hits'] += 1
+
+        return self._stage_results[stage]
+
+
+def superpose_blades(power, counts):
+    '''
+    the roll superposition of the blades (as find_avg_power / find_average_power) for each blade count in
+    counts - power has a leading blade count axis and theta as its last axis. The shifted thetas of every
+    count are one (count, max count, theta) index, padded to the largest count and masked, so all the
+    counts are gathered and summed together
+    '''
+    counts = np.asarray(counts, dtype=int)
+    power = np.asarray(power)
+    n_theta = power.shape[-1]
+
+    # the roll of each blade of each count, the blades beyond a count are masked out
+    blade = np.arange(counts.max())
+    valid = blade[None, :] < counts[:, None]
+    shifts = np.where(valid, (blade[None, :] * (100 / counts[:, None])).astype(int), 0)
+    index = (np.arange(n_theta)[None, None, :] - shifts[:, :, None]) % n_theta
+
+    # gather (count, other axes, blade, theta) and sum over the blades
+    flat = power.reshape(len(counts), -1, n_theta)
+    rolled = flat[np.arange(len(counts))[:, None, None, None], np.arange(flat.shape[1])[None, :, None, None],
+                  index[:, None, :, :]]
+    total = np.sum(rolled * valid[:, None, :, None], axis=-2)
+    return total.reshape(power.shape)
@@ -0,0 +1,296 @@
+'''
+This module optimises the turbine design with far fewer model evaluations than the particle swarm of
+optimisation.ipynb, by fitting a cheap surrogate of the power (a Gaussian process) to the evaluations made
+so far. Each round the surrogate picks a batch of new designs by expected improvement - the batch is filled
+by the 'kriging believer' rule (each chosen design is added to the surrogate at its predicted power before
+the next is chosen) - and the batch is evaluated together, optionally on a process pool. The search stops
+once the best expected improvement is below a threshold.
+
+The surrogate is fitted to log(1 + power) in the unit cube of the parameter bounds, which evens out the
+very large spread of powers over a design space. The powers are those of sensitivity.evaluate_parameters,
+by default (cap) limited to the hydraulic power of the river, so a search can reach that ceiling but not
+climb past it into the designs the model credits with more than the flow carries - the result says whether
+the best design is at the ceiling.
+
+Parameters:
+----------------
+    river - object: river object for the site
+    model - string: 'breastshot' or 'undershot'
+    bounds - dict: (min, max) of each parameter, as sensitivity.py
+    batch - int: the number of designs evaluated each round
+    max_evaluations - int: the evaluation budget
+    ei_tol - float: the expected improvement (of the standardised log power) to stop at
+    workers - int: the number of worker processes (1 evaluates in this process)
+    cap - bool: score the designs on their power limited to the hydraulic power of the river
+    trace - object: optional traces.trace_writer recording each round
+
+Methods:
+----------------
+    gaussian_process - the surrogate
+    expected_improvement - the expected improvement of designs over the best so far
+    optimise_surrogate - the surrogate-assisted optimisation
+    pso_baseline - the particle swarm baseline (pyswarms GlobalBestPSO)
+    evaluations_to_reach - the number of evaluations a search took to reach a power
+
+Returns:
+----------------
+    optimise_surrogate - dict: the best parameters and power, whether that power is limited, the number of
+                        evaluations and rounds, the best power after each round and whether the search
+                        converged
+
+'''
+
+# imports
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from sensitivity import PARAMETERS, RPM_BOUNDS, evaluate_parameters, evaluate_blades
+from pareto import DEFAULT_BOUNDS, UNDERSHOT_Y_BOUNDS
+from evaluation import hydraulic_power
+
+
+def _bounds(model, bounds):
+    # the (min, max) arrays of the model's parameters
+    names = PARAMETERS[model]
+    all_bounds = dict(DEFAULT_BOUNDS, RPM=RPM_BOUNDS)
+    if model == 'undershot':
+        all_bounds['y_centre'] = UNDERSHOT_Y_BOUNDS
+    all_bounds.update(bounds or {})
+    lo = np.array([all_bounds[name][0] for name in names], dtype=float)
+    hi = np.array([all_bounds[name][1] for name in names], dtype=float)
+    return names, lo, hi
+
+
+def _evaluate(river, model, X, names, pool, workers, cap):
+    # evaluate the designs, split into one chunk per worker when there is a pool
+    if pool is None:
+        return evaluate_parameters(river, model, X, names, cap)
+
+    chunks = np.array_split(X, workers)
+    return np.concatenate(list(pool.map(evaluate_parameters, [river] * workers, [model] * workers, chunks, [names] * workers,
+                                        [cap] * workers)))
+
+
+class gaussian_process():
+    '''
+    A Gaussian process with a squared exponential kernel of one length scale - the length scale is chosen
+    from a grid by the marginal likelihood (unless given) and the outputs are standardised.
+
+    Parameters:
+    ----------------
+        X - array: the inputs (scaled to the unit cube), a row per point
+        y - array: the outputs
+        noise - float: the nugget added to the kernel diagonal (the model power is not smooth everywhere)
+        length - float: a fixed length scale
+    '''
+    LENGTH_SCALES = np.logspace(-1.5, 0.5, 15)
+
+    def __init__(self, X, y, noise=1e-4, length=None):
+        self.X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.mean = y.mean()
+        self.scale = y.std() if y.std() > 0 else 1
+        self.y = (y - self.mean) / self.scale
+        self.noise = noise
+
+        d2 = np.sum((self.X[:, None, :] - self.X[None, :, :])**2, axis=-1)
+        best = -np.inf
+        for scale in (self.LENGTH_SCALES if length is None else [length]):
+            try:
+                L = np.linalg.cholesky(np.exp(-0.5 * d2 / scale**2) + noise * np.eye(len(self.y)))
+            except np.linalg.LinAlgError:
+                continue
+            alpha = np.linalg.solve(L.T, np.linalg.solve(L, self.y))
+            likelihood = -0.5 * self.y @ alpha - np.sum(np.log(np.diag(L)))
+            if likelihood > best:
+                best, self.length, self.L, self.alpha = likelihood, scale, L, alpha
+
+    def predict(self, X):
+        # the mean and standard deviation (in the units of y) at each row of X
+        from scipy.linalg import solve_triangular
+
+        k = np.exp(-0.5 * np.sum((np.asarray(X)[:, None, :] - self.X[None, :, :])**2, axis=-1) / self.length**2)
+        v = solve_triangular(self.L, k.T, lower=True)
+        sd = np.sqrt(np.maximum(1 + self.noise - np.sum(v**2, axis=0), 1e-12))
+        return self.mean + self.scale * (k @ self.alpha), self.scale * sd
+
+
+def expected_improvement(mu, sd, best, xi=0.01):
+    # the expected improvement over best (maximising) of points with mean mu and standard deviation sd
+    from scipy.special import ndtr
+
+    z = (mu - best - xi) / sd
+    return (mu - best - xi) * ndtr(z) + sd * np.exp(-0.5 * z**2) / np.sqrt(2 * np.pi)
+
+
+def _candidates(rng, U, y, n=2048):
+    # random designs across the cube and around the best designs so far
+    d = U.shape[1]
+    top = U[np.argsort(y)[-5:]]
+    local = top[rng.integers(len(top), size=n // 2)] + rng.normal(0, 0.05, size=(n // 2, d))
+    return np.clip(np.vstack([rng.random((n // 2, d)), local]), 0, 1)
+
+
+def _select_batch(gp, U, y, candidates, batch, ei_tol):
+    '''
+    the batch of candidates by expected improvement, each choice believed at its predicted value before the
+    next - empty when the best expected improvement (in standard deviations of y) is below ei_tol
+    '''
+    best = np.max(y)
+    chosen, believed = [], []
+    model = gp
+    for q in range(batch):
+        mu, sd = model.predict(candidates)
+        ei = expected_improvement(mu, sd, best, xi=0.01 * gp.scale)
+        k = np.argmax(ei)
+        if q == 0:
+            first_ei = ei[k] / gp.scale
+            if first_ei < ei_tol:
+                return np.zeros((0, U.shape[1])), first_ei
+        chosen.append(candidates[k])
+        believed.append(mu[k])
+        model = gaussian_process(np.vstack([U] + chosen), np.concatenate([y, believed]), length=gp.length)
+    return np.array(chosen), first_ei
+
+
+def optimise_surrogate(river, model='breastshot', bounds=None, batch=8, n_initial=None, max_evaluations=400, ei_tol=1e-3,
+                       workers=1, cap=True, seed=None, trace=None):
+    '''
+    maximise the average power over the parameters of the model with a Gaussian process surrogate, starting
+    from n_initial Sobol points (about 4 per parameter, rounded up to a power of 2, by default)
+    '''
+    from scipy.stats import qmc
+
+    names, lo, hi = _bounds(model, bounds)
+    d = len(names)
+    rng = np.random.default_rng(seed)
+    n_initial = n_initial if n_initial is not None else 2 ** int(np.ceil(np.log2(4 * d)))
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        # a space filling start
+        U = qmc.Sobol(d=d, scramble=True, seed=seed).random(n_initial)
+        power = _evaluate(river, model, lo + U * (hi - lo), names, pool, workers, cap)
+        history = [power.max()]
+        converged = False
+
+        if trace is not None:
+            trace.evaluated(lo + U[np.argmax(power)] * (hi - lo), power.max(), n=len(power))
+            trace.iteration_done()
+
+        while len(power) < max_evaluations:
+            y = np.log1p(np.maximum(power, 0))
+            gp = gaussian_process(U, y)
+            chosen, ei = _select_batch(gp, U, y, _candidates(rng, U, y), min(batch, max_evaluations - len(power)), ei_tol)
+            if len(chosen) == 0:
+                converged = True
+                break
+
+            new_power = _evaluate(river, model, lo + chosen * (hi - lo), names, pool, workers, cap)
+            U = np.vstack([U, chosen])
+            power = np.concatenate([power, new_power])
+            history.append(power.max())
+
+            if trace is not None:
+                trace.evaluated(lo + chosen[np.argmax(new_power)] * (hi - lo), new_power.max(), n=len(new_power))
+                trace.iteration_done(expected_improvement=float(ei))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if trace is not None:
+            trace.flush()
+
+    k = np.argmax(power)
+    params = dict(zip(names, lo + U[k] * (hi - lo)))
+    params['num_blades'] = int(round(params['num_blades']))
+    return {'params': params, 'power': power[k], 'limited': _limited(river, model, power[k], cap),
+            'evaluations': len(power), 'rounds': len(history) - 1, 'history': np.array(history), 'powers': power,
+            'converged': converged}
+
+
+def _limited(river, model, power, cap):
+    # whether a best power is at (scored with cap) or above the hydraulic power of the river
+    available = hydraulic_power(river, model)
+    return bool(power >= available if cap else power > available)
+
+
+def evaluations_to_reach(powers, target):
+    # the number of evaluations (in the order made) until the best power first reaches target, None if never
+    hits = np.nonzero(np.maximum.accumulate(powers) >= target)[0]
+    return int(hits[0]) + 1 if len(hits) else None
+
+
+def pso_baseline(river, model='breastshot', bounds=None, n_particles=20, iters=50, init_pos=None, blade_counts=None, cap=True,
+                 seed=None, trace=None):
+    '''
+    the particle swarm of optimisation.ipynb over the same parameters and bounds, with every evaluated power
+    in the order made - init_pos are optional starting positions (e.g. warm_start_store.swarm_init)
+
+    with blade_counts the swarm has no num_blades dimension, each particle is scored by its best count of
+    blade_counts from one shared evaluation (sensitivity.evaluate_blades)
+    '''
+    from pyswarms.single.global_best import GlobalBestPSO
+
+    names, lo, hi = _bounds(model, bounds)
+    if blade_counts is not None:
+        keep = [k for k, name in enumerate(names) if name != 'num_blades']
+        names, lo, hi = tuple(names[k] for k in keep), lo[keep], hi[keep]
+    powers = []
+
+    def fun(X):
+        if blade_counts is None:
+            power = evaluate_parameters(river, model, X, names, cap)
+        else:
+            power, _ = evaluate_blades(river, model, X, names, blade_counts, cap)
+        powers.append(power)
+        return -power
+
+    if trace is not None:
+        fun = trace.swarm_objective(fun)
+
+    # pyswarms draws from the global numpy generator - it is seeded for the search only and the caller's
+    # state is put back afterwards
+    state = np.random.get_state()
+    try:
+        if seed is not None:
+            np.random.seed(seed)
+        optimiser = GlobalBestPSO(n_particles=n_particles, dimensions=len(names), options={'c1': 0.5, 'c2': 0.3, 'w': 0.9},
+                                  bounds=(lo, hi), init_pos=init_pos)
+        cost, pos = optimiser.optimize(fun, iters=iters, verbose=False)
+    finally:
+        np.random.set_state(state)
+
+    if trace is not None:
+        trace.flush()
+
+    powers = np.concatenate(powers)
+    params = dict(zip(names, pos))
+    if blade_counts is None:
+        params['num_blades'] = int(round(params['num_blades']))
+    else:
+        params['num_blades'] = int(evaluate_blades(river, model, pos[None, :], names, blade_counts, cap)[1][0])
+    return {'params': params, 'power': -cost, 'limited': _limited(river, model, -cost, cap), 'evaluations': len(powers),
+            'powers': powers}
+
+
+if __name__ == "__main__":
+    import time
+    from river_class import river_obj
+
+    river = river_obj(width=0.77, depth=0.3, velocity=1.5, head=2)
+
+    for model, site in (('breastshot', river), ('undershot', river_obj(width=0.77, depth=0.5, velocity=2))):
+        print('%s: the river carries %.1f W' % (model, hydraulic_power(site, model)))
+        start = time.time()
+        result = optimise_surrogate(site, model, seed=0)
+        print('%s surrogate: %.1f W%s after %d evaluations in %d rounds (converged: %s, %.1f s)'
+              % (model, result['power'], ' (limited)' if result['limited'] else '', result['evaluations'], result['rounds'],
+                 result['converged'], time.time() - start))
+        print('    ', {name: round(float(value), 3) for name, value in result['params'].items()})
+
+        # the swarm of the notebook, and the evaluations each method took to reach 99% of the other's best
+        pso = pso_baseline(site, model, seed=0)
+        target = 0.99 * min(result['power'], pso['power'])
+        print('%s PSO: %.1f W after %d evaluations' % (model, pso['power'], pso['evaluations']))
+        print('    evaluations to reach %.1f W - surrogate: %s, PSO: %s'
+              % (target, evaluations_to_reach(result['powers'], target), evaluations_to_reach(pso['powers'], target)))
@@ -0,0 +1,380 @@
+'''
+This module compares live telemetry from an installed turbine with the model as it is logged, rather than
+afterwards as in validation.ipynb. The log has the columns of testData.csv (position, turbine and generator
+RPM and output power) and is read as it grows - by tailing the log file or from a local socket - in
+micro-batches of the lines available.
+
+Each micro-batch is predicted in one analysis call per turbine position (the position rarely changes, so
+the turbines are kept), and the error of every sample is added to rolling statistics over a fixed window.
+Drift is found with a two-sided CUSUM of the relative error standardised by its mean and spread over a
+reference period at the start of the log (and again after each alarm) - the model need not match the
+turbine exactly, only a change in how it differs is flagged. The threshold is high because at high logging
+rates even rare false alarms add up, the shift of a real drift soon crosses it. Memory is bounded by the
+window, the turbines kept and the drift events kept.
+
+Parameters:
+----------------
+    river - object: river object of the installation
+    turbine - dict: the breastTurbine geometry (radius, width, num_blades), the position comes from the log
+    gear_ratio - float: generator RPM / turbine RPM, used when the log has no turbine RPM
+    window - int: the number of samples in the rolling statistics
+    reference - int: the number of samples the error reference is taken from
+    slack, threshold - float: the CUSUM allowance and decision threshold in standard deviations
+
+Methods:
+----------------
+    telemetry_monitor - the model comparison, fed with lines of the log
+    file_batches - micro-batches of the lines appended to a growing log file
+    socket_batches - micro-batches of the lines read from a local socket
+    monitor_stream - feeds a source of micro-batches to a monitor
+
+Returns:
+----------------
+    telemetry_monitor.feed - dict: the predicted power, error and drift flag of each sample of the batch
+    telemetry_monitor.stats - dict: the rolling error statistics, the CUSUM state and the drift events
+
+'''
+
+# imports
+import os
+import time
+import socket
+import collections
+import numpy as np
+
+from breastshot_calcs import breastTurbine
+
+# the columns of the log (as testData.csv)
+COLUMNS = {
+    'x': 'x centre [m]',
+    'y': 'y centre [m]',
+    'power': 'Output power [kW]',
+    'RPM': 'Turbine rotational speed [RPM]',
+    'generator_RPM': 'Generator rotational speed [RPM]',
+}
+
+# the gear ratio of the test rig (231.2 / 14.5 generator / turbine RPM)
+GEAR_RATIO = 231.2 / 14.5
+
+# the most turbine positions (and drift events) kept
+MAX_TURBINES = 16
+MAX_EVENTS = 100
+
+
+class telemetry_monitor():
+    '''
+    Predicts the power of each logged sample, keeps rolling error statistics and flags drift.
+
+    Parameters:
+    ----------------
+        river - object: river object of the installation
+        turbine - dict: keyword arguments of breastTurbine other than the river and position
+        gear_ratio - float: generator RPM / turbine RPM
+        window - int: samples in the rolling statistics
+        reference - int: samples the relative error reference (mean and standard deviation) is taken from
+        slack - float: the CUSUM allowance in standard deviations
+        threshold - float: the CUSUM value in standard deviations that flags drift
+    '''
+    def __init__(self, river, turbine=None, gear_ratio=GEAR_RATIO, window=1000, reference=200, slack=1, threshold=20):
+        self.river = river
+        self.turbine = dict(turbine or {})
+        self.gear_ratio = gear_ratio
+        self.reference = reference
+        self.slack = slack
+        self.threshold = threshold
+
+        self.header = None
+        self.turbines = collections.OrderedDict()
+
+        # the ring buffers of the rolling window
+        self.window_error = np.zeros(window)
+        self.window_measured = np.zeros(window)
+        self.n = 0
+
+        # the reference error (running sums until reference samples are seen) and the CUSUM
+        self.ref_sum = self.ref_sq = 0.0
+        self.n_ref = 0
+        self.ref_mean = self.ref_sd = None
+        self.cusum_high = self.cusum_low = 0.0
+        self.events = collections.deque(maxlen=MAX_EVENTS)
+
+    def _turbine(self, x, y):
+        # the turbine at a position, the least recently used positions are dropped
+        key = (round(x, 6), round(y, 6))
+        if key in self.turbines:
+            self.turbines.move_to_end(key)
+        else:
+            self.turbines[key] = breastTurbine(self.river, x_centre=x, y_centre=y, **self.turbine)
+            if len(self.turbines) > MAX_TURBINES:
+                self.turbines.popitem(last=False)
+        return self.turbines[key]
+
+    def predict(self, x, y, RPM):
+        '''
+        the model power in kW of each sample - one analysis of all the RPMs at each distinct position
+        '''
+        predicted = np.zeros(len(RPM))
+        positions, which = np.unique(np.column_stack([x, y]), axis=0, return_inverse=True)
+        for p, (px, py) in enumerate(positions):
+            rows = which.ravel() == p
+            power = self._turbine(px, py).analysis(RPM[rows])
+            predicted[rows] = np.nan_to_num(power) / 1000
+        return predicted
+
+    def parse(self, lines):
+        '''
+        the position, turbine RPM and output power columns of the log lines - the first line seen is taken
+        as the header, lines that do not parse are skipped
+        '''
+        if self.header is None:
+            if not lines:
+                return np.zeros((0, 4))
+            names = [name.strip() for name in lines[0].lstrip('﻿').split(',')]
+            self.header = {name: k for name, k in zip(names, range(len(names)))}
+            lines = lines[1:]
+
+        index = [self.header.get(COLUMNS[name]) for name in ('x', 'y', 'power', 'RPM', 'generator_RPM')]
+        rows = []
+        for line in lines:
+            fields = line.split(',')
+            try:
+                rows.append([float(fields[k]) if k is not None and k < len(fields) and fields[k].strip() else np.nan for k in index])
+            except ValueError:
+                continue
+        if not rows:
+            return np.zeros((0, 4))
+
+        rows = np.array(rows)
+        # the turbine RPM, from the generator RPM where it is not logged
+        RPM = np.where(np.isnan(rows[:, 3]), rows[:, 4] / self.gear_ratio, rows[:, 3])
+        data = np.column_stack([rows[:, :3], RPM])
+        return data[~np.isnan(data).any(axis=1)]
+
+    def feed(self, lines):
+        '''
+        process a micro-batch of log lines - returns the predicted power, error (predicted - measured, kW)
+        and drift flag of each sample
+        '''
+        data = self.parse(lines)
+        return self.update(data[:, 0], data[:, 1], data[:, 3], data[:, 2])
+
+    def update(self, x, y, RPM, power):
+        '''
+        add samples of position, turbine RPM and measured power (kW) to the statistics
+        '''
+        n = len(power)
+        if n == 0:
+            return {'predicted': np.zeros(0), 'error': np.zeros(0), 'drift': np.zeros(0, dtype=bool)}
+
+        predicted = self.predict(x, y, RPM)
+        error = predicted - power
+
+        # the rolling window (only the last window samples of a large batch matter)
+        size = len(self.window_error)
+        slots = (self.n + np.arange(n)) % size
+        self.window_error[slots[-size:]] = error[-size:]
+        self.window_measured[slots[-size:]] = power[-size:]
+
+        # the drift statistic is the relative error, so a change of operating point is not a drift
+        with np.errstate(divide='ignore', invalid='ignore'):
+            relative = np.where(predicted > 0, error / predicted, 0)
+
+        drift = np.zeros(n, dtype=bool)
+        i = 0
+        while i < n:
+            if self.ref_mean is None:
+                # the reference period
+                take = min(self.reference - self.n_ref, n - i)
+                self.ref_sum += np.sum(relative[i:i + take])
+                self.ref_sq += np.sum(relative[i:i + take]**2)
+                self.n_ref += take
+                i += take
+                if self.n_ref == self.reference:
+                    self.ref_mean = self.ref_sum / self.reference
+                    self.ref_sd = max(np.sqrt(max(self.ref_sq / self.reference - self.ref_mean**2, 0)), 1e-9)
+                continue
+
+            # the CUSUM is sequential - the rest of the batch is scanned at once up to the first alarm
+            z = (relative[i:] - self.ref_mean) / self.ref_sd
+            high = _cusum(self.cusum_high, z - self.slack)
+            low = _cusum(self.cusum_low, -z - self.slack)
+            alarm = np.nonzero((high > self.threshold) | (low > self.threshold))[0]
+            if not len(alarm):
+                self.cusum_high, self.cusum_low = high[-1], low[-1]
+                break
+
+            # flag the drift, then take a new reference so a lasting change is only flagged once
+            k = alarm[0]
+            drift[i + k] = True
+            self.events.append({'sample': self.n + i + k, 'direction': 'high' if high[k] > self.threshold else 'low',
+                                'reference_mean': self.ref_mean})
+            self.cusum_high = self.cusum_low = 0.0
+            self.ref_sum = self.ref_sq = 0.0
+            self.n_ref = 0
+            self.ref_mean = self.ref_sd = None
+            i += k + 1
+
+        self.n += n
+        return {'predicted': predicted, 'error': error, 'drift': drift}
+
+    def stats(self):
+        '''
+        the rolling error statistics over the window, the reference, the CUSUM and the drift events
+        '''
+        filled = min(self.n, len(self.window_error))
+        error = self.window_error[:filled]
+        measured = self.window_measured[:filled]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            relative = np.abs(error) / np.abs(measured)
+
+        return {
+            'samples': self.n,
+            'mean_error': np.mean(error) if filled else np.nan,
+            'rmse': np.sqrt(np.mean(error**2)) if filled else np.nan,
+            'mape': 100 * np.mean(relative[np.isfinite(relative)]) if filled else np.nan,
+            'reference_mean': self.ref_mean,
+            'reference_sd': self.ref_sd,
+            'cusum_high': self.cusum_high,
+            'cusum_low': self.cusum_low,
+            'drift_events': list(self.events),
+        }
+
+
+def _cusum(start, increments):
+    '''
+    the one-sided CUSUM s_i = max(0, s_(i-1) + increment_i) of a batch - the running sum minus its running
+    minimum (including the start) gives the same sequence without a python loop
+    '''
+    total = start + np.cumsum(increments)
+    return total - np.minimum(np.minimum.accumulate(total), 0)
+
+
+def file_batches(path, max_batch=5000, poll=0.05, idle_timeout=None):
+    '''
+    yield lists of the complete lines appended to a log file (the first list starts with the header), waiting
+    poll seconds when there are none - stops after idle_timeout seconds without new lines, if given. A file
+    that shrinks (rotated or truncated) is read again from its start.
+    '''
+    while not os.path.exists(path):
+        time.sleep(poll)
+
+    f = open(path, 'r', newline='')
+    partial = ''
+    idle_since = time.time()
+    try:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                if os.path.getsize(path) < f.tell():
+                    f.seek(0)
+                    partial = ''
+                    continue
+                if idle_timeout is not None and time.time() - idle_since > idle_timeout:
+                    return
+                time.sleep(poll)
+                continue
+
+            idle_since = time.time()
+            lines = (partial + chunk).split('\n')
+            # the last piece is an incomplete line until its newline is written
+            partial = lines.pop()
+            lines = [line for line in lines if line.strip()]
+            for i in range(0, len(lines), max_batch):
+                yield lines[i:i + max_batch]
+    finally:
+        f.close()
+
+
+def socket_batches(address, max_batch=5000, timeout=None):
+    '''
+    yield lists of the complete lines read from a local socket - a path for a unix socket or (host, port)
+    for TCP - until the other end closes it or nothing arrives for timeout seconds
+    '''
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.connect(address)
+        sock.settimeout(timeout)
+        partial = b''
+        while True:
+            try:
+                chunk = sock.recv(1 << 20)
+            except socket.timeout:
+                return
+            if not chunk:
+                return
+
+            lines = (partial + chunk).split(b'\n')
+            partial = lines.pop()
+            lines = [line.decode() for line in lines if line.strip()]
+            for i in range(0, len(lines), max_batch):
+                yield lines[i:i + max_batch]
+
+
+def monitor_stream(batches, monitor, on_batch=None):
+    '''
+    feed every micro-batch of lines to the monitor, calling on_batch(result, monitor) after each - returns
+    the monitor statistics when the source ends
+    '''
+    for lines in batches:
+        result = monitor.feed(lines)
+        if on_batch is not None:
+            on_batch(result, monitor)
+    return monitor.stats()
+
+
+if __name__ == "__main__":
+    import tempfile
+    import threading
+    import warnings
+    from river_class import river_obj
+
+    warnings.filterwarnings('ignore')
+
+    # the test rig of testData.csv
+    river = river_obj(width=0.77, depth=0.3, velocity=1.5, head=1)
+    geometry = {'radius': 0.585, 'width': 1.008, 'num_blades': 6}
+
+    # a synthetic log at the test rig positions - the turbine loses 15% of its power part way through
+    rate, seconds = 10000, 20
+    rng = np.random.default_rng(0)
+    n = rate * seconds
+    x = np.repeat([0.65, 0.73], n // 2)
+    y = np.repeat([0.14, 0.04], n // 2)
+    RPM = 14.5 + rng.normal(0, 0.3, n)
+    model = telemetry_monitor(river, geometry).predict(x, y, RPM)
+    power = model * 0.9 * (1 + rng.normal(0, 0.03, n))
+    power[int(0.7 * n):] *= 0.85
+
+    path = os.path.join(tempfile.gettempdir(), 'telemetry_demo.csv')
+    with open(path, 'w') as f:
+        f.write(','.join(COLUMNS[name] for name in ('x', 'y', 'power', 'RPM', 'generator_RPM')) + '\n')
+
+    def logger():
+        # append a second of samples at a time, as the logger would
+        for s in range(seconds):
+            rows = slice(s * rate, (s + 1) * rate)
+            lines = ['%.2f,%.2f,%.5f,%.3f,%.1f\n' % row for row in zip(x[rows], y[rows], power[rows], RPM[rows], GEAR_RATIO * RPM[rows])]
+            with open(path, 'a') as f:
+                f.writelines(lines)
+            time.sleep(1)
+
+    writer = threading.Thread(target=logger)
+    writer.start()
+
+    busy = [0.0]
+    monitor = telemetry_monitor(river, geometry)
+
+    def timed(batches):
+        # the time spent processing, as opposed to waiting for the log
+        for lines in batches:
+            t = time.time()
+            yield lines
+            busy[0] += time.time() - t
+
+    stats = monitor_stream(timed(file_batches(path, idle_timeout=2)), monitor)
+    writer.join()
+
+    print('%d samples logged at %d/s over %d s - processing took %.2f s (%.0f samples/s on one core)'
+          % (stats['samples'], rate, seconds, busy[0], stats['samples'] / busy[0]))
+    print('rolling error: mean %.4f kW, rmse %.4f kW, MAPE %.1f%%' % (stats['mean_error'], stats['rmse'], stats['mape']))
+    print('drift flagged at samples', [int(event['sample']) for event in stats['drift_events']], '(the power drops at %d)' % int(0.7 * n))
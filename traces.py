@@ -0,0 +1,198 @@
+'''
+This module records structured convergence traces of the optimisers. Each iteration of an optimiser
+emits an event with the best power and parameters so far, the number of evaluations, the wall time of
+the iteration and the cache hits, and the events are streamed to a JSONL file (one JSON object per line).
+The events are buffered and written in blocks so tracing adds little to the run time.
+
+A trace can be attached to breastTurbine.optimise, pareto.pareto_front and user_interface.optimise_turbine
+with their trace argument, or wrapped around any objective (swarm_objective wraps a pyswarms cost
+function, which is called once per iteration with the whole swarm).
+
+Parameters:
+----------------
+    path - string: the JSONL file the events are appended to
+    run - string: a name for the run, so several runs can share a file
+    buffer - int: the number of events held before they are written
+
+Methods:
+----------------
+    trace_writer - records evaluations and emits an event per iteration
+    read_trace - reads the events of a trace file
+    summarise - summarises the convergence and throughput of each run in a trace file
+
+Returns:
+----------------
+    events - dict: run, iteration, best_power, best_params, evaluations, iteration_time, wall_time,
+                cache_hits and rejects (if known) for each iteration
+
+'''
+
+# imports
+import json
+import time
+import uuid
+import numpy as np
+
+
+class trace_writer():
+    # constructor
+    def __init__(self, path, run=None, buffer=64):
+        self.path = path
+        self.run = run if run is not None else uuid.uuid4().hex[:8]
+        self.buffer = buffer
+        self.lines = []
+
+        self.iteration = 0
+        self.evaluations = 0
+        self.best_power = -np.inf
+        self.best_params = None
+
+        # the clock starts at the first evaluation, so setting up the optimiser is not counted
+        self.start = self.last = None
+
+    def evaluated(self, params, power, n=1):
+        '''
+        record n evaluations, params and power are those of the best of them
+        '''
+        if self.start is None:
+            self.start = self.last = time.perf_counter()
+        self.evaluations += n
+        if power > self.best_power:
+            self.best_power = float(power)
+            self.best_params = [float(p) for p in np.ravel(params)]
+        return 0
+
+    def iteration_done(self, cache_hits=None, **extra):
+        '''
+        emit the event for the iteration that has just finished
+        '''
+        now = time.perf_counter()
+        if self.start is None:
+            self.start = self.last = now
+        event = {
+            'run': self.run,
+            'iteration': self.iteration,
+            'best_power': self.best_power if np.isfinite(self.best_power) else None,
+            'best_params': self.best_params,
+            'evaluations': self.evaluations,
+            'iteration_time': now - self.last,
+            'wall_time': now - self.start,
+        }
+        if cache_hits is not None:
+            event['cache_hits'] = int(cache_hits)
+        event.update(extra)
+
+        self.iteration += 1
+        self.last = now
+
+        self.lines.append(json.dumps(event))
+        if len(self.lines) >= self.buffer:
+            self.flush()
+        return 0
+
+    def callback(self, cache_hits=None, **counters):
+        '''
+        a scipy.optimize callback that emits an event each iteration - cache_hits and any other counters
+        (e.g. rejects) are optional functions returning the current counts
+        '''
+        def callback(*args, **kwargs):
+            extra = {name: int(counter()) for name, counter in counters.items()}
+            self.iteration_done(cache_hits=None if cache_hits is None else cache_hits(), **extra)
+        return callback
+
+    def objective(self, fun, sign=-1):
+        '''
+        wrap an objective so each evaluation is recorded - the power is sign * the objective (the
+        objectives are minimised negative powers)
+        '''
+        def wrapped(params, *args, **kwargs):
+            value = fun(params, *args, **kwargs)
+            self.evaluated(params, sign * value)
+            return value
+        return wrapped
+
+    def swarm_objective(self, fun, sign=-1, cache_hits=None):
+        '''
+        wrap a swarm cost function f(X) -> costs, X having a row per particle - each call is an iteration
+        of the swarm
+        '''
+        def wrapped(X, *args, **kwargs):
+            costs = np.asarray(fun(X, *args, **kwargs))
+            best = np.argmax(sign * costs)
+            self.evaluated(X[best], sign * costs[best], n=len(costs))
+            self.iteration_done(cache_hits=None if cache_hits is None else cache_hits())
+            return costs
+        return wrapped
+
+    def flush(self):
+        # append the buffered events to the file
+        if self.lines:
+            with open(self.path, 'a') as f:
+                f.write('\n'.join(self.lines) + '\n')
+            self.lines = []
+        return 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+def read_trace(path):
+    # read the events of a trace file one at a time
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def summarise(path, target=0.99):
+    '''
+    summarise each run in the trace file - its final best power, the iteration and evaluations at which
+    target * the final best power was first reached, the evaluation throughput, the mean iteration time
+    and the cache hits per evaluation
+    '''
+    runs = {}
+    for event in read_trace(path):
+        runs.setdefault(event['run'], []).append(event)
+
+    summary = {}
+    for run, events in runs.items():
+        best = np.array([e['best_power'] if e['best_power'] is not None else np.nan for e in events], dtype=float)
+        evaluations = np.array([e['evaluations'] for e in events])
+        final = best[-1]
+
+        reached = np.nonzero(best >= target * final)[0] if np.isfinite(final) else []
+        k = reached[0] if len(reached) else len(events) - 1
+
+        wall_time = events[-1]['wall_time']
+        hits = events[-1].get('cache_hits')
+
+        summary[run] = {
+            'iterations': len(events),
+            'evaluations': int(evaluations[-1]),
+            'best_power': final,
+            'best_params': events[-1]['best_params'],
+            'iterations_to_target': int(k) + 1,
+            'evaluations_to_target': int(evaluations[k]),
+            'wall_time': wall_time,
+            'evaluations_per_s': evaluations[-1] / wall_time if wall_time > 0 else np.nan,
+            'mean_iteration_time': float(np.mean([e['iteration_time'] for e in events])),
+            'cache_hits_per_evaluation': hits / evaluations[-1] if hits is not None and evaluations[-1] else None,
+            'rejects': events[-1].get('rejects'),
+        }
+
+    return summary
+
+
+if __name__ == "__main__":
+    import sys
+
+    # summarise a trace file
+    for run, s in summarise(sys.argv[1]).items():
+        print('%s: %d iterations, %d evaluations, best power %.2f W' % (run, s['iterations'], s['evaluations'], s['best_power']))
+        print('    99%% of best after %d iterations (%d evaluations)' % (s['iterations_to_target'], s['evaluations_to_target']))
+        print('    %.0f evaluations/s, %.2f ms per iteration' % (s['evaluations_per_s'], s['mean_iteration_time'] * 1000))
+        if s['rejects'] is not None:
+            print('    %d positions rejected by the feasibility test' % s['rejects'])
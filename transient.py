@@ -0,0 +1,234 @@
+'''
+This module simulates the rotor in time rather than at a steady RPM, to show start-up, stalls and the
+response to flow pulses. The rotor speed is integrated from
+
+    inertia * d(omega)/dt = turbine torque(theta, omega, flow) - load torque(omega) - friction * omega
+
+where the turbine torque at each angle is the per-theta power of the models (full_power, scaled so its
+mean is the model's average power) divided by the angular velocity.
+
+The turbine torque is tabulated once per turbine over the rotor angle, the RPM and the flow (as a multiple
+of the turbine river's flow, the river being scaled as in annual_energy.scaled_river), then every scenario
+is stepped together with a fixed step Euler integrator. The speed step is linearly implicit - the net
+torque is taken at the new speed through its slope with speed (from the table and the load curve) - so the
+step stays stable and settles on the operating point when the time constant inertia / slope is shorter
+than dt, as it is for a light rotor on a stiff generator load. The RPM, torque and power of every scenario
+are streamed to .npy files on disk as the simulation runs.
+
+Parameters:
+----------------
+    turbines - list: a breastTurbine or underTurbine object for each scenario (the same object can be shared)
+    load - object: operating_point.generator_load, or a list with one per scenario
+    inertia - float or array: rotor inertia in kg m^2 of each scenario
+    flow - function: flow(t) gives the flow multiple of each scenario at time t (an array), 1 if not given
+    duration - float: simulated time in s
+    dt - float: time step in s
+    path - string: the directory the results are streamed to, kept in memory if not given
+
+Methods:
+----------------
+    torque_table - tabulates the turbine torque of a turbine over angle, RPM and flow
+    flow_pulse - a flow function with a pulse of flow
+    simulate - simulates every scenario
+
+Returns:
+----------------
+    simulate - dict: time, RPM, torque and power arrays (record, scenario) - memmapped from path if given -
+                and the final RPM and stall flag of each scenario
+
+'''
+
+# imports
+import os
+import numpy as np
+
+from annual_energy import scaled_river
+
+# the RPMs and flow multiples the turbine torque is tabulated at (evenly spaced)
+TABLE_RPM = np.linspace(0.5, 80, 64)
+TABLE_FLOW = np.linspace(0.2, 3, 15)
+
+# a rotor below this RPM after start_up is stalled
+STALL_RPM = 0.5
+
+# the RPM step the load slope is found over
+SLOPE_RPM = 0.01
+
+
+def torque_table(turbine, RPM=TABLE_RPM, flow=TABLE_FLOW):
+    '''
+    the turbine torque in Nm at each flow multiple, RPM and rotor angle - shape (flow, RPM, theta)
+
+    every RPM and flow is one analysis with an array-valued river, the turbine's own river is put back
+    afterwards
+    '''
+    river = turbine.river
+    n_theta = len(turbine.theta)
+    omega = 2 * np.pi * RPM / 60
+
+    try:
+        turbine.river = scaled_river(river, np.asarray(flow, dtype=float))
+        avg_power = np.nan_to_num(turbine.analysis(RPM))
+        if not np.any(avg_power):
+            # not in the river at any flow
+            return np.zeros((len(flow), len(RPM), n_theta))
+
+        # the per-theta power scaled so that its mean over a revolution is the average power
+        full_power = np.nan_to_num(turbine.full_power)
+        mean = np.mean(full_power, axis=-1, keepdims=True)
+        scale = np.divide(avg_power[..., None], mean, out=np.zeros_like(mean), where=mean != 0)
+        table = full_power * scale / omega[:, None, None]
+    finally:
+        turbine.river = river
+
+    # (RPM, flow, theta) to (flow, RPM, theta)
+    return np.ascontiguousarray(table.transpose(1, 0, 2))
+
+
+def flow_pulse(n_scenarios, start, duration, amplitude, base=1):
+    '''
+    a flow function of base flow with a pulse of amplitude (an array with one per scenario, or a value)
+    from start for duration seconds
+    '''
+    amplitude = np.broadcast_to(np.asarray(amplitude, dtype=float), (n_scenarios,))
+
+    def flow(t):
+        return base + amplitude * (start <= t < start + duration)
+    return flow
+
+
+def _interp_index(values, grid):
+    # the lower index on an evenly spaced grid and the weight of the upper point for linear interpolation
+    # (clamped to the grid)
+    x = np.minimum(np.maximum((values - grid[0]) / (grid[1] - grid[0]), 0), len(grid) - 1 - 1e-9)
+    i = x.astype(int)
+    return i, x - i
+
+
+def _open(path, name, shape):
+    # an array for a result, a .npy file memmapped from path when given
+    if path is None:
+        return np.zeros(shape)
+    return np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode='w+', dtype=np.float64, shape=shape)
+
+
+def simulate(turbines, load, inertia=5.0, flow=None, duration=60, dt=0.005, RPM0=0, friction=0.0, record_every=20,
+             start_up=5, path=None, flush_every=1000):
+    '''
+    simulate the rotor of each scenario for duration seconds - RPM, torque and power are recorded every
+    record_every steps (to .npy files in path when given, flushed every flush_every records)
+    '''
+    n = len(turbines)
+    loads = load if isinstance(load, (list, tuple)) else [load] * n
+    inertia = np.broadcast_to(np.asarray(inertia, dtype=float), (n,))
+    friction = np.broadcast_to(np.asarray(friction, dtype=float), (n,))
+
+    # one torque table per distinct turbine, and the scenarios using each load
+    tables, which = [], np.zeros(n, dtype=int)
+    seen = {}
+    for s, turbine in enumerate(turbines):
+        if id(turbine) not in seen:
+            seen[id(turbine)] = len(tables)
+            tables.append(torque_table(turbine))
+        which[s] = seen[id(turbine)]
+    tables = np.array(tables)
+    _, n_flow, n_RPM, n_theta = tables.shape
+
+    # the table is read through flat indices - the four corners of each interpolation in one gather
+    flat = tables.ravel()
+    corners = np.array([0, n_theta, n_RPM * n_theta, (n_RPM + 1) * n_theta])[:, None]
+
+    load_groups = {}
+    for s, l in enumerate(loads):
+        load_groups.setdefault(id(l), (l, []))[1].append(s)
+    load_groups = [(l, np.array(members)) for l, members in load_groups.values()]
+
+    n_steps = int(round(duration / dt))
+    n_records = n_steps // record_every + 1
+    if path is not None:
+        os.makedirs(path, exist_ok=True)
+    results = {name: _open(path, name, (n_records, n)) for name in ('RPM', 'torque', 'power')}
+    results['time'] = _open(path, 'time', (n_records,))
+
+    omega = np.full(n, 2 * np.pi * RPM0 / 60, dtype=float)
+    theta = np.zeros(n)
+    below = np.zeros(n, dtype=bool)
+
+    f, wf = _interp_index(np.ones(n), TABLE_FLOW)
+    d_omega = 2 * np.pi * (TABLE_RPM[1] - TABLE_RPM[0]) / 60
+    for step in range(n_steps + 1):
+        t = step * dt
+        RPM = omega * 60 / (2 * np.pi)
+
+        # bilinear interpolation of the table in flow and RPM at the nearest tabulated angle
+        if flow is not None:
+            f, wf = _interp_index(np.broadcast_to(flow(t), (n,)), TABLE_FLOW)
+        r, wr = _interp_index(RPM, TABLE_RPM)
+        k = np.round(theta * ((n_theta - 1) / (2 * np.pi))).astype(int) % n_theta
+        low, low_r, high, high_r = flat[((which * n_flow + f) * n_RPM + r) * n_theta + k + corners]
+        torque = (1 - wf) * (low + wr * (low_r - low)) + wf * (high + wr * (high_r - high))
+        torque_slope = ((1 - wf) * (low_r - low) + wf * (high_r - high)) / d_omega
+
+        load_torque = np.zeros(n)
+        load_slope = np.zeros(n)
+        for l, members in load_groups:
+            load_torque[members] = l.torque_at(RPM[members])
+            load_slope[members] = (l.torque_at(RPM[members] + SLOPE_RPM) - load_torque[members]) / (2 * np.pi * SLOPE_RPM / 60)
+
+        if step % record_every == 0:
+            i = step // record_every
+            results['time'][i] = t
+            results['RPM'][i] = RPM
+            results['torque'][i] = torque
+            results['power'][i] = torque * omega
+            if path is not None and (i + 1) % flush_every == 0:
+                for name in ('RPM', 'torque', 'power', 'time'):
+                    results[name].flush()
+
+        if t >= start_up:
+            below |= RPM < STALL_RPM
+
+        # linearly implicit Euler in the speed - the net torque is taken at the new speed through its slope,
+        # so a steep load or torque curve (a time constant inertia / slope shorter than dt) settles rather
+        # than overshooting - then the angle with the new speed, the rotor does not reverse
+        stiffness = np.maximum(load_slope + friction - torque_slope, 0)
+        omega = np.maximum(omega + dt * (torque - load_torque - friction * omega) / (inertia + dt * stiffness), 0)
+        theta = (theta + omega * dt) % (2 * np.pi)
+
+    if path is not None:
+        for name in ('RPM', 'torque', 'power', 'time'):
+            results[name].flush()
+
+    results['final_RPM'] = omega * 60 / (2 * np.pi)
+    results['stalled'] = below
+    return results
+
+
+if __name__ == "__main__":
+    import time
+    import tempfile
+    from river_class import river_obj
+    from breastshot_calcs import breastTurbine
+    from operating_point import generator_load
+
+    river = river_obj(width=0.77, depth=0.3, velocity=1.5, head=2)
+    turbine = breastTurbine(river, x_centre=0.8, y_centre=-0.1)
+    load = generator_load(speed=[0, 500], torque=[0, 40], gear_ratio=231.2 / 14.5)
+
+    # 200 scenarios of the same turbine with different inertias and flow pulses, starting from rest
+    n = 200
+    rng = np.random.default_rng(0)
+    inertia = rng.uniform(2, 20, n)
+    flow = flow_pulse(n, start=60, duration=30, amplitude=rng.uniform(-0.8, 1, n))
+
+    path = os.path.join(tempfile.gettempdir(), 'transient_demo')
+    start = time.time()
+    results = simulate([turbine] * n, load, inertia=inertia, flow=flow, duration=180, path=path)
+    print('%d scenarios x %.0f s simulated in %.2f s, written to %s' % (n, results['time'][-1], time.time() - start, path))
+
+    # the rotor speed ripples through each revolution so the mean over the last 10 s before and in the pulse
+    t = results['time']
+    before = results['RPM'][(t >= 50) & (t < 60)].mean(axis=0)
+    during = results['RPM'][(t >= 80) & (t < 90)].mean(axis=0)
+    print('mean RPM before the pulse: %.1f - %.1f, in the pulse: %.1f - %.1f, stalled: %d'
+          % (before.min(), before.max(), during.min(), during.max(), np.sum(results['stalled'])))
@@ -0,0 +1,161 @@
+'''
+This module propagates the uncertainty of the river measurements through the turbine models. The river
+width, depth, velocity and head come from quick field measurements, so rather than a single power the
+turbine is evaluated over samples of the measurements to give a distribution of power.
+
+The samples are drawn in batches (quasi-Monte Carlo from a scrambled Sobol sequence by default) and the
+sampling stops once the confidence intervals on the mean power and on P10/P90 are tight enough.
+
+Parameters:
+----------------
+    turbine - object: breastTurbine or underTurbine object, its river is replaced by each sample in turn
+    measurements - dict: (value, standard deviation) of each of width, depth, velocity and head,
+                    missing measurements are taken from the turbine's river with no uncertainty
+    rtol - float: the confidence interval half-widths, relative to the mean power, to stop at
+    batch - int: the number of samples drawn at a time (a power of 2 for the Sobol sequence)
+    max_samples - int: the maximum number of samples
+    qmc - bool: use a scrambled Sobol sequence rather than pseudo random samples
+
+Methods:
+----------------
+    sample_rivers - draws samples of the river measurements
+    evaluate_samples - evaluates the turbine power for each sample
+    power_distribution - samples until the power distribution has converged
+
+Returns:
+----------------
+    power_distribution - dict: the power samples, mean, P10, P50, P90, their confidence interval
+                        half-widths, the number of samples and whether the sampling converged
+
+'''
+
+# imports
+import numpy as np
+
+from river_class import river_obj
+
+# the river measurements in the order they are sampled
+MEASUREMENTS = ('width', 'depth', 'velocity', 'head')
+
+# the z value of a 95% confidence interval
+Z95 = 1.959963984540054
+
+
+def sample_rivers(measurements, n, qmc=True, seed=None, sampler=None):
+    '''
+    draw n normally distributed samples of each measurement - returns a dict of arrays (width, depth and
+    velocity are kept positive and the head is kept non negative)
+
+    for quasi-Monte Carlo a scipy.stats.qmc.Sobol sampler can be passed in to continue its sequence
+    '''
+    if qmc:
+        from scipy.stats import qmc as scipy_qmc
+        from scipy.special import ndtri
+
+        if sampler is None:
+            sampler = scipy_qmc.Sobol(d=len(MEASUREMENTS), scramble=True, seed=seed)
+        # keep the uniform samples away from 0 and 1 before the inverse normal
+        z = ndtri(np.clip(sampler.random(n), 1e-12, 1 - 1e-12))
+    else:
+        z = np.random.default_rng(seed).standard_normal((n, len(MEASUREMENTS)))
+
+    samples = {}
+    for k, name in enumerate(MEASUREMENTS):
+        value, sd = measurements[name]
+        samples[name] = value + sd * z[:, k]
+
+    for name in ('width', 'depth', 'velocity'):
+        samples[name] = np.maximum(samples[name], 1e-6)
+    samples['head'] = np.maximum(samples['head'], 0)
+
+    return samples
+
+
+def evaluate_samples(turbine, samples):
+    '''
+    evaluate the average power of the turbine for each sample of the river, all samples in one call with an
+    array-valued river - the turbine's own river is put back afterwards
+    '''
+    river = turbine.river
+
+    try:
+        turbine.river = river_obj(samples['width'], samples['depth'], samples['velocity'], head=samples['head'])
+        power = turbine.analysis()
+    finally:
+        turbine.river = river
+
+    return np.nan_to_num(power)
+
+
+def _quantile_ci(power, q):
+    '''
+    the quantile of the power and the half-width of its 95% confidence interval, from the order statistics
+    either side of it (the binomial approximation)
+    '''
+    n = len(power)
+    ordered = np.sort(power)
+    spread = Z95 * np.sqrt(n * q * (1 - q))
+    lo = ordered[max(int(np.floor(n * q - spread)), 0)]
+    hi = ordered[min(int(np.ceil(n * q + spread)), n - 1)]
+    return np.quantile(power, q), (hi - lo) / 2
+
+
+def power_distribution(turbine, measurements, rtol=0.02, batch=256, max_samples=8192, qmc=True, seed=None):
+    '''
+    sample the river measurements and evaluate the turbine until the 95% confidence intervals on the mean
+    power, P10 and P90 are all within rtol of the mean power (or max_samples is reached)
+    '''
+    river = turbine.river
+    measurements = dict(measurements)
+    for name in MEASUREMENTS:
+        measurements.setdefault(name, (getattr(river, name), 0))
+
+    sampler = None
+    if qmc:
+        from scipy.stats import qmc as scipy_qmc
+        sampler = scipy_qmc.Sobol(d=len(MEASUREMENTS), scramble=True, seed=seed)
+
+    power = np.zeros(0)
+    converged = False
+    while len(power) < max_samples:
+        samples = sample_rivers(measurements, batch, qmc=qmc, seed=None if qmc else (None if seed is None else seed + len(power)), sampler=sampler)
+        power = np.concatenate([power, evaluate_samples(turbine, samples)])
+
+        mean = np.mean(power)
+        mean_ci = Z95 * np.std(power, ddof=1) / np.sqrt(len(power))
+        p10, p10_ci = _quantile_ci(power, 0.1)
+        p90, p90_ci = _quantile_ci(power, 0.9)
+
+        if max(mean_ci, p10_ci, p90_ci) <= rtol * abs(mean):
+            converged = True
+            break
+
+    return {
+        'power': power,
+        'mean': mean,
+        'p10': p10,
+        'p50': np.median(power),
+        'p90': p90,
+        'mean_ci': mean_ci,
+        'p10_ci': p10_ci,
+        'p90_ci': p90_ci,
+        'n': len(power),
+        'converged': converged,
+    }
+
+
+if __name__ == "__main__":
+    import time
+    from breastshot_calcs import breastTurbine
+
+    # the test channel with typical field measurement errors
+    river = river_obj(width=0.77, depth=0.3, velocity=1.5, head=2)
+    turbine = breastTurbine(river, x_centre=0.8, y_centre=-0.1)
+
+    measurements = {'width': (0.77, 0.02), 'depth': (0.3, 0.03), 'velocity': (1.5, 0.15), 'head': (2, 0.05)}
+
+    start = time.time()
+    dist = power_distribution(turbine, measurements, seed=0)
+    print('%d samples in %.2f s (converged: %s)' % (dist['n'], time.time() - start, dist['converged']))
+    print('Mean power: %.1f +/- %.1f W' % (dist['mean'], dist['mean_ci']))
+    print('P10: %.1f +/- %.1f W, P50: %.1f W, P90: %.1f +/- %.1f W' % (dist['p10'], dist['p10_ci'], dist['p50'], dist['p90'], dist['p90_ci']))
@@ -1,9 +1,22 @@
 # import modules
 import numpy as np
-import matplotlib.pyplot as plt
 import math
 
-class underTurbine():
+from stages import staged, superpose_blades
+
+__all__ = ['np', 'math', 'underTurbine']
+
+# matplotlib is only needed for plotting, plt is imported on first use
+_LAZY = {'plt': 'matplotlib.pyplot'}
+
+def __getattr__(name):
+    if name in _LAZY:
+        import importlib
+        return importlib.import_module(_LAZY[name])
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+class underTurbine(staged):
     '''
     This class will contain all the calculations for the undershot turbine
 
@@ -18,20 +31,42 @@ class underTurbine():
     num_blades - int: number of blades on the turbine
     width - float: width of the turbine
     y_centre - float: y coordinate of the centre of the turbine
-    river - object: river object containing the river parameters
+    river - object: river object containing the river parameters (array-valued for many river conditions)
     barrel_radius - float: radius of the barrel
 
     Methods:
+    find_geometry - calculates the coordinates and the river intersection angles of the turbine
+    find_depth_list - calculates the effective depth of the turbine for each theta
     find_eff_depth - calculates the effective depth of the turbine
     find_drag_force - calculates the drag force on the turbine
     find_drag_list - calculates the drag force on the turbine for each theta
     find_power - calculates the power at each theta for a given RPM
+    analysis_blades - the average power for a range of blade counts from one shared evaluation
+    optimise - finds the y_centre and RPM giving the most average power
+
+    The methods are run as stages (see stages.py) - changing an input only re-runs the stages that depend
+    on it the next time analysis is called, e.g. a new RPM re-uses the depths and centre of mass.
+
+    For an array-valued river the results have the river axes after any RPM axes (RPM..., river..., theta),
+    so a fixed turbine is evaluated against every river condition in one call. y_centre can then also be an
+    array of the river's shape, a height for each river condition.
 
     Return:
     force - array: drag force at each theta
     power_list - array: power at each theta for a given RPM
 
     '''
+    # the inputs of the analysis and the stages that depend on them
+    INPUTS = ('river', 'radius', 'barrel_radius', 'width', 'num_blades', 'y_centre', 'drag_coeff', 'RPM')
+    STAGES = {
+        'geometry': ('find_geometry', ('radius', 'barrel_radius', 'width', 'num_blades', 'y_centre')),
+        'depth_list': ('find_depth_list', ('geometry',)),
+        'drag_list': ('find_drag_list', ('depth_list', 'river', 'drag_coeff', 'RPM')),
+        'centre_mass': ('find_centre_mass', ('geometry',)),
+        'power': ('find_power', ('drag_list', 'centre_mass')),
+        'average_power': ('find_average_power', ('power',)),
+    }
+
     # constructor
     def __init__(self,  river, RPM = 15, radius = 0.504, barrel_radius=0.169,  width = 1.008, num_blades = 6,  y_centre = 0, drag_coeff = 2.3):
         self.radius = radius
@@ -41,39 +76,62 @@ class underTurbine():
         self.x_centre = 2
         self.barrel_radius = barrel_radius
 
-        self.max_depth = radius - barrel_radius
-
         self.river = river
         self.g = 9.81
         self.drag_coeff = drag_coeff # from consultancy report
-        self.blade_width = width # from CAD
-
-        self.blade_sep = 2 * np.pi / num_blades
-
-        self.RPM = RPM
-        self.omega = (RPM * 2 * math.pi) / 60 # convert RPM to rad/s
 
         # for drawing
         self.theta = np.linspace(0, 2 * np.pi, 100)
-        self.x = self.radius * np.cos(self.theta) + self.x_centre
-        self.y = self.radius * np.sin(self.theta) + self.y_centre
 
-        # dtheta/dt
-        dtheta = self.theta[1] - self.theta[0]
-        dt = (60/RPM) / len(self.theta)
-        self.dthetadt = dtheta / dt
+        self.set_RPM(RPM)
+        self.run_stage('geometry')
+
+    def find_geometry(self):
+        '''
+        calculate the coordinates of the turbine and the angles it enters and leaves the river
+        '''
+        self.max_depth = self.radius - self.barrel_radius
+        self.blade_width = self.width # from CAD
+
+        self.blade_sep = 2 * np.pi / self.num_blades
+
+        self.x = self.radius * np.cos(self.theta) + self.x_centre
+        self.y = self.radius * np.sin(self.theta) + np.asarray(self.y_centre)[..., None]
 
-        if y_centre < 0:
+        if np.any(np.asarray(self.y_centre) < 0):
             raise ValueError('y_centre must be greater than 0, above the water surface')
 
 
         # depth of turbine below water surface
-        self.sub_depth = y_centre - radius
-        self.unsub_depth = y_centre
+        self.sub_depth = self.y_centre - self.radius
+        self.unsub_depth = self.y_centre
 
         # find the intersection angles of the turbine and the river
-        self.alpha1 = np.arcsin(self.unsub_depth / radius)
+        self.alpha1 = np.arcsin(self.unsub_depth / self.radius)
         self.alpha2 = math.pi - self.alpha1
+        return 0
+
+    def set_RPM(self, RPM):
+        '''
+        set the RPM of the turbine and the RPM dependent angular velocities
+
+        RPM can be an array, the RPM dependent results then have a leading RPM axis
+        '''
+        if not np.isscalar(RPM):
+            RPM = np.asarray(RPM, dtype=float)
+
+        self.RPM = RPM
+        self.omega = (RPM * 2 * math.pi) / 60 # convert RPM to rad/s
+
+        # dtheta/dt
+        dtheta = self.theta[1] - self.theta[0]
+        dt = (60/RPM) / len(self.theta)
+        self.dthetadt = dtheta / dt
+        return 0
+
+    def _rpm_axes(self, value):
+        # an RPM dependent value with axes added for the river conditions and theta
+        return np.reshape(value, np.shape(value) + (1,) * (len(self.river.shape) + 1))
 
     def find_eff_depth(self, theta):
 
@@ -104,26 +162,40 @@ class underTurbine():
         area = self.blade_width * (depth - depth*np.cos(theta)) * np.sin(theta - self.blade_sep)# account for blocking
         return self.river.rho * v**2 * self.drag_coeff * area * self.dthetadt
 
-    def find_drag_list(self):
-        force_list = []
-        
-        for theta in self.theta:
+    def find_depth_list(self):
+        '''
+        calculate the effective depth (as find_eff_depth) at every theta at once
+        '''
+        theta = self.theta
+        y_centre = np.asarray(self.y_centre)[..., None]
 
-            # check if the turbine is submerged
-            if theta < self.alpha1 or theta > self.alpha2:
-                force_list.append(0)
-                continue
-            else:
+        # check if the turbine is submerged
+        submerged = ~((theta < np.asarray(self.alpha1)[..., None]) | (theta > np.asarray(self.alpha2)[..., None]))
 
-                depth = self.find_eff_depth(theta)
+        # the depth below a centre above the barrel radius, else the blade length (for each height)
+        depth = np.where(y_centre >= self.barrel_radius, self.radius * np.sin(theta - np.pi/2) - y_centre,
+                         (self.radius - self.barrel_radius) * np.sin(theta - np.pi/2))
+        depth = np.where(depth > self.max_depth, self.max_depth, depth)
 
-                if depth > 0:
-                    drag = self.find_drag_force(depth, theta)
-                    force_list.append(drag)
-                else:
-                    force_list.append(0)
+        self.depth_list = np.where(submerged, depth, 0)
+        return 0
 
-        self.force_list = np.array(force_list )
+    def find_drag_list(self):
+        '''
+        calculate the drag force at every theta at once, with a leading axis when the RPM is an array and
+        the river axes after it for an array-valued river
+        '''
+        theta = self.theta
+        self.run_stage('depth_list')
+        depth = self.depth_list
+
+        # drag force (as find_drag_force) for each RPM and river condition
+        omega = self._rpm_axes(self.omega)
+        v = np.asarray(self.river.velocity)[..., None] - omega * self.radius * np.sin(theta)
+        area = self.blade_width * (depth - depth*np.cos(theta)) * np.sin(theta - self.blade_sep)# account for blocking
+        drag = self.river.rho * v**2 * self.drag_coeff * area * self._rpm_axes(self.dthetadt)
+
+        self.force_list = np.where(depth > 0, drag, 0)
 
     def find_centre_mass(self):
         '''
@@ -137,30 +209,19 @@ class underTurbine():
         e = 3.19372668997763
 
         # calculate the centre of mass at each theta
-        centre_mass = np.zeros(len(self.theta))
-
-        for i, theta in enumerate(self.theta):
-
-            if theta >= self.alpha1 and theta <= self.alpha2:
-                theta = theta - np.pi/2
+        in_range = (self.theta >= np.asarray(self.alpha1)[..., None]) & (self.theta <= np.asarray(self.alpha2)[..., None])
+        theta = self.theta - np.pi/2
 
-                centre_mass[i] = (a*(theta**4) + b*(theta**3) + c*(theta**2) + d*theta + e)
-            else:
-                centre_mass[i] = 0
+        centre_mass = np.where(in_range, a*(theta**4) + b*(theta**3) + c*(theta**2) + d*theta + e, 0)
 
         self.centre_mass = centre_mass
         return 0
 
     # calculate instantaneous power for each theta for a given RPM
     def find_power(self):
-        power = np.zeros(len(self.theta))
-        for i, force in enumerate(self.force_list):
-            # find the power at each angle
-            p = force * self.omega * self.centre_mass[i] * np.sin(self.theta[i])
-
-            power[i] = p
-
-        self.power_list = power
+        # find the power at each angle
+        omega = self._rpm_axes(self.omega)
+        self.power_list = self.force_list * omega * self.centre_mass * np.sin(self.theta)
 
 
     def find_average_power(self):
@@ -175,41 +236,165 @@ class underTurbine():
         blade_sep_idx = 100 / self.num_blades
 
         # compounding the power output of each blade with offset blade_sep_idx
-        power = np.zeros(len(self.theta))
+        power = np.zeros(np.shape(self.power_list))
         for i in range(self.num_blades):
-            power += np.roll(self.power_list, int(i*blade_sep_idx))
+            power += np.roll(self.power_list, int(i*blade_sep_idx), axis=-1)
 
         # average the power over one revolution
-        avg_power = np.sum(power) / len(power)
+        avg_power = np.sum(power, axis=-1) / power.shape[-1]
 
         self.avg_power = avg_power / self.num_blades
         self.full_power = power
 
         return 0
     
-    def analysis(self):
+    def analysis(self, RPM=None):
+        '''
+        run the analysis for the turbine
+
+        if RPM is given (a value or an array) the turbine is set to it first - for an array of RPMs the
+        submerged depth and centre of mass are found once and the average power is returned for each RPM
+        '''
+        if RPM is not None:
+            self.set_RPM(RPM)
 
-        # set the turbine parameters
-        self.find_drag_list()
-        self.find_centre_mass()
-        self.find_power()
-        self.find_average_power()
+        # run the analysis - only the stages with changed inputs since the last analysis are re-run
+        self.run_stage('average_power')
 
         return self.avg_power
 
+    def analysis_blades(self, blade_counts, RPM=None):
+        '''
+        the average power of the turbine with each number of blades in blade_counts in one evaluation - the
+        depths and centre of mass are shared, only the blocked drag area and the superposition of the blades
+        change, and they are found for every count at once (the result has a leading blade count axis)
+
+        the turbine's own num_blades is unchanged, the next analysis re-runs its drag stages
+        '''
+        counts = np.asarray(blade_counts, dtype=int)
+        if RPM is not None:
+            self.set_RPM(RPM)
+
+        self.run_stage('depth_list')
+        self.run_stage('centre_mass')
+
+        blade_sep = self.blade_sep
+        self.blade_sep = np.reshape(2 * np.pi / counts, counts.shape + (1,) * (np.ndim(self.RPM) + len(self.river.shape) + 1))
+        try:
+            self.find_drag_list()
+            self.find_power()
+            power = superpose_blades(self.power_list, counts)
+        finally:
+            self.blade_sep = blade_sep
+            self.invalidate('depth_list')
+
+        # as find_average_power
+        avg_power = np.sum(power, axis=-1) / power.shape[-1]
+        return avg_power / np.reshape(counts, counts.shape + (1,) * (avg_power.ndim - 1))
+
+    def optimise(self, trace=None, y_tol=1e-3, RPM_tol=0.05, n_grid=9, y_bounds=None):
+        '''
+        Optimise the height of the turbine (y_centre between the barrel radius and the radius) and the RPM
+        to maximise the average power output
+
+        each height is scored by its best RPM - the RPM curve is evaluated on a coarse grid in one call to
+        bracket the best RPM, which is then refined by golden-section search, and the height is found by
+        golden-section search on this score. The RPM is kept below the runaway RPM (blade tip speed equal to
+        the river velocity), above which the drag model no longer holds.
 
+        trace - optional traces.trace_writer recording each iteration of the optimisation
+        y_bounds - optional (min, max) heights to search within (e.g. around a warm start), kept between the
+                    barrel radius and the radius - bounds that do not overlap this range are ignored
+        '''
+        y_lo, y_hi = self.barrel_radius, self.radius
+        if y_bounds is not None:
+            lo, hi = max(y_lo, min(y_bounds)), min(y_hi, max(y_bounds))
+            # a warm start from another wheel can lie outside this one's heights, search them all then
+            if lo < hi:
+                y_lo, y_hi = lo, hi
+
+        RPM_lo = 0.5
+        RPM_hi = max(60 * self.river.velocity / (2 * np.pi * self.radius), RPM_lo + RPM_tol)
+
+        def power_at(y, RPM):
+            # only a new height invalidates the depth stages, the RPM refinement at one height reuses them
+            if y != self.y_centre:
+                self.y_centre = y
+            power = float(np.nan_to_num(self.analysis(RPM)))
+            if trace is not None:
+                trace.evaluated((y, RPM), power)
+            return power
+
+        def best_RPM(y):
+            # bracket the best RPM from the whole curve at the height then refine it
+            if y != self.y_centre:
+                self.y_centre = y
+            grid = np.linspace(RPM_lo, RPM_hi, n_grid)
+            curve = np.nan_to_num(self.analysis(grid))
+            k = np.argmax(curve)
+            if trace is not None:
+                trace.evaluated((y, grid[k]), curve[k], n=n_grid)
+
+            RPM, power = _golden_max(lambda RPM: power_at(y, RPM), grid[max(k - 1, 0)], grid[min(k + 1, n_grid - 1)], RPM_tol)
+            best_RPM.found[y] = RPM
+            return power
+        best_RPM.found = {}
+
+        def score(y):
+            power = best_RPM(y)
+            if trace is not None:
+                trace.iteration_done(cache_hits=self.stage_hits)
+            return power
+
+        y, power = _golden_max(score, y_lo, y_hi, y_tol)
+
+        if trace is not None:
+            trace.flush()
+
+        self.y_centre = y
+        self.set_RPM(best_RPM.found[y])
+
+        # average power at the new height and RPM
+        power = self.analysis()
+
+        # return the optimal power
+        return power
+
+
+def _golden_max(f, lo, hi, tol):
+    '''
+    golden-section search for the maximum of f on [lo, hi] to within tol, the ends are checked as well
+    since the best height is often at a bound - returns the best x and f(x)
+    '''
+    invphi = (np.sqrt(5) - 1) / 2
+
+    a, b = lo, hi
+    c, d = b - invphi * (b - a), a + invphi * (b - a)
+    fc, fd = f(c), f(d)
+    while b - a > tol:
+        if fc >= fd:
+            b, d, fd = d, c, fc
+            c = b - invphi * (b - a)
+            fc = f(c)
+        else:
+            a, c, fc = c, d, fd
+            d = a + invphi * (b - a)
+            fd = f(d)
+
+    return max([(fc, c), (fd, d), (f(lo), lo), (f(hi), hi)])[::-1]
 
 
 if __name__ == "__main__":
 
     # test the class
+    import matplotlib.pyplot as plt
     from river_class import river_obj
 
     river = river_obj(0.77, 0.5, 2, head=0)
 
-    turbine = underTurbine(river)
+    turbine = underTurbine(river, y_centre=0.2, RPM=25)
 
-    turbine.analysis(0.2, 25)
+    turbine.analysis()
 
     # plot the power curve
     plt.figure()
@@ -220,22 +405,12 @@ if __name__ == "__main__":
     plt.ylabel('power')
     plt.show()
 
-    # now vary the RPM
-    RPM = np.linspace(0, 40, 50)
-    power = np.zeros(len(RPM))
-
-    for i, rpm in enumerate(RPM):
-        power[i] = turbine.analysis(0.2, rpm)
+    # now vary the RPM - the whole power curve in one call
+    RPM = np.linspace(0.5, 40, 50)
+    power = turbine.analysis(RPM)
         
     plt.figure()
     plt.plot(RPM, power)
     plt.xlabel('RPM')
     plt.ylabel('power')
     plt.show()
-
-
-
-
-
-
-
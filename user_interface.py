@@ -15,6 +15,13 @@ The user will be asked to input the following:
 The program will then calculate the optimal power output of the turbine and display it to the user with the optimal
 position of the turbine.
 
+The live panel has sliders for the position, RPM and river inputs which redraw the power curve and the turbine
+diagram as they move. The redraws are debounced - while a slider is moving a coarse power curve is drawn and
+once it stops the full curve replaces it - and the curves are cached so returning to earlier inputs is instant.
+The height slider's range and starting value follow the turbine type (an undershot wheel sits above the
+water surface, a breastshot wheel below the weir crest), and a power above what the river carries is
+flagged as outside the model.
+
 
 Parameters:
 ----------------
@@ -35,11 +42,14 @@ Return:
 
 # import modules
 import numpy as np
-import matplotlib.pyplot as plt
-import math
+import time
+import functools
 from breastshot_calcs import breastTurbine
 from undershot_calcs import underTurbine
 from river_class import river_obj
+from optimum_cache import optimum_cache
+from warm_start import warm_start_store
+from evaluation import build_turbine, turbine_power, limited
 
 # import modules for the GUI
 import tkinter as tk
@@ -47,66 +57,65 @@ import tkinter as tk
 # import window for the GUI
 from tkinter import *
 
+# matplotlib (with the TkAgg backend) and scipy are imported where they are used, when the turbine is
+# displayed and optimised, so importing this module stays cheap
+
+# the RPMs of the live power curve - coarse while a slider is moving and fine once it has stopped
+LIVE_RPM = {'coarse': np.linspace(1, 40, 8), 'fine': np.linspace(1, 40, 60)}
 
-# import FigureCanvasTkAgg from matplotlib
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+# the delays (ms) after the last slider movement before the coarse and the fine redraw
+DEBOUNCE_MS = 30
+REFINE_MS = 300
 
+# the live sliders - (label, from, to, resolution, default), the y centre range and default are replaced by
+# those of the turbine type in LIVE_Y_CENTRE
+LIVE_SLIDERS = {
+    'x_centre': ("x centre (m)", 0, 2.5, 0.01, 0.8),
+    'y_centre': ("y centre (m)", -1.5, 1, 0.01, -0.1),
+    'RPM': ("RPM", 1, 40, 0.5, 15),
+    'river_width': ("River width (m)", 0.2, 3, 0.01, 0.77),
+    'river_depth': ("River depth (m)", 0.05, 1.5, 0.01, 0.3),
+    'river_velocity': ("River velocity (m/s)", 0.1, 4, 0.05, 1.5),
+    'head': ("Head (m)", 0, 4, 0.05, 2),
+}
 
-# import optimisation module
-import scipy.optimize as opt
+# the y centre slider (from, to, default) for each turbine type - the undershot centre is above the water
+# surface (between the barrel radius and the radius for the default wheel)
+LIVE_Y_CENTRE = {'breastshot': (-1.5, 1, -0.1), 'undershot': (0, 1, 0.3)}
 
 
 
 # define a function to optimise the turbine
-def optimise_turbine(turbine, river, type):
+def optimise_turbine(turbine, river, type, trace=None, cache=None, warm_start=None):
+    # trace - optional traces.trace_writer recording each iteration of the optimisation
+    # cache - optional optimum_cache.optimum_cache, an optimisation it has already seen is not re-run
+    # warm_start - optional warm_start.warm_start_store, the optimisation starts from the nearest past optima
+
+    def optimise():
+        # the cache is looked up with the unseeded turbine, the warm start only runs on a miss
+        seed = warm_start.seed if warm_start is not None else None
+        if cache is not None:
+            power = cache.optimise(turbine, trace=trace, start=seed)
+        else:
+            power = turbine.optimise(trace=trace, **(seed(turbine) if seed is not None else {}))
+        if warm_start is not None:
+            warm_start.record(turbine, power)
+        return power
 
     if type == "undershot": 
 
-        # first define the function to be optimised
-        def fun(y):
-            # define the power
-            power = turbine.analysis( y , RPM = 15)
-            
-            return -power
-
-        # run the optimisation
-        res = opt.minimize(fun, -0.1, bounds = [(-1, 3)])
+        # optimise the height and RPM of the turbine (bounded golden-section search)
+        power = optimise()
 
-        # reinstantiate the turbine
-        under_turbine = underTurbine(turbine.radius, turbine.width, turbine.num_blades, res.x, river)
-
-        # calculate the power 
-        power = under_turbine.analysis(res.x, RPM = 15)
-        return power, res.x
+        return power, [turbine.y_centre]
     
     elif type == "breastshot":
 
-        # first define the function to be optimised
-        def fun(Y):
-            # unpack the variables
-            x, y = Y
-            # define the power
-            power = turbine.analysis( x, y , RPM = 15)
-            
-            return -power
-
-
-        # define the initial guess
-        x0 = [1, -0.2]
-
-        # run the optimisation
-        res = opt.fmin(fun, x0 )
-
-        # print the results
-        newx, newy = res
-
-        # reinstantiate the turbine
-        turbine = breastTurbine(turbine.radius, turbine.width, turbine.num_blades, newx, newy, river)
-
-        # calculate the power
-        power = turbine.analysis(newx, newy, RPM = 15)
+        # optimise the position of the turbine from a starting guess (or the past optima near it)
+        turbine.x_centre, turbine.y_centre = 1, -0.2
+        power = optimise()
 
-        return power, [newx, newy]
+        return power, [turbine.x_centre, turbine.y_centre]
     
 
 # # define a function to calculate the power output
@@ -126,6 +135,24 @@ def optimise_turbine(turbine, river, type):
 
 #     return power, newy, turbine
 
+@functools.lru_cache(maxsize=2048)
+def live_power(model, river_params, turbine_params, RPM):
+    '''
+    the average power of a turbine at RPM (a float, or a resolution name of LIVE_RPM for the power curve)
+    with the turbine's coordinates for drawing - the parameters are tuples of numbers so earlier results come
+    from the cache, zero power is returned where the turbine can not be placed
+    '''
+    RPMs = LIVE_RPM[RPM] if isinstance(RPM, str) else RPM
+
+    river = river_obj(*river_params)
+    turbine = build_turbine(river, model, **dict(turbine_params))
+    if turbine is None:
+        return np.zeros(np.shape(RPMs)), None, None
+    power = turbine_power(turbine, RPMs, model)
+
+    return power, turbine.x, turbine.y
+
+
 '''
 Create a GUI that will take the users input, calculate the optimal power output and display it to the user and display
 the optimal position of the turbine.
@@ -148,7 +175,7 @@ class GUI(tk.Tk):
 
         # create a frame to hold the widgets
         self.frame = tk.Frame(self, bg = "white")
-        self.frame.pack()
+        self.frame.pack(side = tk.LEFT, anchor = tk.N)
 
         # create a label for the title
         self.title_label = tk.Label(self.frame, text = "Turbine Optimisation", bg = "white", font = ("Arial", 20))
@@ -238,8 +265,158 @@ class GUI(tk.Tk):
         self.position_display = tk.Label(self.frame, text = "", bg = "white", font = ("Arial", 12))
         self.position_display.grid(row = 11, column = 1, pady = 10)
 
+        # the turbine type variable shared by the optimisation and the live panel
+        self.turbine_var = self.turbine_type
+
+        # optimisations are kept on disk between sessions, and past optima seed new ones
+        self.cache = optimum_cache()
+        self.warm_start = warm_start_store()
+
+        # create the live panel
+        self.live_panel()
+
+    def live_panel(self):
+        '''
+        create the sliders and the live power curve and turbine diagram
+        '''
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        self.live_frame = tk.Frame(self, bg = "white")
+        self.live_frame.pack(side = tk.LEFT, fill = tk.BOTH, expand = True)
+
+        # create a slider for each live input - moving one schedules a redraw
+        self.sliders = {}
+        for i, (name, (label, lo, hi, step, default)) in enumerate(LIVE_SLIDERS.items()):
+            if name == "y_centre":
+                lo, hi, default = LIVE_Y_CENTRE[self.turbine_var.get()]
+            slider = tk.Scale(self.live_frame, label = label, from_ = lo, to = hi, resolution = step, orient = tk.HORIZONTAL,
+                              length = 220, bg = "white", command = self.slider_moved)
+            slider.set(default)
+            slider.grid(row = i // 2, column = i % 2, padx = 5)
+            self.sliders[name] = slider
+        self.turbine_var.trace_add("write", lambda *args: self.model_changed())
+
+        # create a label for the live power and the redraw time
+        self.live_display = tk.Label(self.live_frame, text = "", bg = "white", font = ("Arial", 12))
+        self.live_display.grid(row = 4, column = 0, columnspan = 2, pady = 5)
+
+        # the figure with the power curve and the turbine diagram - the lines are animated, so they are
+        # drawn over a saved background (blitted) rather than redrawing the whole figure
+        self.live_fig = Figure(figsize = (5, 6))
+        self.curve_ax, self.diagram_ax = self.live_fig.subplots(2, 1)
+        self.curve_line, = self.curve_ax.plot([], [], "b.-", animated = True)
+        self.point_line, = self.curve_ax.plot([], [], "ro", animated = True)
+        self.curve_ax.set_xlim(0, 41)
+        self.curve_ax.set_ylim(0, 1)
+        self.curve_ax.set_xlabel("RPM")
+        self.curve_ax.set_ylabel("Average power (W)")
+
+        self.turbine_line, = self.diagram_ax.plot([], [], "r-", animated = True)
+        self.centre_line, = self.diagram_ax.plot([], [], "ro", animated = True)
+        self.river_line, = self.diagram_ax.plot([], [], "b-", animated = True)
+        self.live_lines = [self.curve_line, self.point_line, self.turbine_line, self.centre_line, self.river_line]
+        self.diagram_ax.set_xlim(0, 4)
+        self.diagram_ax.set_ylim(-2, 2)
+        self.diagram_ax.set_aspect("equal")
+        self.diagram_ax.set_xlabel("x (m)")
+        self.diagram_ax.set_ylabel("y (m)")
+        self.live_fig.tight_layout()
+
+        self.live_canvas = FigureCanvasTkAgg(self.live_fig, self.live_frame)
+        self.live_canvas.get_tk_widget().grid(row = 5, column = 0, columnspan = 2)
+        self.background = None
+
+        self.pending = []
+        self.update_live("fine")
+
+    def model_changed(self):
+        # a new turbine type moves the y centre slider to its range and default, then redraws
+        lo, hi, default = LIVE_Y_CENTRE[self.turbine_var.get()]
+        self.sliders["y_centre"].config(from_ = lo, to = hi)
+        self.sliders["y_centre"].set(default)
+        self.slider_moved()
+
+    def slider_moved(self, *args):
+        # debounce - cancel the scheduled redraws and schedule a coarse and then a fine redraw
+        for job in self.pending:
+            self.after_cancel(job)
+        self.pending = [self.after(DEBOUNCE_MS, self.update_live, "coarse"), self.after(REFINE_MS, self.update_live, "fine")]
+
+    def live_inputs(self):
+        # the model, river and turbine parameters of the live panel as hashable tuples
+        values = {name: float(slider.get()) for name, slider in self.sliders.items()}
+        model = self.turbine_var.get()
+
+        def entry(box, default):
+            try:
+                return float(box.get())
+            except ValueError:
+                return default
+
+        geometry = (("radius", entry(self.radius_entry, 0.504)), ("width", entry(self.width_entry, 1.008)),
+                    ("num_blades", int(entry(self.num_blades_entry, 6))))
+        if model == "undershot":
+            position = (("y_centre", values["y_centre"]),)
+            river = (values["river_width"], values["river_depth"], values["river_velocity"], 0)
+        else:
+            position = (("x_centre", values["x_centre"]), ("y_centre", values["y_centre"]))
+            river = (values["river_width"], values["river_depth"], values["river_velocity"], values["head"])
+
+        return model, river, geometry + position, values["RPM"]
+
+    def update_live(self, resolution):
+        '''
+        redraw the power curve (at the coarse or fine resolution) and the turbine diagram
+        '''
+        start = time.perf_counter()
+        model, river, turbine, RPM = self.live_inputs()
+
+        curve, x, y = live_power(model, river, turbine, resolution)
+        power, _, _ = live_power(model, river, turbine, RPM)
+
+        self.curve_line.set_data(LIVE_RPM[resolution], curve)
+        self.point_line.set_data([RPM], [power])
+
+        if x is not None:
+            self.turbine_line.set_data(x, y)
+            self.centre_line.set_data([np.mean(x)], [np.mean(y)])
+        else:
+            self.turbine_line.set_data([], [])
+            self.centre_line.set_data([], [])
+
+        stream = river_obj(*river)
+        if model == "undershot":
+            self.river_line.set_data([0, 4], [0, 0])
+        else:
+            self.river_line.set_data(stream.x_nappe, stream.y_nappe)
+
+        # the whole figure is only redrawn when the power axis has to change - it grows as soon as the
+        # power goes off the top and shrinks on the fine redraw
+        top = max(np.max(curve), power, 1) * 1.1
+        current = self.curve_ax.get_ylim()[1]
+        if self.background is None or top > current or (resolution == "fine" and top < 0.5 * current):
+            self.curve_ax.set_ylim(0, top)
+            self.live_canvas.draw()
+            self.background = self.live_canvas.copy_from_bbox(self.live_fig.bbox)
+
+        self.live_canvas.restore_region(self.background)
+        for line in self.live_lines:
+            line.axes.draw_artist(line)
+        self.live_canvas.blit(self.live_fig.bbox)
+
+        # the model is outside its range where it gives more than the river carries
+        note = " - above the river's hydraulic power" if limited(power, stream, model) else ""
+        self.live_display.config(text = "%.1f W at %.1f RPM%s (%s, %.0f ms)" % (power, RPM, note, resolution, (time.perf_counter() - start) * 1000))
+        return 0
+
         
     def display_turbine(self):
+        import matplotlib.pyplot as plt
+
+        # import FigureCanvasTkAgg from matplotlib
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
         # get the values from the return from calc_power
         turbine = self.turbine
 
@@ -253,9 +430,9 @@ class GUI(tk.Tk):
         ax.plot(turbine.x, turbine.y, "r-")
 
         # plot the river
-        if self.turbine_type == "undershot":
+        if isinstance(turbine, underTurbine):
             ax.plot([0,4],[-turbine.river.depth, -turbine.river.depth], "b-")
-        elif self.turbine_type == "breastshot":
+        elif isinstance(turbine, breastTurbine):
             ax.plot(turbine.river.x_nappe,turbine.river.y_nappe, "b-")
 
         ax.set_xlim(0 , 4)
@@ -280,7 +457,7 @@ class GUI(tk.Tk):
         radius = float(self.radius_entry.get())
         width = float(self.width_entry.get())
         num_blades = int(self.num_blades_entry.get())
-        turbine_type = self.turbine_type.get()
+        turbine_type = self.turbine_var.get()
         river_width = float(self.river_width_entry.get())
         river_depth = float(self.river_depth_entry.get())
         river_velocity = float(self.river_velocity_entry.get())
@@ -288,29 +465,21 @@ class GUI(tk.Tk):
         # create a river object
         river = river_obj(river_width, river_depth, river_velocity)
 
-        self.turbine_type = turbine_type
-
         if turbine_type == "undershot":
 
             # create a turbine object
-            turbine = underTurbine(radius, width, num_blades, 0, river)
+            turbine = underTurbine(river, radius=radius, width=width, num_blades=num_blades)
 
             # calculate the optimal position of the turbine
-            power , y_opt = optimise_turbine(turbine, river, turbine_type)
-
-            # re-create the turbine object with the optimal position
-            turbine = underTurbine(radius, width, num_blades, y_opt, river)
+            power , y_opt = optimise_turbine(turbine, river, turbine_type, cache = self.cache, warm_start = self.warm_start)
 
         elif turbine_type == "breastshot":
                 
             # create a turbine object
-            turbine = breastTurbine(radius, width, num_blades, 0, 0, river)
+            turbine = breastTurbine(river, radius=radius, width=width, num_blades=num_blades)
 
             # calculate the optimal position of the turbine
-            power , y_opt = optimise_turbine(turbine, river, turbine_type)
-
-            # re-create the turbine object with the optimal position
-            turbine = breastTurbine(radius, width, num_blades, y_opt[0], y_opt[1], river)
+            power , y_opt = optimise_turbine(turbine, river, turbine_type, cache = self.cache, warm_start = self.warm_start)
 
         # store the optimal position
         self.y_opt = y_opt
@@ -335,8 +504,7 @@ class GUI(tk.Tk):
 if __name__ == "__main__":
     root = GUI()
     root.title("Turbine Optimisation")
-    root.geometry("500x500")
-    root.resizable(False, False)
+    # no fixed size, the window fits the entry form and the live panel
     root.configure(bg = "white")
     root.mainloop()
 
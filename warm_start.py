@@ -0,0 +1,277 @@
+'''
+This module keeps every optimum found in a growing on-disk store, so a new optimisation can start from the
+optima of the most similar rivers and turbines already solved rather than from a fixed guess. The cases are
+matched by their normalised river and geometry features with a KD-tree.
+
+Each model has its own append-only file of fixed-size float64 records (river, geometry, optimum, power), so
+records from other processes are picked up by reading the end of the file. New records are searched by
+brute force until there are enough of them to be worth rebuilding the KD-tree (about the square root of the
+records already in it), which keeps adding a record cheap and a query a fraction of a millisecond.
+
+Unlike optimum_cache.py the records are not tied to the model version - an optimum from an older model is
+still a good place to start.
+
+Parameters:
+----------------
+    path - string: the store directory, created if needed
+    model - string: 'breastshot' or 'undershot'
+    k - int: the number of neighbours used
+
+Methods:
+----------------
+    warm_start_store - the store
+        add / record - store an optimum (record takes it from a turbine at its optimum)
+        nearest - the nearest stored cases to a river (and geometry)
+        seed - starts a turbine from the optima of its nearest cases before it is optimised
+        optimise - a warm started turbine.optimise(), whose result is stored
+        swarm_init - swarm starting positions from the designs of the nearest rivers
+
+Returns:
+----------------
+    nearest - dict: an array of each record column of the neighbours, nearest first, and their distances
+
+'''
+
+# imports
+import os
+import numpy as np
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'pico_stream', 'warm_start')
+
+# the river columns of every record, then the geometry held fixed by the optimiser and the optimum it finds
+RIVER = ('river_width', 'river_depth', 'river_velocity', 'river_head')
+MODELS = {
+    'breastshot': {'geometry': ('radius', 'width', 'num_blades', 'RPM'), 'solution': ('x_centre', 'y_centre')},
+    'undershot': {'geometry': ('radius', 'barrel_radius', 'width', 'num_blades'), 'solution': ('y_centre', 'RPM')},
+}
+
+# the typical size of each feature, features are divided by these before measuring distances
+SCALES = {'river_width': 1.0, 'river_depth': 0.3, 'river_velocity': 1.0, 'river_head': 1.0,
+          'radius': 0.5, 'barrel_radius': 0.2, 'width': 1.0, 'num_blades': 6, 'RPM': 20}
+
+# the fewest new records that trigger a rebuild of the KD-tree
+REBUILD_MIN = 32
+
+# an undershot search is only narrowed around neighbours this close (in normalised features)
+MAX_DISTANCE = 0.5
+
+
+def _columns(model):
+    return RIVER + MODELS[model]['geometry'] + MODELS[model]['solution'] + ('power',)
+
+
+def _model(turbine):
+    return 'undershot' if type(turbine).__name__ == 'underTurbine' else 'breastshot'
+
+
+class warm_start_store():
+    '''
+    The store of past optima and its nearest neighbour index.
+
+    Parameters:
+    ----------------
+        path - string: the store directory
+    '''
+    def __init__(self, path=None):
+        self.path = path if path is not None else DEFAULT_PATH
+        os.makedirs(self.path, exist_ok=True)
+
+        # the records of each model, and the KD-tree of each model and feature set with the records it holds
+        self.records = {}
+        self.trees = {}
+
+    def _file(self, model):
+        return os.path.join(self.path, model + '.f64')
+
+    def _refresh(self, model):
+        # read any whole records appended to the model's file since it was last read
+        n_columns = len(_columns(model))
+        records = self.records.get(model, np.zeros((0, n_columns)))
+        try:
+            n = os.path.getsize(self._file(model)) // (8 * n_columns)
+        except FileNotFoundError:
+            n = 0
+
+        if n > len(records):
+            new = np.fromfile(self._file(model), dtype='<f8', count=(n - len(records)) * n_columns,
+                              offset=len(records) * 8 * n_columns)
+            records = np.vstack([records, new.reshape(-1, n_columns)])
+            self.records[model] = records
+        return records
+
+    def add(self, model, river, geometry, solution, power):
+        '''
+        store an optimum - geometry and solution are dicts of the model's geometry and optimum columns
+        '''
+        row = [river.width, river.depth, river.velocity, river.head]
+        row += [geometry[name] for name in MODELS[model]['geometry']]
+        row += [solution[name] for name in MODELS[model]['solution']]
+        row.append(power)
+
+        # one small append, so records written by concurrent processes are not interleaved
+        with open(self._file(model), 'ab') as f:
+            f.write(np.asarray(row, dtype='<f8').tobytes())
+        return 0
+
+    def record(self, turbine, power):
+        '''
+        store the optimum of a turbine that has just been optimised, unless the same case is already stored
+        '''
+        model = _model(turbine)
+        geometry = {name: getattr(turbine, name) for name in MODELS[model]['geometry']}
+        solution = {name: getattr(turbine, name) for name in MODELS[model]['solution']}
+
+        nearest = self.nearest(model, turbine.river, geometry, k=1)
+        if len(nearest['distance']) and nearest['distance'][0] == 0 and \
+                all(np.isclose(nearest[name][0], value) for name, value in solution.items()):
+            return 0
+        return self.add(model, turbine.river, geometry, solution, float(np.nan_to_num(power)))
+
+    def _tree(self, model, names, records):
+        # the KD-tree over the feature columns, rebuilt once enough records have been added since the last build
+        from scipy.spatial import cKDTree
+
+        columns = [_columns(model).index(name) for name in names]
+        tree, n_built = self.trees.get((model, names), (None, 0))
+        if tree is None or len(records) - n_built > max(REBUILD_MIN, np.sqrt(n_built)):
+            n_built = len(records)
+            tree = cKDTree(records[:, columns] / [SCALES[name] for name in names])
+            self.trees[model, names] = (tree, n_built)
+        return tree, n_built, columns
+
+    def nearest(self, model, river, geometry=None, k=5):
+        '''
+        the k stored cases nearest the river (and the geometry, a dict of the model's geometry columns, if
+        given) - nearest first
+        '''
+        records = self._refresh(model)
+        names = RIVER + (MODELS[model]['geometry'] if geometry is not None else ())
+        values = [river.width, river.depth, river.velocity, river.head]
+        if geometry is not None:
+            values += [geometry[name] for name in MODELS[model]['geometry']]
+        features = np.array(values, dtype=float) / [SCALES[name] for name in names]
+
+        index, distance = np.zeros(0, dtype=int), np.zeros(0)
+        if len(records):
+            tree, n_built, columns = self._tree(model, names, records)
+
+            # the tree, then the records added since it was built by brute force
+            if n_built:
+                d, i = tree.query(features, k=min(k, n_built))
+                index, distance = np.atleast_1d(i), np.atleast_1d(d)
+            new = records[n_built:, columns] / [SCALES[name] for name in names]
+            index = np.concatenate([index, n_built + np.arange(len(new))])
+            distance = np.concatenate([distance, np.linalg.norm(new - features, axis=1)])
+
+            order = np.argsort(distance, kind='stable')[:k]
+            index, distance = index[order], distance[order]
+
+        result = {name: records[index, c] for c, name in enumerate(_columns(model))}
+        result['distance'] = distance
+        return result
+
+    def seed(self, turbine, k=5):
+        '''
+        start the turbine from its nearest stored cases - a breastshot turbine is moved to whichever of the
+        neighbours' positions (and its own) gives it the most power, an undershot search is narrowed to the
+        heights of the close neighbours - and return any settings for turbine.optimise (empty if there is
+        nothing to start from)
+        '''
+        model = _model(turbine)
+        geometry = {name: getattr(turbine, name) for name in MODELS[model]['geometry']}
+        nearest = self.nearest(model, turbine.river, geometry, k=k)
+        if not len(nearest['distance']):
+            return {}
+
+        if model == 'breastshot':
+            # one analysis per candidate start is far cheaper than an optimisation from a poor one
+            starts = [(turbine.x_centre, turbine.y_centre)] + list(zip(nearest['x_centre'], nearest['y_centre']))
+            power = []
+            for turbine.x_centre, turbine.y_centre in starts:
+                power.append(float(np.nan_to_num(turbine.analysis())))
+            turbine.x_centre, turbine.y_centre = starts[int(np.argmax(power))]
+            return {}
+
+        y = nearest['y_centre'][nearest['distance'] <= MAX_DISTANCE]
+        if not len(y):
+            return {}
+        pad = 0.1 * (turbine.radius - turbine.barrel_radius)
+        return {'y_bounds': (y.min() - pad, y.max() + pad)}
+
+    def optimise(self, turbine, k=5, **kwargs):
+        '''
+        turbine.optimise(**kwargs) started from the nearest stored cases, the optimum is stored - returns the
+        optimum power
+        '''
+        kwargs.update(self.seed(turbine, k=k))
+        power = turbine.optimise(**kwargs)
+        self.record(turbine, power)
+        return power
+
+    def swarm_init(self, model, river, names, bounds, n_particles, seed=None):
+        '''
+        swarm starting positions (a row per particle, a column per name in names) - up to half the swarm
+        starts at the designs of the nearest stored rivers, the rest uniformly within bounds ((min...), (max...))
+        '''
+        lo, hi = np.asarray(bounds[0], dtype=float), np.asarray(bounds[1], dtype=float)
+        init = lo + np.random.default_rng(seed).random((n_particles, len(names))) * (hi - lo)
+
+        nearest = self.nearest(model, river, k=n_particles // 2)
+        n = len(nearest['distance'])
+        if n:
+            init[:n] = np.clip(np.column_stack([nearest[name] for name in names]), lo, hi)
+        return init
+
+
+if __name__ == "__main__":
+    import time
+    import tempfile
+    import warnings
+    from river_class import river_obj
+    from breastshot_calcs import breastTurbine
+
+    warnings.filterwarnings('ignore')
+    path = os.path.join(tempfile.gettempdir(), 'warm_start_demo')
+    for name in MODELS:
+        if os.path.exists(os.path.join(path, name + '.f64')):
+            os.remove(os.path.join(path, name + '.f64'))
+    store = warm_start_store(path)
+    rng = np.random.default_rng(0)
+
+    def random_river():
+        return river_obj(rng.uniform(0.6, 1.0), rng.uniform(0.2, 0.4), rng.uniform(1, 2), head=rng.uniform(1.5, 2.5))
+
+    # past optimisations of similar rivers, started from the usual guess
+    for _ in range(40):
+        turbine = breastTurbine(random_river(), x_centre=1, y_centre=-0.2)
+        store.record(turbine, turbine.optimise())
+
+    # new rivers started from the guess and from the store
+    cold = warm = 0
+    cold_power, warm_power = [], []
+    for _ in range(10):
+        river = random_river()
+        turbine = breastTurbine(river, x_centre=1, y_centre=-0.2)
+        start = time.time()
+        cold_power.append(turbine.optimise())
+        cold += time.time() - start
+
+        turbine = breastTurbine(river, x_centre=1, y_centre=-0.2)
+        start = time.time()
+        warm_power.append(store.optimise(turbine))
+        warm += time.time() - start
+    print('10 new rivers - from the guess: %.0f W mean in %.2f s, warm started: %.0f W mean in %.2f s'
+          % (np.mean(cold_power), cold, np.mean(warm_power), warm))
+
+    # query time with many stored cases
+    for _ in range(10000):
+        store.add('breastshot', random_river(), {'radius': 0.504, 'width': 1.008, 'num_blades': 6, 'RPM': 15},
+                  {'x_centre': 1, 'y_centre': -0.2}, 0)
+    start = time.time()
+    store.nearest('breastshot', river, {'radius': 0.504, 'width': 1.008, 'num_blades': 6, 'RPM': 15})
+    build = time.time() - start
+    start = time.time()
+    for _ in range(100):
+        store.nearest('breastshot', random_river(), {'radius': 0.504, 'width': 1.008, 'num_blades': 6, 'RPM': 15})
+    print('%d stored cases - first query (with the tree build) %.2f ms, then %.3f ms per query'
+          % (len(store.records['breastshot']), 1000 * build, 10 * (time.time() - start)))